@@ -0,0 +1,262 @@
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+from multiprocessing import Pool
+
+import generator_competition as generator
+from level_binary import open_level_batch, read_batch_level, close_level_batch
+
+# analyses existing levels (xml files, gzipped xml files or binary level batches) without regenerating them
+# each level is parsed back into the generator's internal representation and the reachability/vulnerability analyses are run,
+# giving one json record of metrics per level (python analyze_levels.py levels/ --workers 8 --output metrics.jsonl)
+#
+# the level xml written by the generator (and read by Science-Birds) is not well formed (Camera/Slingshot are never closed),
+# so objects are found by scanning for their tags rather than with an xml parser
+# angled platforms are kept but, as during generation, not used by the analyses
+
+object_tag = re.compile(r'<(Block|Pig|TNT|Platform|Bird)\s([^>]*?)/?>')
+object_attribute = re.compile(r'(\w+)\s*=\s*"([^"]*)"')
+
+rotated_blocks = (3,7,9,11,13)      # block numbers that are their block names rotated 90 degrees
+
+
+
+
+# finds the block number for a block name and rotation (None if the block isn't one the generator uses)
+
+def find_block_number(name, rotation):
+    rotated = (round(rotation) % 180) == 90
+    for key,value in generator.block_names.items():
+        if value == name:
+            if (int(key) in rotated_blocks) == rotated or generator.blocks[key][0] == generator.blocks[key][1]:
+                return int(key)
+    return None
+
+
+
+
+# reads level text from an xml or gzipped xml file (levels declare utf-16 but are usually written as utf-8)
+
+def read_level_text(path):
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rb')
+    else:
+        f = open(path, 'rb')
+    data = f.read()
+    f.close()
+    if data[0:2] == b'\xff\xfe' or data[0:2] == b'\xfe\xff':
+        return data.decode('utf-16')
+    return data.decode('utf-8-sig')
+
+
+
+
+# parses level xml back into the form returned by generate_level (blocks and pigs are given new object ids)
+# objects the generator never creates (eg. blocks rotated at other angles) are counted as unsupported and left out
+
+def parse_level_xml(level_text):
+    material_numbers = {}
+    for key,value in generator.materials.items():
+        material_numbers[value] = int(key)
+    other_shapes = {}
+    for key,value in generator.additional_objects.items():
+        other_shapes[value] = key
+    bird_numbers = {}
+    for key,value in generator.bird_types_index.items():
+        bird_numbers[value] = int(key)
+
+    level = {'blocks':[], 'materials':[], 'others':[], 'other_materials':[], 'pigs':[], 'tnt':[], 'platforms':[[]],
+             'angled_platforms':[], 'number_birds':0, 'bird_order':[], 'unsupported':0}
+
+    for tag, attribute_text in object_tag.findall(level_text):
+        attributes = dict(object_attribute.findall(attribute_text))
+        if tag == 'Bird':
+            if attributes.get('type') in bird_numbers:
+                level['bird_order'].append(bird_numbers[attributes['type']])
+            else:
+                level['unsupported'] = level['unsupported'] + 1
+            continue
+
+        x = float(attributes.get('x', 0))
+        y = float(attributes.get('y', 0))
+        rotation = float(attributes.get('rotation', 0))
+
+        if tag == 'Block':
+            name = attributes.get('type')
+            material = attributes.get('material')
+            if name in other_shapes:
+                level['others'].append([other_shapes[name], x, y])
+                level['other_materials'].append([material, attributes.get('rotation', '0')])
+                continue
+            block_number = find_block_number(name, rotation)
+            if block_number == None or material not in material_numbers:
+                level['unsupported'] = level['unsupported'] + 1
+                continue
+            level['blocks'].append([block_number, x, y, generator.new_object_id()])
+            level['materials'].append(material_numbers[material])
+        elif tag == 'Pig':
+            level['pigs'].append([x, y, generator.new_object_id()])
+        elif tag == 'TNT':
+            level['tnt'].append([x, y])
+        elif tag == 'Platform':
+            if 'scaleX' in attributes or rotation != 0:
+                level['angled_platforms'].append([x, y, rotation, float(attributes.get('scaleX', 1))])
+            else:
+                level['platforms'][0].append([x, y])
+
+    level['number_birds'] = len(level['bird_order'])
+    return level
+
+
+
+
+# gives the blocks and pigs of a level loaded from a binary batch new object ids
+
+def add_object_ids(level):
+    for block in level['blocks']:
+        block.append(generator.new_object_id())
+    for pig in level['pigs']:
+        pig.append(generator.new_object_id())
+    level['unsupported'] = 0
+    return level
+
+
+
+
+# runs the reachability and vulnerability analyses on the level, returning its metrics
+
+def analyze_level(level):
+    complete_locations = [level['blocks']]
+    final_pig_positions = level['pigs']
+    selected_other = level['others']
+    final_platforms = level['platforms']
+
+    reachable_ids = set()
+    for block in generator.find_reachable_blocks(complete_locations, final_pig_positions, selected_other, final_platforms):
+        reachable_ids.add(generator.object_id(block))
+    vulnerable_blocks = generator.find_vulnerable_blocks(complete_locations, final_pig_positions, selected_other, final_platforms)
+
+    hittable_ids = set()
+    for pig in generator.find_hittable_pigs(complete_locations, final_pig_positions, selected_other, final_platforms):
+        hittable_ids.add(generator.object_id(pig))
+    unprotected_ids = set()
+    for pig in generator.find_unprotected_pigs(complete_locations, final_pig_positions, selected_other, final_platforms):
+        unprotected_ids.add(generator.object_id(pig))
+
+    # fewest blocks in the way of any shot reaching each pig
+    fewest_in_way = {}
+    for pig, blocks_in_way in generator.find_blocks_in_way(complete_locations, final_pig_positions, selected_other, final_platforms):
+        in_way_ids = set([generator.object_id(block) for block in blocks_in_way])
+        if generator.object_id(pig) not in fewest_in_way or len(in_way_ids) < fewest_in_way[generator.object_id(pig)]:
+            fewest_in_way[generator.object_id(pig)] = len(in_way_ids)
+    mean_blocks_in_way = None
+    if len(fewest_in_way) > 0:
+        mean_blocks_in_way = sum(fewest_in_way.values())/float(len(fewest_in_way))
+
+    material_counts = {}
+    for value in generator.materials.values():
+        material_counts[value] = 0
+    for material in level['materials']:
+        material_counts[generator.materials[str(material)]] = material_counts[generator.materials[str(material)]] + 1
+
+    number_platforms = 0
+    for platform_set in final_platforms:
+        number_platforms = number_platforms + len(platform_set)
+
+    return {'blocks':len(level['blocks']), 'additional_blocks':len(level['others']), 'pigs':len(final_pig_positions),
+            'tnt':len(level['tnt']), 'platforms':number_platforms, 'angled_platforms':len(level['angled_platforms']),
+            'birds':level['number_birds'], 'unsupported_objects':level['unsupported'],
+            'wood':material_counts['wood'], 'ice':material_counts['ice'], 'stone':material_counts['stone'],
+            'reachable_blocks':len(reachable_ids), 'vulnerable_blocks':len(vulnerable_blocks),
+            'hittable_pigs':len(hittable_ids), 'protected_pigs':len(final_pig_positions)-len(hittable_ids),
+            'unprotected_pigs':len(unprotected_ids), 'reachable_pigs_through_blocks':len(fewest_in_way),
+            'mean_blocks_in_way':mean_blocks_in_way}
+
+
+
+
+# analyses one task ([path] for xml files, [path, n] for level n of a binary batch), returning its metrics record
+
+def analyze_task(task):
+    record = {'path':task[0]}
+    try:
+        if len(task) == 1:
+            level = parse_level_xml(read_level_text(task[0]))
+            record['name'] = os.path.basename(task[0])
+        else:
+            batch = open_level_batch(task[0])
+            level, name = read_batch_level(batch, task[1])
+            close_level_batch(batch)
+            level = add_object_ids(level)
+            record['name'] = name
+            record['index'] = task[1]
+        record.update(analyze_level(level))
+    except Exception as error:
+        record['error'] = repr(error)
+    return record
+
+
+
+
+# expands the given paths (xml files, binary batches, directories or glob patterns) into analysis tasks
+
+def find_tasks(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = files + sorted(glob.glob(os.path.join(path, 'level-*.xml')) + glob.glob(os.path.join(path, 'level-*.xml.gz')))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            files = files + sorted(glob.glob(path))
+
+    tasks = []
+    for path in files:
+        if path.endswith('.xml') or path.endswith('.xml.gz'):
+            tasks.append([path])
+        else:
+            batch = open_level_batch(path)
+            for n in range(len(batch['offsets'])):
+                tasks.append([path, n])
+            close_level_batch(batch)
+    return tasks
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse existing Science-Birds levels (xml or binary batches) and write per-level metrics as json lines.")
+    parser.add_argument("paths", nargs="+", help="level files, binary level batches, directories (level-*.xml) or glob patterns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--output", default=None, help="file the metrics are written to (default: standard output)")
+    args = parser.parse_args()
+
+    tasks = find_tasks(args.paths)
+    if args.output == None:
+        out = sys.stdout
+    else:
+        out = open(args.output, 'w')
+
+    if args.workers > 1 and len(tasks) > 1:
+        pool = Pool(args.workers)
+        records = pool.imap(analyze_task, tasks)
+    else:
+        pool = None
+        records = map(analyze_task, tasks)
+    for record in records:
+        out.write(json.dumps(record) + '\n')
+    if pool != None:
+        pool.close()
+        pool.join()
+
+    if out != sys.stdout:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
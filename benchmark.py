@@ -0,0 +1,455 @@
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+from copy import deepcopy
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# reproducible benchmark of level generation
+# each scenario (a parameters file plus fixed numbers of ground structures/platforms) is generated for a fixed set of seeds,
+# every seed in a fresh process (so module state and peak memory start clean), recording:
+#   the time per stage (from level_stats), end to end levels per second, peak memory (max resident set size)
+#   and a sha256 digest of every generated level
+# results can be saved as a baseline and later runs compared against it:
+#   levels per second (and each stage's time) must be within the tolerance and every level must be identical
+#
+# --check-engines instead runs each scenario under the reference and the optimised engine settings and compares the outputs
+#
+# python benchmark.py --save-baseline baseline.json
+# python benchmark.py --baseline baseline.json --tolerance 0.15
+# python benchmark.py --check-engines
+
+scenarios = {
+    'many_pigs':          {'parameters':'\n8,10\n30\n', 'ground_structures':3, 'platforms':2},
+    'restricted_blocks':  {'parameters':'wood SquareHole,ice SquareHole,stone SquareHole,wood RectBig,ice RectBig,stone RectBig,'
+                                        'wood Circle,ice Circle,ice Triangle,stone RectFat,wood RectTiny\n3,5\n30\n',
+                           'ground_structures':3, 'platforms':2},
+    'few_structures':     {'parameters':'\n2,3\n30\n', 'ground_structures':2, 'platforms':0},
+    'many_platforms':     {'parameters':'\n3,5\n30\n', 'ground_structures':2, 'platforms':6}}
+
+default_seeds = [1, 2, 3]
+default_levels = 2          # levels generated per seed
+default_tolerance = 0.15    # allowed fractional slow down before a result counts as a regression
+
+# reference and optimised engine settings (generator settings, plus writer_threads for the background level writers)
+# 'levels': the generated levels must be identical
+# 'reachability': the optimised engine is meant to give different levels, so instead every level geometry the reachability queries see
+#   is recorded and both engines are run on it, and the objects found by the one that should contain the other must all be found by it
+#   (polyline trajectories count everything crossed by the line segment where they first hit something, while analytic trajectories
+#   find only what the shots' parabolas touch first, and adaptive sampling finds everything any shot between -pi/2 and pi/2 hits first)
+#   where it misses some, it is run again with the 'refined' settings (if given) and only objects it still misses count as mismatches
+#   (a polyline segment can clip the corner of an object the parabola passes just above, hiding what is behind it, which shorter
+#   segments, following the parabola more closely, don't)
+# 'draws': the samplers must choose the same item as walking the probability table for every random number
+engine_checks = {
+    'writer_threads':    {'compare':'levels', 'reference':{'writer_threads':0}, 'optimised':{'writer_threads':2}},
+    'trajectory_method': {'compare':'reachability', 'contains':'reference',
+                          'reference':{'trajectory_method':'polyline', 'shot_sampling':'fixed'},
+                          'optimised':{'trajectory_method':'analytic', 'shot_sampling':'fixed'},
+                          'refined':{'trajectory_accuracy':0.05}},
+    'shot_sampling':     {'compare':'reachability', 'contains':'optimised',
+                          'reference':{'trajectory_method':'analytic', 'shot_sampling':'fixed'},
+                          'optimised':{'trajectory_method':'analytic', 'shot_sampling':'adaptive'}},
+    'samplers':          {'compare':'draws', 'reference':{}, 'optimised':{}}}
+
+reachability_queries = ['find_reachable_blocks', 'find_unprotected_pigs', 'find_hittable_pigs', 'find_blocks_in_way']
+
+
+
+
+# generates the levels of one scenario for one seed (run in its own process), returning its timings, peak memory and level digests
+# settings (if given) are set in the generator first, with writer_threads > 0 writing the levels from that many background threads
+
+def run_scenario(scenario_name, seed, number_levels, settings={}):
+    scenario = scenarios[scenario_name]
+    work_directory = tempfile.mkdtemp(prefix='benchmark-')
+    parameters_file = os.path.join(work_directory, 'parameters.txt')
+    f = open(parameters_file, 'w')
+    f.write(str(number_levels) + '\n' + scenario['parameters'])
+    f.close()
+
+    import generator_competition as generator
+    from level_sinks import open_sink, close_sink, start_writer, stop_writer
+    from level_stats import enable_stage_timing, disable_stage_timing
+
+    random.seed(seed)
+    generator.number_ground_structures = scenario['ground_structures']
+    generator.number_platforms = scenario['platforms']
+    generator.output_sink = open_sink('directory', work_directory)
+    writer_threads = 0
+    for name,value in settings.items():
+        if name == 'writer_threads':
+            writer_threads = value
+        else:
+            setattr(generator, name, value)
+
+    stage_records = io.StringIO()
+    enable_stage_timing(stage_records)
+    start = perf_counter()
+    writer = None
+    if writer_threads > 0:
+        writer = start_writer(generator.output_sink, generator.serialize_level, writer_threads)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator.generate_levels(parameters_file, writer)
+    finally:
+        if writer != None:
+            stop_writer(writer)
+    seconds = perf_counter() - start
+    disable_stage_timing()
+    close_sink(generator.output_sink)
+
+    stages = {}
+    for line in stage_records.getvalue().splitlines():
+        for name,value in json.loads(line)['stages'].items():
+            stages[name] = stages.get(name, 0.0) + value
+
+    digests = {}
+    for name in sorted(os.listdir(work_directory)):
+        if name.startswith('level-'):
+            f = open(os.path.join(work_directory, name), 'rb')
+            digests['%d/%s' % (seed, name)] = hashlib.sha256(f.read()).hexdigest()
+            f.close()
+            os.remove(os.path.join(work_directory, name))
+    os.remove(parameters_file)
+    os.rmdir(work_directory)
+
+    peak_memory = None
+    if resource != None:
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss      # kilobytes on linux
+    return {'seconds':seconds, 'levels':len(digests), 'stages':stages, 'peak_memory_kb':peak_memory, 'digests':digests}
+
+
+
+
+# runs every seed of the scenario (each in a fresh process) and combines the results
+
+def benchmark_scenario(scenario_name, seeds, number_levels, settings={}):
+    result = {'seconds':0.0, 'levels':0, 'stages':{}, 'peak_memory_kb':None, 'digests':{}}
+    for seed in seeds:
+        seed_result = run_in_fresh_process(run_scenario, (scenario_name, seed, number_levels, settings))
+        result['seconds'] = result['seconds'] + seed_result['seconds']
+        result['levels'] = result['levels'] + seed_result['levels']
+        for name,value in seed_result['stages'].items():
+            result['stages'][name] = result['stages'].get(name, 0.0) + value
+        if seed_result['peak_memory_kb'] != None:
+            result['peak_memory_kb'] = max(result['peak_memory_kb'] or 0, seed_result['peak_memory_kb'])
+        result['digests'].update(seed_result['digests'])
+    result['levels_per_second'] = result['levels']/result['seconds']
+    return result
+
+def run_in_fresh_process(function, args):
+    pool = multiprocessing.get_context('spawn').Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+
+
+# compares the results with the baseline, returning a list of problems (slower than the tolerance allows or different levels)
+# and a list of stages that were slower than the tolerance allows (reported only, as single stages are noisier than the whole run)
+
+def compare_with_baseline(results, baseline, tolerance):
+    problems = []
+    slower_stages = []
+    for scenario_name,result in results['scenarios'].items():
+        if scenario_name not in baseline['scenarios']:
+            continue
+        base = baseline['scenarios'][scenario_name]
+
+        if result['levels_per_second'] < base['levels_per_second']*(1.0-tolerance):
+            problems.append("%s: %.3f levels/sec, baseline %.3f" % (scenario_name, result['levels_per_second'], base['levels_per_second']))
+        for name,value in result['stages'].items():
+            if name in base['stages'] and value > base['stages'][name]*(1.0+tolerance) and value - base['stages'][name] > 0.01:
+                slower_stages.append("%s: stage %s took %.3fs, baseline %.3fs" % (scenario_name, name, value, base['stages'][name]))
+
+        for level,digest in base['digests'].items():
+            if level not in result['digests']:
+                problems.append("%s: level %s was not generated" % (scenario_name, level))
+            elif result['digests'][level] != digest:
+                problems.append("%s: level %s differs from the baseline" % (scenario_name, level))
+    return problems, slower_stages
+
+
+
+
+# checks the per stage memory accounting (--memory) on stages with a known allocation, returning a list of problems
+# a stage keeping memory must report it as allocated (and within its peak), and the stages after it must not be charged for the accounting itself
+
+def check_memory_accounting():
+    import level_stats
+    output = io.StringIO()
+    level_stats.enable_memory_tracing(output)
+    level_stats.start_level_record()
+    kept = []
+    for i in range(3):
+        kept.append(level_stats.timed_stage('allocate', lambda: [[j] for j in range(2000)]))
+        level_stats.timed_stage('nothing', lambda: None)
+    level_stats.finish_level_record('memory-check')
+    level_stats.disable_memory_tracing()
+    stages = json.loads(output.getvalue().splitlines()[0])['stages']
+
+    problems = []
+    expected = 3*2000*sys.getsizeof([0])
+    if stages['allocate']['allocated'] < expected:
+        problems.append("allocate stage reported %d bytes allocated, expected at least %d" % (stages['allocate']['allocated'], expected))
+    if stages['allocate']['peak'] < stages['allocate']['allocated']/3:
+        problems.append("allocate stage reported a peak of %d bytes" % stages['allocate']['peak'])
+    for name,stage in stages.items():
+        if name != 'allocate' and abs(stage['allocated']) > 1024:
+            problems.append("stage %s reported %d bytes allocated, expected about 0" % (name, stage['allocated']))
+    return problems
+
+
+
+
+# runs every engine check on the scenarios (each seed in a fresh process), printing a summary of each comparison
+# and returning a list of problems (levels that differ, objects missing from the engine that should find them, or sampler mismatches)
+
+def check_engines(scenario_names, seeds, number_levels):
+    problems = []
+    for check_name,check in sorted(engine_checks.items()):
+        for scenario_name in scenario_names:
+            if check['compare'] == 'levels':
+                reference = benchmark_scenario(scenario_name, seeds, number_levels, check['reference'])
+                optimised = benchmark_scenario(scenario_name, seeds, number_levels, check['optimised'])
+                different = 0
+                for level,digest in sorted(reference['digests'].items()):
+                    if optimised['digests'].get(level) != digest:
+                        different = different + 1
+                        problems.append("%s %s: level %s differs between %s and %s" % (check_name, scenario_name, level,
+                                        describe_settings(check['reference']), describe_settings(check['optimised'])))
+                print("%-18s %-18s %3d levels, %d different" % (check_name, scenario_name, len(reference['digests']), different))
+
+            elif check['compare'] == 'reachability':
+                geometries = 0
+                differences = {}
+                for name in reachability_queries:
+                    differences[name] = {'reference':0, 'optimised':0, 'missed':0}
+                for seed in seeds:
+                    result = run_in_fresh_process(run_reachability_check, (scenario_name, seed, number_levels, check_name))
+                    geometries = geometries + result['geometries']
+                    for name in reachability_queries:
+                        for count in ('reference', 'optimised', 'missed'):
+                            differences[name][count] = differences[name][count] + result['differences'][name][count]
+                print("%-18s %-18s %3d geometries, objects found only by %s / only by %s (still missed after refining)" % (check_name,
+                      scenario_name, geometries, describe_settings(check['reference']), describe_settings(check['optimised'])))
+                for name in reachability_queries:
+                    print("    %-34s %4d / %d (%d)" % (name, differences[name]['reference'], differences[name]['optimised'], differences[name]['missed']))
+                    if differences[name]['missed'] > 0:
+                        problems.append("%s %s: %s found %d objects that %s did not" % (check_name, scenario_name, name, differences[name]['missed'],
+                                        describe_settings(dict(check[check['contains']], **check.get('refined', {})))))
+
+            else:
+                draws = 0
+                for seed in seeds:
+                    result = run_in_fresh_process(run_draws_check, (scenario_name, seed, number_levels))
+                    draws = draws + result['draws']
+                    for mismatch in result['mismatches']:
+                        problems.append("%s %s: %s" % (check_name, scenario_name, mismatch))
+                print("%-18s %-18s %6d draws checked" % (check_name, scenario_name, draws))
+    return problems
+
+
+
+
+def describe_settings(settings):
+    return ' '.join(["%s=%s" % (name, value) for name,value in sorted(settings.items())]) or 'defaults'
+
+
+
+
+# generates the levels of one scenario for one seed (run in its own process) with the optimised settings of the check,
+# recording every level geometry the reachability queries are asked about, then runs each query on each geometry with both settings
+# returns the number of geometries and, for each query, the number of objects found only by the reference and only by the optimised settings,
+# and the number the side that should contain the other still misses with the refined settings
+
+def run_reachability_check(scenario_name, seed, number_levels, check_name):
+    import generator_competition as generator
+    check = engine_checks[check_name]
+    queries = {}
+    geometries = {}
+    for name in reachability_queries:
+        queries[name] = getattr(generator, name)
+        setattr(generator, name, recording_query(queries[name], geometries))
+    try:
+        run_scenario(scenario_name, seed, number_levels, check['optimised'])
+    finally:
+        for name in reachability_queries:
+            setattr(generator, name, queries[name])
+
+    default_settings = {}           # the generator's own values of every setting the check changes
+    for side in ('reference', 'optimised', 'refined'):
+        for setting in check.get(side, {}):
+            default_settings[setting] = getattr(generator, setting)
+    other = 'optimised'
+    if check['contains'] == 'optimised':
+        other = 'reference'
+
+    differences = {}
+    for name in reachability_queries:
+        differences[name] = {'reference':0, 'optimised':0, 'missed':0}
+    for geometry in geometries.values():
+        for name in reachability_queries:
+            found = {}
+            for side in ('reference', 'optimised'):
+                found[side] = run_query(generator, queries[name], name, geometry, dict(default_settings, **check[side]))
+            differences[name]['reference'] = differences[name]['reference'] + len(found['reference'] - found['optimised'])
+            differences[name]['optimised'] = differences[name]['optimised'] + len(found['optimised'] - found['reference'])
+            missed = found[other] - found[check['contains']]
+            if missed != set() and 'refined' in check:
+                missed = missed - run_query(generator, queries[name], name, geometry, dict(default_settings, **dict(check[check['contains']], **check['refined'])))
+            differences[name]['missed'] = differences[name]['missed'] + len(missed)
+    return {'geometries':len(geometries), 'differences':differences}
+
+# runs the query on a copy of the geometry with the given generator settings, returning the ids of the objects it found
+
+def run_query(generator, query, name, geometry, settings):
+    for setting,value in settings.items():
+        setattr(generator, setting, value)
+    return query_objects(name, query(*deepcopy(geometry)))
+
+# wraps a reachability query so that a copy of every distinct geometry it is called with is kept (later stages change the lists)
+
+def recording_query(query, geometries):
+    def recorded_query(*geometry):
+        key = repr(geometry)
+        if key not in geometries:
+            geometries[key] = deepcopy(geometry)
+        return query(*geometry)
+    return recorded_query
+
+# the ids of the objects a query found (pig and block id pairs for find_blocks_in_way)
+
+def query_objects(name, result):
+    from generator_competition import object_id
+    if name == 'find_blocks_in_way':
+        return set([(object_id(pig), object_id(block)) for pig,blocks_in_way in result for block in blocks_in_way])
+    return set([object_id(item) for item in result])
+
+
+
+
+# generates the levels of one scenario for one seed (run in its own process), so that the block table is restricted as the scenario asks,
+# then checks that each sampler chooses the same item as walking its probability table, for random numbers from the seed and for
+# the numbers either side of each cumulative probability, returning the number of draws checked and the mismatches
+
+def run_draws_check(scenario_name, seed, number_levels):
+    import generator_competition as generator
+    run_scenario(scenario_name, seed, number_levels)
+    tables = {'blocks':[generator.probability_table_blocks, generator.block_sampler],
+              'materials':[generator.probability_table_materials, generator.material_sampler],
+              'trajectory materials':[generator.probability_table_materials_trajectory, generator.material_trajectory_sampler]}
+    numbers = [random.uniform(0.0,1.0) for i in range(10000)]
+
+    draws = 0
+    mismatches = []
+    uniform = generator.uniform
+    try:
+        for table_name,(probability_table,sampler) in sorted(tables.items()):
+            edges = []
+            for total in sampler['cumulative']:
+                edges = edges + [math.nextafter(total, 0.0), total, math.nextafter(total, 2.0)]
+            for number in numbers + edges:
+                expected = walk_probability_table(probability_table, number)
+                if expected == None:
+                    continue
+                generator.uniform = lambda low, high: number
+                chosen = generator.sample_item(sampler)
+                draws = draws + 1
+                if chosen != expected:
+                    mismatches.append("%s sampler chose %d for %r, walking the table chooses %d" % (table_name, chosen, number, expected))
+    finally:
+        generator.uniform = uniform
+    return {'draws':draws, 'mismatches':mismatches}
+
+# chooses an item by walking the probability table, as the generator did before it used samplers (None past the end of the table)
+
+def walk_probability_table(probability_table, number):
+    selected_num = 0
+    while number > 0:
+        selected_num = selected_num + 1
+        if str(selected_num) not in probability_table:
+            return None
+        number = number - probability_table[str(selected_num)]
+    return selected_num
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark level generation on fixed seeds and compare against a baseline.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(scenarios.keys()), default=sorted(scenarios.keys()), help="scenarios to run")
+    parser.add_argument("--seeds", nargs="+", type=int, default=default_seeds, help="random seeds generated for each scenario")
+    parser.add_argument("--levels", type=int, default=default_levels, help="levels generated per seed")
+    parser.add_argument("--baseline", default=None, help="baseline json to compare against")
+    parser.add_argument("--tolerance", type=float, default=default_tolerance, help="allowed fractional slow down compared with the baseline")
+    parser.add_argument("--save-baseline", default=None, help="file the results are saved to (as a baseline for later runs)")
+    parser.add_argument("--check-memory", action="store_true", help="only check that per stage memory accounting reports known allocations")
+    parser.add_argument("--check-engines", action="store_true", help="only run the scenarios under the reference and optimised engine settings and compare them")
+    args = parser.parse_args()
+
+    if args.check_memory:
+        problems = check_memory_accounting()
+        for problem in problems:
+            print("MEMORY ACCOUNTING " + problem)
+        if problems != []:
+            sys.exit(1)
+        print("memory accounting ok")
+        return
+
+    if args.check_engines:
+        problems = check_engines(args.scenarios, args.seeds, args.levels)
+        for problem in problems:
+            print("ENGINE MISMATCH " + problem)
+        if problems != []:
+            sys.exit(1)
+        print("engines ok")
+        return
+
+    results = {'config':{'seeds':args.seeds, 'levels':args.levels}, 'scenarios':{}}
+    for scenario_name in args.scenarios:
+        result = benchmark_scenario(scenario_name, args.seeds, args.levels)
+        results['scenarios'][scenario_name] = result
+        print("%-18s %3d levels  %8.2fs  %6.3f levels/sec  peak memory %s KB" % (scenario_name, result['levels'], result['seconds'],
+                                                                                 result['levels_per_second'], result['peak_memory_kb']))
+        for name,value in sorted(result['stages'].items(), key=lambda x: -x[1]):
+            print("    %-34s %8.3fs" % (name, value))
+
+    if args.save_baseline != None:
+        f = open(args.save_baseline, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+
+    if args.baseline != None:
+        f = open(args.baseline, 'r')
+        baseline = json.load(f)
+        f.close()
+        problems, slower_stages = compare_with_baseline(results, baseline, args.tolerance)
+        for stage in slower_stages:
+            print("slower " + stage)
+        for problem in problems:
+            print("REGRESSION " + problem)
+        if problems != []:
+            sys.exit(1)
+        print("no regressions against " + args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,21 @@
 from random import randint
 from random import uniform
 from random import shuffle
-from math import sqrt, ceil, atan, atan2, cos, sin, pi, degrees, radians, tan
+import random
+from math import sqrt, ceil, floor, atan, atan2, cos, sin, pi, degrees, radians, tan, nextafter
 from copy import deepcopy
+from bisect import bisect_left
 import itertools
+import argparse
+import json
+from time import perf_counter
+
+from proximity import build_kd_tree, count_within_radius, sorted_neighbours
+from level_binary import pack_level
+from level_sinks import sink_types, default_sink_paths, open_sink, write_to_sink, close_sink, start_writer, submit_to_writer, stop_writer
+from level_stats import enable_stage_timing, disable_stage_timing, start_level_record, timed_stage, record_counts, finish_level_record, level_write_timer
+from level_stats import enable_work_counting, disable_work_counting, count_work, counting_function
+from level_stats import enable_level_profiling, disable_level_profiling, enable_memory_tracing, disable_memory_tracing
 
 # blocks number and size
 blocks = {'1':[0.84,0.84], '2':[0.85,0.43], '3':[0.43,0.85], '4':[0.43,0.43],
@@ -91,8 +103,16 @@ factor3_distance = 0.8
 factor3_bonus = 1.0
 
 # used for trajectory estimation and identifying reachable blocks
+# with trajectory_method 'analytic' each shot's parabola is solved exactly against the edges of the objects,
+# with 'polyline' it is sampled every trajectory_accuracy units and the line segments between the points are intersected with the objects
+trajectory_method = 'analytic'
 trajectory_accuracy = 0.5
 number_shots = 50
+# with shot_sampling 'fixed' shots are fired at number_shots angles spread evenly from -pi/2 to pi/2,
+# with 'adaptive' the angles at which the first object hit can change (where a shot starts or stops touching an object's corners or top)
+# are solved for and one shot is fired between each pair of them, giving the exact range of angles over which each object is hit first
+# ('fixed' gives the same levels as before adaptive sampling was added)
+shot_sampling = 'adaptive'
 slingshot_x = -7.7
 slingshot_y = -1.0
 MAX_X = 20
@@ -136,6 +156,26 @@ max_slope_height = 1.5
 max_slope_increase = 1.0
 add_slopes = True
 
+# used for keeping to each parameter block's time limit
+# the time left for a block is shared equally between its remaining levels, and within a level the optional stages
+# must finish by these fractions of the level's budget (the rest is left for the stages that always run in full)
+# when a stage's deadline passes it stops early: fewer block swaps, skipped protection passes, no extra TNT rounds
+honour_time_limit = True
+stage_deadline_shares = {'swap_blocks':0.25, 'protect_vulnerable_blocks':0.6, 'add_tnt':0.65}
+level_start_time = 0.0
+level_time_budget = None            # seconds allowed for the current level (None when there is no limit)
+
+# used for checking, once structures and platforms are built, that the level has space for the chosen number of pigs
+# if not the level geometry is rebuilt (with one more platform each time), and the number of pigs is reduced once the attempts run out
+# (a level with no space for any pigs keeps being rebuilt, and an error is raised if it still has none after max_empty_geometry_attempts)
+pig_capacity_check = True
+max_geometry_attempts = 5
+max_empty_geometry_attempts = 20
+
+# overlap, support and position checks round both sides to 10 decimal places before comparing them (see rounded)
+# coordinates are stored as floats, this only makes the rounding cheaper than round(x,10) and gives the same results
+rounding_scale = 10**10
+
 #weighting multipliers on number of birds
 number_birds_weight = 1.0           # higher number means more birds (easier levels)
 number_red_birds_weight = 1.0       # higher number means more red birds
@@ -149,6 +189,14 @@ number_white_birds_weight = 1.0     # higher number means more white birds
 
 
 
+# rounds a coordinate (or size) to 10 decimal places, as an integer number of 1e-10 units (for comparing with other rounded values)
+
+def rounded(value):
+    return round(value*rounding_scale)
+
+
+
+
 # generates a list of all possible subsets for structure bottom
 
 def generate_subsets(current_tree_bottom):     
@@ -347,15 +395,88 @@ def check_inner_both(grouping,choosen_item,current_tree_bottom):
 
 
 
-# choose a random item/block from the blocks dictionary based on probability table
+# builds a sampler for a probability table (item number -> probability), so that items can be chosen from it without walking the table
+# it holds the items with a non-zero probability in order and their cumulative probabilities, and a choice is a binary search of these
+# (each random number chooses the same item as walking the table, so seeded runs still give the same levels)
 
-def choose_item(probability_table):
-    ran_num = uniform(0.0,1.0)
-    selected_num = 0
-    while ran_num > 0:
-        selected_num = selected_num + 1
+def build_sampler(probability_table):
+    items = []
+    cumulative = []
+    total = 0.0
+    for key in sorted(probability_table.keys(), key=int):
+        if probability_table[key] > 0:
+            total = total + probability_table[key]
+            items.append(int(key))
+            cumulative.append(find_walk_threshold(probability_table, int(key), total))
+    return {'items':items, 'cumulative':cumulative}
+
+# the largest random number for which walking the table stops at or before the item
+# this is the cumulative probability up to it, except that the walk subtracts the probabilities one at a time,
+# which can round differently from adding them up (so it is moved to where the walk changes, at most a few steps of float precision)
+
+def find_walk_threshold(probability_table, item, total):
+    threshold = total
+    while walk_remainder(probability_table, item, threshold) > 0:
+        threshold = nextafter(threshold, 0.0)
+    while walk_remainder(probability_table, item, nextafter(threshold, 2.0)) <= 0:
+        threshold = nextafter(threshold, 2.0)
+    return threshold
+
+def walk_remainder(probability_table, item, ran_num):
+    for selected_num in range(1, item+1):
         ran_num = ran_num - probability_table[str(selected_num)]
-    return selected_num
+    return ran_num
+
+
+
+
+# choose a random item/block based on the sampler's probability table
+# (if floating point error leaves the probabilities adding up to just under 1, a random number past them chooses the last item)
+
+def sample_item(sampler):
+    index = bisect_left(sampler['cumulative'], uniform(0.0,1.0))
+    if index == len(sampler['items']):
+        index = index - 1
+    return sampler['items'][index]
+
+
+
+
+# every placed object (blocks and pigs) is given a stable integer id, stored as its last element
+# objects are then identified by id rather than by comparing their (floating point) positions
+
+object_id_counter = itertools.count()
+
+def new_object_id():
+    return next(object_id_counter)
+
+def object_id(item):
+    return item[-1]
+
+
+
+
+# builds lookups from object id to object and from object id to the index of the structure containing it
+
+def build_object_index(complete_locations):
+    id_to_object = {}
+    id_to_structure = {}
+    for i in range(len(complete_locations)):
+        for block in complete_locations[i]:
+            id_to_object[object_id(block)] = block
+            id_to_structure[object_id(block)] = i
+    return id_to_object, id_to_structure
+
+
+
+
+# total number of objects in a list of structures (or platform sets), used to count overlap checks
+
+def count_objects(nested):
+    total = 0
+    for i in nested:
+        total = total + len(i)
+    return total
 
 
 
@@ -395,7 +516,7 @@ def find_structure_height(structure):
 def add_new_row(current_tree_bottom, total_tree):
 
     groupings = generate_subsets(current_tree_bottom)   # generate possible groupings of bottom row objects
-    choosen_item = choose_item(probability_table_blocks)# choosen block for new row
+    choosen_item = sample_item(block_sampler)# choosen block for new row
     center_groupings = []                               # collection of viable groupings with new block at center
     edge_groupings = []                                 # collection of viable groupings with new block at edges
     both_groupings = []                                 # collection of viable groupings with new block at both center and edges
@@ -486,6 +607,7 @@ def add_new_row(current_tree_bottom, total_tree):
         return total_tree, current_tree_bottom      # return the new structure
     
     else:
+        count_work('add_new_row_retries')
         return add_new_row(current_tree_bottom, total_tree) # choose a new block and try again if no options available
 
 
@@ -497,7 +619,7 @@ def make_peaks(center_point):
 
     current_tree_bottom = []        # bottom blocks of structure
     number_peaks = randint(1,max_peaks)     # this is the number of peaks the structure will have
-    top_item = choose_item(probability_table_blocks)    # this is the item at top of structure
+    top_item = sample_item(block_sampler)    # this is the item at top of structure
 
     if number_peaks == 1:
         current_tree_bottom.append([top_item,center_point])     
@@ -543,6 +665,7 @@ def make_structure(absolute_ground, center_point, max_width, max_height):
     current_tree_bottom = make_peaks(center_point)
     if max_width > 0.0:
         while find_structure_width(current_tree_bottom) > max_width:
+            count_work('make_peaks_retries')
             current_tree_bottom = make_peaks(center_point)
 
     total_tree.append(current_tree_bottom)
@@ -564,6 +687,7 @@ def make_structure(absolute_ground, center_point, max_width, max_height):
             structure_height = find_structure_height(complete_locations)
             structure_width = find_structure_width(complete_locations)
             if structure_height > max_height or structure_width > max_width:
+                count_work('add_new_row_rejections')
                 total_tree = deepcopy(pre_total_tree)
             else:
                 pre_total_tree = deepcopy(total_tree)
@@ -574,7 +698,7 @@ def make_structure(absolute_ground, center_point, max_width, max_height):
     ground = absolute_ground
     for row in reversed(total_tree):
         for item in row:
-            complete_locations.append([item[0],item[1],round((((blocks[str(item[0])][1])/2)+ground),10)])
+            complete_locations.append([item[0],item[1],round((((blocks[str(item[0])][1])/2)+ground),10),new_object_id()])
         ground = ground + (blocks[str(item[0])][1])
 
     print("Width:",find_structure_width(complete_locations))
@@ -599,13 +723,13 @@ def make_structure(absolute_ground, center_point, max_width, max_height):
         for test_position in test_positions:
             valid_pig = True
             for i in complete_locations:
-                if ( round((test_position[0] - pig_width/2),10) < round((i[1] + (blocks[str(i[0])][0])/2),10) and
-                     round((test_position[0] + pig_width/2),10) > round((i[1] - (blocks[str(i[0])][0])/2),10) and
-                     round((test_position[1] + pig_height/2),10) > round((i[2] - (blocks[str(i[0])][1])/2),10) and
-                     round((test_position[1] - pig_height/2),10) < round((i[2] + (blocks[str(i[0])][1])/2),10)):
+                if ( rounded((test_position[0] - pig_width/2)) < rounded((i[1] + (blocks[str(i[0])][0])/2)) and
+                     rounded((test_position[0] + pig_width/2)) > rounded((i[1] - (blocks[str(i[0])][0])/2)) and
+                     rounded((test_position[1] + pig_height/2)) > rounded((i[2] - (blocks[str(i[0])][1])/2)) and
+                     rounded((test_position[1] - pig_height/2)) < rounded((i[2] + (blocks[str(i[0])][1])/2))):
                     valid_pig = False
             if valid_pig == True:
-                possible_pig_positions.append(test_position)
+                possible_pig_positions.append(test_position + [new_object_id()])
 
 
     #identify all possible pig positions on ground within structure
@@ -621,13 +745,13 @@ def make_structure(absolute_ground, center_point, max_width, max_height):
     for test_position in test_positions:
         valid_pig = True
         for i in complete_locations:
-            if ( round((test_position[0] - pig_width/2),10) < round((i[1] + (blocks[str(i[0])][0])/2),10) and
-                 round((test_position[0] + pig_width/2),10) > round((i[1] - (blocks[str(i[0])][0])/2),10) and
-                 round((test_position[1] + pig_height/2),10) > round((i[2] - (blocks[str(i[0])][1])/2),10) and
-                 round((test_position[1] - pig_height/2),10) < round((i[2] + (blocks[str(i[0])][1])/2),10)):
+            if ( rounded((test_position[0] - pig_width/2)) < rounded((i[1] + (blocks[str(i[0])][0])/2)) and
+                 rounded((test_position[0] + pig_width/2)) > rounded((i[1] - (blocks[str(i[0])][0])/2)) and
+                 rounded((test_position[1] + pig_height/2)) > rounded((i[2] - (blocks[str(i[0])][1])/2)) and
+                 rounded((test_position[1] - pig_height/2)) < rounded((i[2] + (blocks[str(i[0])][1])/2))):
                 valid_pig = False
         if valid_pig == True:
-            possible_pig_positions.append(test_position)
+            possible_pig_positions.append(test_position + [new_object_id()])
 
 
     pig_protect_values = []
@@ -678,6 +802,8 @@ def create_ground_structures():
         for j in range(len(ground_divides)-1):
             if (ground_divides[j+1] - ground_divides[j]) < min_ground_width:
                 valid = False
+        if valid == False:
+            count_work('ground_divides_resamples')
 
     # determine the area available to each ground structure
     ground_positions = []
@@ -716,6 +842,7 @@ def create_platforms(number_platforms, complete_locations, possible_pig_position
     attempts = 0            # number of attempts so far to find space for platform
     final_platforms = []
     while len(final_platforms) < number_platforms:
+        count_work('create_platforms_attempts')
         platform_width = randint(4,7)
         platform_position = [uniform(level_width_min+((platform_width*platform_size[0])/2.0), level_width_max-((platform_width*platform_size[0])/2.0)),
                              uniform(level_height_min, (level_height_max - minimum_height_gap))]
@@ -765,31 +892,32 @@ def create_platforms(number_platforms, complete_locations, possible_pig_position
             
         overlap = False
         for platform in temp_platform:
+            count_work('aabb_checks', count_objects(complete_locations) + count_objects(final_platforms) + len(possible_pig_positions))
 
             if (((platform[0]-(platform_size[0]/2)) < level_width_min) or ((platform[0]+(platform_size[0])/2) > level_width_max)):
                 overlap = True
 
             for structure in complete_locations:
                 for block in structure:
-                    if ( round((platform[0] - platform_distance_buffer - platform_size[0]/2),10) <= round((block[1] + blocks[str(block[0])][0]/2),10) and
-                         round((platform[0] + platform_distance_buffer + platform_size[0]/2),10) >= round((block[1] - blocks[str(block[0])][0]/2),10) and
-                         round((platform[1] + platform_distance_buffer + platform_size[1]/2),10) >= round((block[2] - blocks[str(block[0])][1]/2),10) and
-                         round((platform[1] - platform_distance_buffer - platform_size[1]/2),10) <= round((block[2] + blocks[str(block[0])][1]/2),10)):
+                    if ( rounded((platform[0] - platform_distance_buffer - platform_size[0]/2)) <= rounded((block[1] + blocks[str(block[0])][0]/2)) and
+                         rounded((platform[0] + platform_distance_buffer + platform_size[0]/2)) >= rounded((block[1] - blocks[str(block[0])][0]/2)) and
+                         rounded((platform[1] + platform_distance_buffer + platform_size[1]/2)) >= rounded((block[2] - blocks[str(block[0])][1]/2)) and
+                         rounded((platform[1] - platform_distance_buffer - platform_size[1]/2)) <= rounded((block[2] + blocks[str(block[0])][1]/2))):
                         overlap = True
 
             for platform_set in final_platforms:
                 for platform2 in platform_set:
-                    if ( round((platform[0] - platform_distance_buffer - platform_size[0]/2),10) <= round((platform2[0] + platform_size[0]/2),10) and
-                         round((platform[0] + platform_distance_buffer + platform_size[0]/2),10) >= round((platform2[0] - platform_size[0]/2),10) and
-                         round((platform[1] + platform_distance_buffer + platform_size[1]/2),10) >= round((platform2[1] - platform_size[1]/2),10) and
-                         round((platform[1] - platform_distance_buffer - platform_size[1]/2),10) <= round((platform2[1] + platform_size[1]/2),10)):
+                    if ( rounded((platform[0] - platform_distance_buffer - platform_size[0]/2)) <= rounded((platform2[0] + platform_size[0]/2)) and
+                         rounded((platform[0] + platform_distance_buffer + platform_size[0]/2)) >= rounded((platform2[0] - platform_size[0]/2)) and
+                         rounded((platform[1] + platform_distance_buffer + platform_size[1]/2)) >= rounded((platform2[1] - platform_size[1]/2)) and
+                         rounded((platform[1] - platform_distance_buffer - platform_size[1]/2)) <= rounded((platform2[1] + platform_size[1]/2))):
                         overlap = True
 
             for pig in possible_pig_positions:
-                if ( round((platform[0] - platform_distance_buffer - platform_size[0]/2),10) <= round((pig[0] + pig_size[0]/2),10) and
-                     round((platform[0] + platform_distance_buffer + platform_size[0]/2),10) >= round((pig[0] - pig_size[0]/2),10) and
-                     round((platform[1] + platform_distance_buffer + platform_size[1]/2),10) >= round((pig[1] - pig_size[1]/2),10) and
-                     round((platform[1] - platform_distance_buffer - platform_size[1]/2),10) <= round((pig[1] + pig_size[1]/2),10)):
+                if ( rounded((platform[0] - platform_distance_buffer - platform_size[0]/2)) <= rounded((pig[0] + pig_size[0]/2)) and
+                     rounded((platform[0] + platform_distance_buffer + platform_size[0]/2)) >= rounded((pig[0] - pig_size[0]/2)) and
+                     rounded((platform[1] + platform_distance_buffer + platform_size[1]/2)) >= rounded((pig[1] - pig_size[1]/2)) and
+                     rounded((platform[1] - platform_distance_buffer - platform_size[1]/2)) <= rounded((pig[1] + pig_size[1]/2))):
                     overlap = True
 
             for platform_set2 in final_platforms:
@@ -801,9 +929,12 @@ def create_platforms(number_platforms, complete_locations, possible_pig_position
         if overlap == False:
             final_platforms.append(temp_platform)
             platform_centers.append(platform_position)
+        else:
+            count_work('create_platforms_rejections')
 
         attempts = attempts + 1
         if attempts > max_attempts:
+            count_work('create_platforms_dropped')
             attempts = 0
             number_platforms = number_platforms - 1
 
@@ -864,215 +995,162 @@ def choose_number_birds(final_pig_positions,number_ground_structures,number_plat
 
 
 
-# identify all possible triangleHole positions on top of blocks
+# width of the x-columns used to bucket objects for overlap queries
 
-def find_trihole_positions(complete_locations):
-    possible_trihole_positions = []
-    for structure in complete_locations:
-        for block in structure:
-            block_width = round(blocks[str(block[0])][0],10)
-            block_height = round(blocks[str(block[0])][1],10)
-            trihole_width = additional_object_sizes['1'][0]
-            trihole_height = additional_object_sizes['1'][1]
+grid_cell_size = 1.0
 
-            # don't place block on edge if block too thin
-            if blocks[str(block[0])][0] < trihole_width:
-                test_positions = [ [round(block[1],10),round(block[2] + (trihole_height/2) + (block_height/2),10)]]
-            else:
-                test_positions = [ [round(block[1],10),round(block[2] + (trihole_height/2) + (block_height/2),10)],
-                                   [round(block[1] + (block_width/3),10),round(block[2] + (trihole_height/2) + (block_height/2),10)],
-                                   [round(block[1] - (block_width/3),10),round(block[2] + (trihole_height/2) + (block_height/2),10)] ]
-            
-            for test_position in test_positions:
-                valid_position = True
-                for structure in complete_locations:
-                    for i in structure:
-                        if ( round((test_position[0] - trihole_width/2),10) < round((i[1] + (blocks[str(i[0])][0])/2),10) and
-                             round((test_position[0] + trihole_width/2),10) > round((i[1] - (blocks[str(i[0])][0])/2),10) and
-                             round((test_position[1] + trihole_height/2),10) > round((i[2] - (blocks[str(i[0])][1])/2),10) and
-                             round((test_position[1] - trihole_height/2),10) < round((i[2] + (blocks[str(i[0])][1])/2),10)):
-                            valid_position = False
-                for j in final_pig_positions:
-                    if ( round((test_position[0] - trihole_width/2),10) < round((j[0] + (pig_size[0]/2)),10) and
-                         round((test_position[0] + trihole_width/2),10) > round((j[0] - (pig_size[0]/2)),10) and
-                         round((test_position[1] + trihole_height/2),10) > round((j[1] - (pig_size[1]/2)),10) and
-                         round((test_position[1] - trihole_height/2),10) < round((j[1] + (pig_size[1]/2)),10)):
-                        valid_position = False
-                for i in final_platforms:
-                    for j in i:
-                        if ( round((test_position[0] - trihole_width/2),10) < round((j[0] + (platform_size[0]/2)),10) and
-                             round((test_position[0] + trihole_width/2),10) > round((j[0] - (platform_size[0]/2)),10) and
-                             round((test_position[1] + platform_distance_buffer + trihole_height/2),10) > round((j[1] - (platform_size[1]/2)),10) and
-                             round((test_position[1] - platform_distance_buffer - trihole_height/2),10) < round((j[1] + (platform_size[1]/2)),10)):
-                            valid_position = False
-                if valid_position == True:
-                    possible_trihole_positions.append(test_position)
-                        
-    return possible_trihole_positions
 
 
 
+# returns the range of grid columns covered by the x interval [left,right]
 
-# identify all possible triangle positions on top of blocks
+def grid_columns(left, right):
+    return range(int((left-0.000001)//grid_cell_size), int((right+0.000001)//grid_cell_size)+1)
 
-def find_tri_positions(complete_locations):
-    possible_tri_positions = []
-    for structure in complete_locations:
-        for block in structure:
-            block_width = round(blocks[str(block[0])][0],10)
-            block_height = round(blocks[str(block[0])][1],10)
-            tri_width = additional_object_sizes['2'][0]
-            tri_height = additional_object_sizes['2'][1]
-            
-            # don't place block on edge if block too thin
-            if blocks[str(block[0])][0] < tri_width:
-                test_positions = [ [round(block[1],10),round(block[2] + (tri_height/2) + (block_height/2),10)]]
+
+
+
+# buckets objects (given as [left,right,...] extents) into x-columns so that overlap tests only visit nearby objects
+
+def build_grid_index(extents):
+    grid_index = {}
+    for index in range(len(extents)):
+        for column in grid_columns(extents[index][0], extents[index][1]):
+            if column in grid_index:
+                grid_index[column].append(index)
             else:
-                test_positions = [ [round(block[1],10),round(block[2] + (tri_height/2) + (block_height/2),10)],
-                                   [round(block[1] + (block_width/3),10),round(block[2] + (tri_height/2) + (block_height/2),10)],
-                                   [round(block[1] - (block_width/3),10),round(block[2] + (tri_height/2) + (block_height/2),10)] ]
-            
-            for test_position in test_positions:
-                valid_position = True
-                for structure in complete_locations:
-                    for i in structure:
-                        if ( round((test_position[0] - tri_width/2),10) < round((i[1] + (blocks[str(i[0])][0])/2),10) and
-                             round((test_position[0] + tri_width/2),10) > round((i[1] - (blocks[str(i[0])][0])/2),10) and
-                             round((test_position[1] + tri_height/2),10) > round((i[2] - (blocks[str(i[0])][1])/2),10) and
-                             round((test_position[1] - tri_height/2),10) < round((i[2] + (blocks[str(i[0])][1])/2),10)):
-                            valid_position = False
-                for j in final_pig_positions:
-                    if ( round((test_position[0] - tri_width/2),10) < round((j[0] + (pig_size[0]/2)),10) and
-                         round((test_position[0] + tri_width/2),10) > round((j[0] - (pig_size[0]/2)),10) and
-                         round((test_position[1] + tri_height/2),10) > round((j[1] - (pig_size[1]/2)),10) and
-                         round((test_position[1] - tri_height/2),10) < round((j[1] + (pig_size[1]/2)),10)):
-                        valid_position = False
-                for i in final_platforms:
-                    for j in i:
-                        if ( round((test_position[0] - tri_width/2),10) < round((j[0] + (platform_size[0]/2)),10) and
-                             round((test_position[0] + tri_width/2),10) > round((j[0] - (platform_size[0]/2)),10) and
-                             round((test_position[1] + platform_distance_buffer + tri_height/2),10) > round((j[1] - (platform_size[1]/2)),10) and
-                             round((test_position[1] - platform_distance_buffer - tri_height/2),10) < round((j[1] + (platform_size[1]/2)),10)):
-                            valid_position = False
-                if blocks[str(block[0])][0] < tri_width:      # as block not symmetrical need to check for support
-                    valid_position = False
-                if valid_position == True:
-                    possible_tri_positions.append(test_position)
+                grid_index[column] = [index]
+    return grid_index
+
+
+
+
+# returns the indices of all objects in the grid index that share a column with the x interval [left,right]
+# (each object is only returned once, even if it spans several of the columns)
 
-    return possible_tri_positions
+def query_grid_index(grid_index, left, right):
+    found = []
+    seen = set()
+    for column in grid_columns(left, right):
+        if column in grid_index:
+            for index in grid_index[column]:
+                if index not in seen:
+                    seen.add(index)
+                    found.append(index)
+    return found
 
 
 
 
-# identify all possible circle positions on top of blocks (can only be placed in middle of block)
+# identify all possible additional block positions on top of blocks, for all allowed shapes in a single pass
+# (triangleHole, triangle and circleSmall can be placed above the center or sides of a block, circles only above the center)
+
+def find_additional_block_positions(complete_locations, final_pig_positions, final_platforms):
+    shapes_allowed = {'1':trihole_allowed, '2':tri_allowed, '3':cir_allowed, '4':cirsmall_allowed}
+    possible_positions = {'1':[], '2':[], '3':[], '4':[]}
+
+    # obstacle extents (left, right, bottom, top, uses platform buffer) for every block, pig and platform
+    obstacles = []
+    for structure in complete_locations:
+        for i in structure:
+            obstacles.append([round((i[1] - (blocks[str(i[0])][0])/2),10), round((i[1] + (blocks[str(i[0])][0])/2),10),
+                              round((i[2] - (blocks[str(i[0])][1])/2),10), round((i[2] + (blocks[str(i[0])][1])/2),10), False])
+    for j in final_pig_positions:
+        obstacles.append([round((j[0] - (pig_size[0]/2)),10), round((j[0] + (pig_size[0]/2)),10),
+                          round((j[1] - (pig_size[1]/2)),10), round((j[1] + (pig_size[1]/2)),10), False])
+    for i in final_platforms:
+        for j in i:
+            obstacles.append([round((j[0] - (platform_size[0]/2)),10), round((j[0] + (platform_size[0]/2)),10),
+                              round((j[1] - (platform_size[1]/2)),10), round((j[1] + (platform_size[1]/2)),10), True])
+    obstacle_index = build_grid_index(obstacles)
 
-def find_cir_positions(complete_locations):
-    possible_cir_positions = []
     for structure in complete_locations:
         for block in structure:
             block_width = round(blocks[str(block[0])][0],10)
             block_height = round(blocks[str(block[0])][1],10)
-            cir_width = additional_object_sizes['3'][0]
-            cir_height = additional_object_sizes['3'][1]
-
-            # only checks above block's center
-            test_positions = [ [round(block[1],10),round(block[2] + (cir_height/2) + (block_height/2),10)]]
-            
-            for test_position in test_positions:
-                valid_position = True
-                for structure in complete_locations:
-                    for i in structure:
-                        if ( round((test_position[0] - cir_width/2),10) < round((i[1] + (blocks[str(i[0])][0])/2),10) and
-                             round((test_position[0] + cir_width/2),10) > round((i[1] - (blocks[str(i[0])][0])/2),10) and
-                             round((test_position[1] + cir_height/2),10) > round((i[2] - (blocks[str(i[0])][1])/2),10) and
-                             round((test_position[1] - cir_height/2),10) < round((i[2] + (blocks[str(i[0])][1])/2),10)):
-                            valid_position = False
-                for j in final_pig_positions:
-                    if ( round((test_position[0] - cir_width/2),10) < round((j[0] + (pig_size[0]/2)),10) and
-                         round((test_position[0] + cir_width/2),10) > round((j[0] - (pig_size[0]/2)),10) and
-                         round((test_position[1] + cir_height/2),10) > round((j[1] - (pig_size[1]/2)),10) and
-                         round((test_position[1] - cir_height/2),10) < round((j[1] + (pig_size[1]/2)),10)):
-                        valid_position = False
-                for i in final_platforms:
-                    for j in i:
-                        if ( round((test_position[0] - cir_width/2),10) < round((j[0] + (platform_size[0]/2)),10) and
-                             round((test_position[0] + cir_width/2),10) > round((j[0] - (platform_size[0]/2)),10) and
-                             round((test_position[1] + platform_distance_buffer + cir_height/2),10) > round((j[1] - (platform_size[1]/2)),10) and
-                             round((test_position[1] - platform_distance_buffer - cir_height/2),10) < round((j[1] + (platform_size[1]/2)),10)):
+            center_x = round(block[1],10)
+            side_xs = [round(block[1] + (block_width/3),10), round(block[1] - (block_width/3),10)]
+
+            for shape in ['1','2','3','4']:
+                if shapes_allowed[shape] == False:
+                    continue
+                shape_width = additional_object_sizes[shape][0]
+                shape_height = additional_object_sizes[shape][1]
+
+                # as triangles are not symmetrical they need full support, circles only check above the block's center
+                if shape == '2' and blocks[str(block[0])][0] < shape_width:
+                    continue
+                if shape == '3' or blocks[str(block[0])][0] < shape_width:
+                    test_xs = [center_x]
+                else:
+                    test_xs = [center_x] + side_xs
+                test_y = round(block[2] + (shape_height/2) + (block_height/2),10)
+
+                for test_x in test_xs:
+                    left = round((test_x - shape_width/2),10)
+                    right = round((test_x + shape_width/2),10)
+                    top = round((test_y + shape_height/2),10)
+                    bottom = round((test_y - shape_height/2),10)
+                    buffered_top = round((test_y + platform_distance_buffer + shape_height/2),10)
+                    buffered_bottom = round((test_y - platform_distance_buffer - shape_height/2),10)
+                    valid_position = True
+                    nearby_obstacles = query_grid_index(obstacle_index, left, right)
+                    count_work('aabb_checks', len(nearby_obstacles))
+                    for index in nearby_obstacles:
+                        obstacle = obstacles[index]
+                        if obstacle[4] == True:
+                            if left < obstacle[1] and right > obstacle[0] and buffered_top > obstacle[2] and buffered_bottom < obstacle[3]:
+                                valid_position = False
+                                break
+                        elif left < obstacle[1] and right > obstacle[0] and top > obstacle[2] and bottom < obstacle[3]:
                             valid_position = False
-                if valid_position == True:
-                    possible_cir_positions.append(test_position)
+                            break
+                    if valid_position == True:
+                        possible_positions[shape].append([test_x,test_y])
 
-    return possible_cir_positions
+    return possible_positions['1'], possible_positions['2'], possible_positions['3'], possible_positions['4']
 
 
 
 
-# identify all possible circleSmall positions on top of blocks
+# creates a counting tree (binary indexed tree) that marks each of the given number of items as present
+
+def counting_tree(number_items):
+    tree = [0]*(number_items+1)
+    for i in range(1,number_items+1):
+        tree[i] = tree[i] + 1
+        parent = i + (i & (-i))
+        if parent <= number_items:
+            tree[parent] = tree[parent] + tree[i]
+    return tree
+
 
-def find_cirsmall_positions(complete_locations):
-    possible_cirsmall_positions = []
-    for structure in complete_locations:
-        for block in structure:
-            block_width = round(blocks[str(block[0])][0],10)
-            block_height = round(blocks[str(block[0])][1],10)
-            cirsmall_width = additional_object_sizes['4'][0]
-            cirsmall_height = additional_object_sizes['4'][1]
 
-            # don't place block on edge if block too thin
-            if blocks[str(block[0])][0] < cirsmall_width:
-                test_positions = [ [round(block[1],10),round(block[2] + (cirsmall_height/2) + (block_height/2),10)]]
-            else:
-                test_positions = [ [round(block[1],10),round(block[2] + (cirsmall_height/2) + (block_height/2),10)],
-                                   [round(block[1] + (block_width/3),10),round(block[2] + (cirsmall_height/2) + (block_height/2),10)],
-                                   [round(block[1] - (block_width/3),10),round(block[2] + (cirsmall_height/2) + (block_height/2),10)] ]
-            
-            for test_position in test_positions:
-                valid_position = True
-                for structure in complete_locations:
-                    for i in structure:
-                        if ( round((test_position[0] - cirsmall_width/2),10) < round((i[1] + (blocks[str(i[0])][0])/2),10) and
-                             round((test_position[0] + cirsmall_width/2),10) > round((i[1] - (blocks[str(i[0])][0])/2),10) and
-                             round((test_position[1] + cirsmall_height/2),10) > round((i[2] - (blocks[str(i[0])][1])/2),10) and
-                             round((test_position[1] - cirsmall_height/2),10) < round((i[2] + (blocks[str(i[0])][1])/2),10)):
-                            valid_position = False
-                for j in final_pig_positions:
-                    if ( round((test_position[0] - cirsmall_width/2),10) < round((j[0] + (pig_size[0]/2)),10) and
-                         round((test_position[0] + cirsmall_width/2),10) > round((j[0] - (pig_size[0]/2)),10) and
-                         round((test_position[1] + cirsmall_height/2),10) > round((j[1] - (pig_size[1]/2)),10) and
-                         round((test_position[1] - cirsmall_height/2),10) < round((j[1] + (pig_size[1]/2)),10)):
-                        valid_position = False
-                for i in final_platforms:
-                    for j in i:
-                        if ( round((test_position[0] - cirsmall_width/2),10) < round((j[0] + (platform_size[0]/2)),10) and
-                             round((test_position[0] + cirsmall_width/2),10) > round((j[0] - (platform_size[0]/2)),10) and
-                             round((test_position[1] + platform_distance_buffer + cirsmall_height/2),10) > round((j[1] - (platform_size[1]/2)),10) and
-                             round((test_position[1] - platform_distance_buffer - cirsmall_height/2),10) < round((j[1] + (platform_size[1]/2)),10)):
-                            valid_position = False
-                if valid_position == True:
-                    possible_cirsmall_positions.append(test_position)
 
-    return possible_cirsmall_positions
+# marks the item at the given index as no longer present in the counting tree
 
+def counting_tree_remove(tree, index):
+    i = index + 1
+    while i < len(tree):
+        tree[i] = tree[i] - 1
+        i = i + (i & (-i))
 
 
 
-# finds possible positions for valid additional block types
 
-def find_additional_block_positions(complete_locations):
-    possible_trihole_positions = []
-    possible_tri_positions = []
-    possible_cir_positions = []
-    possible_cirsmall_positions = []
-    if trihole_allowed == True:
-        possible_trihole_positions = find_trihole_positions(complete_locations)
-    if tri_allowed == True:
-        possible_tri_positions = find_tri_positions(complete_locations)
-    if cir_allowed == True:
-        possible_cir_positions = find_cir_positions(complete_locations)
-    if cirsmall_allowed == True:
-        possible_cirsmall_positions = find_cirsmall_positions(complete_locations)
-    return possible_trihole_positions, possible_tri_positions, possible_cir_positions, possible_cirsmall_positions
+# finds the index of the n-th (starting at 0) item still present in the counting tree
+
+def counting_tree_find(tree, n):
+    position = 0
+    step = 1
+    while step*2 < len(tree):
+        step = step*2
+    while step > 0:
+        if position + step < len(tree) and tree[position+step] <= n:
+            position = position + step
+            n = n - tree[position]
+        step = step//2
+    return position
 
 
 
@@ -1092,121 +1170,150 @@ def add_additional_blocks(possible_trihole_positions, possible_tri_positions, po
 
     #randomly choose an additional block position and remove those that overlap it
     #repeat untill no more valid position
+    #remaining positions are tracked with a counting tree (so the n-th remaining one can be found quickly)
+    #and only positions sharing a grid column with the chosen one are tested for overlap
+
+    extents = []
+    for i in all_other:
+        extents.append([round((i[1] - (additional_object_sizes[i[0]][0]/2)),10), round((i[1] + (additional_object_sizes[i[0]][0]/2)),10),
+                        round((i[2] - (additional_object_sizes[i[0]][1]/2)),10), round((i[2] + (additional_object_sizes[i[0]][1]/2)),10)])
+    other_index = build_grid_index(extents)
+
+    remaining = [True]*len(all_other)
+    remaining_tree = counting_tree(len(all_other))
+    number_remaining = len(all_other)
 
     selected_other = []
-    while (len(all_other) > 0):
-        chosen = all_other.pop(randint(0,len(all_other)-1))
-        selected_other.append(chosen)
-        new_all_other = []
-        for i in all_other:
-            if ( round((chosen[1] - (additional_object_sizes[chosen[0]][0]/2)),10) >= round((i[1] + (additional_object_sizes[i[0]][0]/2)),10) or
-                 round((chosen[1] + (additional_object_sizes[chosen[0]][0]/2)),10) <= round((i[1] - (additional_object_sizes[i[0]][0]/2)),10) or
-                 round((chosen[2] + (additional_object_sizes[chosen[0]][1]/2)),10) <= round((i[2] - (additional_object_sizes[i[0]][1]/2)),10) or
-                 round((chosen[2] - (additional_object_sizes[chosen[0]][1]/2)),10) >= round((i[2] + (additional_object_sizes[i[0]][1]/2)),10)):
-                new_all_other.append(i)
-        all_other = new_all_other
+    while (number_remaining > 0):
+        chosen_index = counting_tree_find(remaining_tree, randint(0,number_remaining-1))
+        chosen = extents[chosen_index]
+        selected_other.append(all_other[chosen_index])
+        nearby_others = [chosen_index] + query_grid_index(other_index, chosen[0], chosen[1])
+        count_work('aabb_checks', len(nearby_others))
+        for i in nearby_others:
+            if remaining[i] == True:
+                if not ( chosen[0] >= extents[i][1] or
+                         chosen[1] <= extents[i][0] or
+                         chosen[3] <= extents[i][2] or
+                         chosen[2] >= extents[i][3]):
+                    remaining[i] = False
+                    counting_tree_remove(remaining_tree, i)
+                    number_remaining = number_remaining - 1
 
     return selected_other
 
 
 
 
-# add the desired number of pigs to the level
+# chooses pig positions from the possible positions, most desirable first, until there are max_pigs or no valid positions remain
+# (this doesn't use any random choices, so the first n positions chosen are the same whatever max_pigs is)
 
-def add_pigs(number_pigs, possible_pig_positions, complete_locations, pig_protect_values, final_platforms,extra_platforms):
+def choose_pig_positions(max_pigs, possible_pig_positions, pig_protect_values, final_platforms):
     final_pig_positions = []
-    pigs_placed_on_ground = False
-    while len(final_pig_positions) < number_pigs:
+    while len(possible_pig_positions) > 0 and (max_pigs == None or len(final_pig_positions) < max_pigs):
         pig_values = []         # three different factors are used to calculate the desirability of each possible pig locations
         f1 = []                 # the protection the location provides
         f2 = []                 # how far away the location is from other already selected locations
         f3 = []                 # how likely the location is to have other objects fall on it
-        
-        if len(possible_pig_positions) > 0:
 
-            for i in pig_protect_values:            # factor 1
-                f1.append(i*factor1_weight)
+        for i in pig_protect_values:            # factor 1
+            f1.append(i*factor1_weight)
 
-            for pig in possible_pig_positions:      # factor 2
-                distance = 1
-                for pig2 in final_pig_positions:
-                    distance = distance * sqrt((pig[0] - pig2[0])*(pig[0] - pig2[0]) +  (pig[1] - pig2[1])*(pig[1] - pig2[1]))
-                if len(final_pig_positions) > 0:
-                    f2.append((distance*factor2_weight)/len(final_pig_positions))
-                else:
-                    f2.append(0.0)
+        for pig in possible_pig_positions:      # factor 2
+            distance = 1
+            for pig2 in final_pig_positions:
+                distance = distance * sqrt((pig[0] - pig2[0])*(pig[0] - pig2[0]) +  (pig[1] - pig2[1])*(pig[1] - pig2[1]))
+            if len(final_pig_positions) > 0:
+                f2.append((distance*factor2_weight)/len(final_pig_positions))
+            else:
+                f2.append(0.0)
 
-            for pig in possible_pig_positions:      # factor 3
-                bonus_found = 0
-                for platform in final_platforms:
-                    platform_edge1 = platform[0][0]-(platform_size[0]/2.0)
-                    platform_edge2 = platform[-1][0]+(platform_size[0]/2.0)
-                    if pig[1] < platform[0][1]:
-                        if (pig[0] > (platform_edge1 - factor3_distance)) and (pig[0] < platform_edge1):
-                            bonus_found = 1
-                        if (pig[0] > platform_edge2) and (pig[0] < (platform_edge2 + factor3_distance)):
-                            bonus_found = 1
-                if bonus_found == 1:
-                    f3.append(factor3_bonus)
-                else:
-                    f3.append(0.0)
+        for pig in possible_pig_positions:      # factor 3
+            bonus_found = 0
+            for platform in final_platforms:
+                platform_edge1 = platform[0][0]-(platform_size[0]/2.0)
+                platform_edge2 = platform[-1][0]+(platform_size[0]/2.0)
+                if pig[1] < platform[0][1]:
+                    if (pig[0] > (platform_edge1 - factor3_distance)) and (pig[0] < platform_edge1):
+                        bonus_found = 1
+                    if (pig[0] > platform_edge2) and (pig[0] < (platform_edge2 + factor3_distance)):
+                        bonus_found = 1
+            if bonus_found == 1:
+                f3.append(factor3_bonus)
+            else:
+                f3.append(0.0)
 
-            for i in range(len(possible_pig_positions)):
-                pig_values.append(f1[i]+f2[i]+f3[i])
+        for i in range(len(possible_pig_positions)):
+            pig_values.append(f1[i]+f2[i]+f3[i])
 
-            max_value = 0
-            max_i = 0
-            for value in range(len(pig_values)):
-                if pig_values[value] > max_value:
-                    max_value = pig_values[value]
-                    max_i = value
+        max_value = 0
+        max_i = 0
+        for value in range(len(pig_values)):
+            if pig_values[value] > max_value:
+                max_value = pig_values[value]
+                max_i = value
 
-            final_pig_positions.append(possible_pig_positions[max_i])       # choose the location with the greatest pig value
+        final_pig_positions.append(possible_pig_positions[max_i])       # choose the location with the greatest pig value
 
-            # remove locations that are no longer valid
-            pig_width = pig_size[0]
-            pig_height = pig_size[1]
-            pig_choice = possible_pig_positions[max_i]
-            new_pig_positions = []
-            new_protect_values = []
-            for i in range(len(possible_pig_positions)):
-                if ( round((pig_choice[0] - pig_width/2),10) >= round((possible_pig_positions[i][0] + pig_width/2),10) or
-                     round((pig_choice[0] + pig_width/2),10) <= round((possible_pig_positions[i][0] - pig_width/2),10) or
-                     round((pig_choice[1] + pig_height/2),10) <= round((possible_pig_positions[i][1] - pig_height/2),10) or
-                     round((pig_choice[1] - pig_height/2),10) >= round((possible_pig_positions[i][1] + pig_height/2),10)):
-                    new_pig_positions.append(possible_pig_positions[i])
-                    new_protect_values.append(pig_protect_values[i])
-            possible_pig_positions = new_pig_positions
-            pig_protect_values = new_protect_values
-
-        # if no remaining options then place pigs randomly on the ground  
-        else:
-            pigs_placed_on_ground = True
-            test_position = [uniform(level_width_min, level_width_max),absolute_ground]
-            pig_width = pig_size[0]
-            pig_height = pig_size[1]
-            valid_pig = True
-            for structure in complete_locations:
-                for i in structure:
-                    if ( round((test_position[0] - pig_width/2),10) < round((i[1] + (blocks[str(i[0])][0])/2),10) and
-                         round((test_position[0] + pig_width/2),10) > round((i[1] - (blocks[str(i[0])][0])/2),10) and
-                         round((test_position[1] + pig_height/2),10) > round((i[2] - (blocks[str(i[0])][1])/2),10) and
-                         round((test_position[1] - pig_height/2),10) < round((i[2] + (blocks[str(i[0])][1])/2),10)):
-                        valid_pig = False
-            for i in extra_platforms:
-                if ( round((test_position[0] - pig_width/2),10) < round((i[0] + (platform_size[0]/2)),10) and
-                     round((test_position[0] + pig_width/2),10) > round((i[0] - (platform_size[0]/2)),10) and
-                     round((test_position[1] + pig_height/2),10) > round((i[1] - (platform_size[1]/2)),10) and
-                     round((test_position[1] - pig_height/2),10) < round((i[1] + (platform_size[1]/2)),10)):
-                    valid_pig = False
-            for i in final_pig_positions:
-                if ( round((test_position[0] - pig_width/2),10) < round((i[0] + (pig_width/2)),10) and
-                     round((test_position[0] + pig_width/2),10) > round((i[0] - (pig_width/2)),10) and
-                     round((test_position[1] + pig_height/2),10) > round((i[1] - (pig_height/2)),10) and
-                     round((test_position[1] - pig_height/2),10) < round((i[1] + (pig_height/2)),10)):
+        # remove locations that are no longer valid
+        pig_width = pig_size[0]
+        pig_height = pig_size[1]
+        pig_choice = possible_pig_positions[max_i]
+        new_pig_positions = []
+        new_protect_values = []
+        count_work('aabb_checks', len(possible_pig_positions))
+        for i in range(len(possible_pig_positions)):
+            if ( rounded((pig_choice[0] - pig_width/2)) >= rounded((possible_pig_positions[i][0] + pig_width/2)) or
+                 rounded((pig_choice[0] + pig_width/2)) <= rounded((possible_pig_positions[i][0] - pig_width/2)) or
+                 rounded((pig_choice[1] + pig_height/2)) <= rounded((possible_pig_positions[i][1] - pig_height/2)) or
+                 rounded((pig_choice[1] - pig_height/2)) >= rounded((possible_pig_positions[i][1] + pig_height/2))):
+                new_pig_positions.append(possible_pig_positions[i])
+                new_protect_values.append(pig_protect_values[i])
+        possible_pig_positions = new_pig_positions
+        pig_protect_values = new_protect_values
+
+    return final_pig_positions
+
+
+
+
+# add the desired number of pigs to the level
+# using the chosen pig positions (from choose_pig_positions) first, then placing the rest randomly on the ground
+
+def add_pigs(number_pigs, chosen_pig_positions, complete_locations, extra_platforms):
+    final_pig_positions = chosen_pig_positions[:number_pigs]
+    pigs_placed_on_ground = False
+    while len(final_pig_positions) < number_pigs:
+        pigs_placed_on_ground = True
+        count_work('add_pigs_ground_attempts')
+        count_work('aabb_checks', count_objects(complete_locations) + len(extra_platforms) + len(final_pig_positions))
+        test_position = [uniform(level_width_min, level_width_max),absolute_ground]
+        pig_width = pig_size[0]
+        pig_height = pig_size[1]
+        valid_pig = True
+        for structure in complete_locations:
+            for i in structure:
+                if ( rounded((test_position[0] - pig_width/2)) < rounded((i[1] + (blocks[str(i[0])][0])/2)) and
+                     rounded((test_position[0] + pig_width/2)) > rounded((i[1] - (blocks[str(i[0])][0])/2)) and
+                     rounded((test_position[1] + pig_height/2)) > rounded((i[2] - (blocks[str(i[0])][1])/2)) and
+                     rounded((test_position[1] - pig_height/2)) < rounded((i[2] + (blocks[str(i[0])][1])/2))):
                     valid_pig = False
-            if valid_pig == True:
-                final_pig_positions.append(test_position)
+        for i in extra_platforms:
+            if ( rounded((test_position[0] - pig_width/2)) < rounded((i[0] + (platform_size[0]/2))) and
+                 rounded((test_position[0] + pig_width/2)) > rounded((i[0] - (platform_size[0]/2))) and
+                 rounded((test_position[1] + pig_height/2)) > rounded((i[1] - (platform_size[1]/2))) and
+                 rounded((test_position[1] - pig_height/2)) < rounded((i[1] + (platform_size[1]/2)))):
+                valid_pig = False
+        for i in final_pig_positions:
+            if ( rounded((test_position[0] - pig_width/2)) < rounded((i[0] + (pig_width/2))) and
+                 rounded((test_position[0] + pig_width/2)) > rounded((i[0] - (pig_width/2))) and
+                 rounded((test_position[1] + pig_height/2)) > rounded((i[1] - (pig_height/2))) and
+                 rounded((test_position[1] - pig_height/2)) < rounded((i[1] + (pig_height/2)))):
+                valid_pig = False
+        if valid_pig == True:
+            final_pig_positions.append(test_position + [new_object_id()])
+        else:
+            count_work('add_pigs_ground_rejections')
 
     print("")
     print("Number of pigs: ", len(final_pig_positions))
@@ -1257,12 +1364,12 @@ def line_intersects_line(A,B,C,D):
 
 # this method uses a straight line rather than trajectory estimator
 
-def find_reachable_blocks_straight(complete_locations):
+def find_reachable_blocks_straight(complete_locations,selected_other,final_platforms):
     reachable_blocks = []
     for block in complete_locations:
         reachable = True
         for block2 in complete_locations:
-            if block2 != block:
+            if object_id(block2) != object_id(block):
                 if line_intersects_block([-7.5,-1],[block[1],block[2]],block2):
                     reachable = False
         for i in final_platforms:
@@ -1282,18 +1389,14 @@ def find_reachable_blocks_straight(complete_locations):
 # determines which blocks within the level can be hit directly by birds fired from the slingshot
 
 def find_reachable_blocks(complete_locations,final_pig_positions,selected_other,final_platforms):
-    reachable_blocks = []
-    angle_interval = pi/(number_shots-1)
-    angle = -(pi/2)
+    if shot_sampling == 'adaptive':
+        return find_reachable_blocks_adaptive(complete_locations,final_pig_positions,selected_other,final_platforms)
+    if trajectory_method == 'analytic':
+        return find_reachable_blocks_analytic(complete_locations,final_pig_positions,selected_other,final_platforms)
 
-    for i in range(number_shots):
-        release_point = find_release_point(angle)
-        trajectory = find_trajectory(release_point[0],release_point[1])
+    reachable_blocks = []
 
-        for point in trajectory:
-            point[0] = round(point[0] + slingshot_x,10)
-            point[1] = round(point[1] + slingshot_y,10)
-        
+    for trajectory in find_shot_trajectories():
         found = 0
         for j in range(len(trajectory)-1):
             point1 = trajectory[j]
@@ -1314,8 +1417,6 @@ def find_reachable_blocks(complete_locations,final_pig_positions,selected_other,
                 for pig in final_pig_positions:
                     if line_intersects_pig(point1, point2, pig):
                         found = 1
-                        
-        angle = angle + angle_interval
 
     return reachable_blocks
 
@@ -1325,16 +1426,12 @@ def find_reachable_blocks(complete_locations,final_pig_positions,selected_other,
 # determines for each pig within the level the blocks that block a player from hitting it.
 
 def find_blocks_in_way(complete_locations,final_pig_positions,selected_other,final_platforms):
-    angle_interval = pi/(number_shots-1)
-    angle = -(pi/2)
+    if trajectory_method == 'analytic':
+        return find_blocks_in_way_analytic(complete_locations,final_pig_positions,selected_other,final_platforms)
+
     final_blocks_in_way = []
-    for i in range(number_shots):
-        release_point = find_release_point(angle)
-        trajectory = find_trajectory(release_point[0],release_point[1])
+    for trajectory in find_shot_trajectories():
         blocks_in_way = []
-        for point in trajectory:
-            point[0] = round(point[0] + slingshot_x,10)
-            point[1] = round(point[1] + slingshot_y,10)
         found = 0
         found_pig = 0
         for j in range(len(trajectory)-1):
@@ -1353,8 +1450,6 @@ def find_blocks_in_way(complete_locations,final_pig_positions,selected_other,fin
                     for platform_block in platform:
                         if line_intersects_platform(point1, point2, platform_block):
                             found = 1
-                        
-        angle = angle + angle_interval
 
     return final_blocks_in_way
 
@@ -1364,18 +1459,14 @@ def find_blocks_in_way(complete_locations,final_pig_positions,selected_other,fin
 # determines which pigs within the level can be hit directly by birds fired from the slingshot
 
 def find_unprotected_pigs(complete_locations,final_pig_positions,selected_other,final_platforms):
-    unprotected_pigs = []
-    angle_interval = pi/(number_shots-1)
-    angle = -(pi/2)
+    if shot_sampling == 'adaptive':
+        return find_unprotected_pigs_adaptive(complete_locations,final_pig_positions,selected_other,final_platforms)
+    if trajectory_method == 'analytic':
+        return find_unprotected_pigs_analytic(complete_locations,final_pig_positions,selected_other,final_platforms)
 
-    for i in range(number_shots):
-        release_point = find_release_point(angle)
-        trajectory = find_trajectory(release_point[0],release_point[1])
+    unprotected_pigs = []
 
-        for point in trajectory:
-            point[0] = round(point[0] + slingshot_x,10)
-            point[1] = round(point[1] + slingshot_y,10)
-        
+    for trajectory in find_shot_trajectories():
         found = 0
         for j in range(len(trajectory)-1):
             point1 = trajectory[j]
@@ -1396,8 +1487,6 @@ def find_unprotected_pigs(complete_locations,final_pig_positions,selected_other,
                     if line_intersects_pig(point1, point2, pig):
                         found = 1
                         unprotected_pigs.append(pig)
-                        
-        angle = angle + angle_interval
 
     return unprotected_pigs
 
@@ -1408,18 +1497,14 @@ def find_unprotected_pigs(complete_locations,final_pig_positions,selected_other,
 # the total number of pigs minus this gives the number of unhittable (directly) pigs
 
 def find_hittable_pigs(complete_locations,final_pig_positions,selected_other,final_platforms):
-    hittable_pigs = []
-    angle_interval = pi/(number_shots-1)
-    angle = -(pi/2)
+    if shot_sampling == 'adaptive':
+        return find_hittable_pigs_adaptive(complete_locations,final_pig_positions,selected_other,final_platforms)
+    if trajectory_method == 'analytic':
+        return find_hittable_pigs_analytic(complete_locations,final_pig_positions,selected_other,final_platforms)
 
-    for i in range(number_shots):
-        release_point = find_release_point(angle)
-        trajectory = find_trajectory(release_point[0],release_point[1])
+    hittable_pigs = []
 
-        for point in trajectory:
-            point[0] = round(point[0] + slingshot_x,10)
-            point[1] = round(point[1] + slingshot_y,10)
-        
+    for trajectory in find_shot_trajectories():
         found = 0
         for j in range(len(trajectory)-1):
             point1 = trajectory[j]
@@ -1433,8 +1518,6 @@ def find_hittable_pigs(complete_locations,final_pig_positions,selected_other,fin
                     if line_intersects_pig(point1, point2, pig):
                         found = 1
                         hittable_pigs.append(pig)
-                        
-        angle = angle + angle_interval
 
     return hittable_pigs
 
@@ -1485,6 +1568,406 @@ def find_release_point(theta):
 
 
 
+# the trajectories of the shots used to find reachable blocks and pigs (number_shots angles spread evenly from -pi/2 to pi/2),
+# with points given in level coordinates
+# these only depend on the trajectory settings, so they are found once and kept (the points must not be changed)
+
+shot_trajectory_cache = {}
+
+def find_shot_trajectories():
+    key = (number_shots, trajectory_accuracy, MAX_X, scale, scaleFactor, slingshot_x, slingshot_y)
+    if key not in shot_trajectory_cache:
+        trajectories = []
+        angle_interval = pi/(number_shots-1)
+        angle = -(pi/2)
+        for i in range(number_shots):
+            release_point = find_release_point(angle)
+            trajectory = find_trajectory(release_point[0],release_point[1])
+            for point in trajectory:
+                point[0] = round(point[0] + slingshot_x,10)
+                point[1] = round(point[1] + slingshot_y,10)
+            trajectories.append(trajectory)
+            angle = angle + angle_interval
+        shot_trajectory_cache[key] = trajectories
+    return shot_trajectory_cache[key]
+
+
+
+
+# the parabolas of the shots (number_shots angles spread evenly from -pi/2 to pi/2), as [a, b] with y = a*x*x + b*x
+# (x and y relative to the slingshot, x from 0 to MAX_X), the same curves that find_trajectory samples
+
+shot_parabola_cache = {}
+
+def find_shot_parabolas():
+    key = (number_shots, scale, scaleFactor)
+    if key not in shot_parabola_cache:
+        parabolas = []
+        angle_interval = pi/(number_shots-1)
+        angle = -(pi/2)
+        for i in range(number_shots):
+            release_point = find_release_point(angle)
+            parabolas.append(find_parabola(release_point[0],release_point[1]))
+            angle = angle + angle_interval
+        shot_parabola_cache[key] = parabolas
+    return shot_parabola_cache[key]
+
+def find_parabola(release_x, release_y):
+    theta = atan2(release_y, release_x)
+    theta = launchToActual(theta)
+    velocity = getVelocity(theta)
+    ux = velocity * cos(theta)
+    uy = velocity * sin(theta)
+    a = -0.5 / (ux * ux)
+    b = uy / ux
+    return [a*scale*scale*scale, b*scale*scale]
+
+
+
+
+# the x (relative to the slingshot) at which the shot's parabola first enters the rectangle with the given edges, None if it misses it
+# either the parabola is already inside the rectangle where the rectangle starts, or it enters by crossing its bottom or top
+
+def parabola_entry(parabola, left, right, bottom, top):
+    a, b = parabola
+    left = max(left - slingshot_x, 0.0)
+    right = min(right - slingshot_x, MAX_X)
+    if left > right:
+        return None
+    bottom = bottom - slingshot_y
+    top = top - slingshot_y
+    y = a*left*left + b*left
+    if bottom <= y and y <= top:
+        return left
+    entry = None
+    for height in (bottom, top):
+        discriminant = b*b + 4*a*height
+        if discriminant >= 0:
+            root = sqrt(discriminant)
+            for x in ((-b + root)/(2*a), (-b - root)/(2*a)):
+                if left <= x and x <= right and (entry == None or x < entry):
+                    entry = x
+    return entry
+
+
+
+
+# the objects the shot's parabola hits, as [entry x, object type, object] in the order they are hit
+# object types are 'block', 'pig', 'platform' and 'irregular' (additional blocks)
+
+def find_shot_hits(parabola, complete_locations, final_pig_positions, selected_other, final_platforms):
+    hits = []
+    for structure in complete_locations:
+        for block in structure:
+            entry = parabola_entry(parabola, block[1]-(blocks[str(block[0])][0]/2.0), block[1]+(blocks[str(block[0])][0]/2.0),
+                                   block[2]-(blocks[str(block[0])][1]/2.0), block[2]+(blocks[str(block[0])][1]/2.0))
+            if entry != None:
+                hits.append([entry, 'block', block])
+    for pig in final_pig_positions:
+        entry = parabola_entry(parabola, pig[0]-(pig_size[0]/2.0), pig[0]+(pig_size[0]/2.0), pig[1]-(pig_size[1]/2.0), pig[1]+(pig_size[1]/2.0))
+        if entry != None:
+            hits.append([entry, 'pig', pig])
+    for platform in final_platforms:
+        for platform_block in platform:
+            entry = parabola_entry(parabola, platform_block[0]-(platform_size[0]/2.0), platform_block[0]+(platform_size[0]/2.0),
+                                   platform_block[1]-(platform_size[1]/2.0), platform_block[1]+(platform_size[1]/2.0))
+            if entry != None:
+                hits.append([entry, 'platform', platform_block])
+    for irregular in selected_other:
+        entry = parabola_entry(parabola, irregular[1]-(additional_object_sizes[str(irregular[0])][0]/2.0), irregular[1]+(additional_object_sizes[str(irregular[0])][0]/2.0),
+                               irregular[2]-(additional_object_sizes[str(irregular[0])][1]/2.0), irregular[2]+(additional_object_sizes[str(irregular[0])][1]/2.0))
+        if entry != None:
+            hits.append([entry, 'irregular', irregular])
+    hits.sort(key=lambda hit: hit[0])
+    return hits
+
+
+
+
+# the objects each shot hits first (more than one if they are entered at the same point)
+
+def find_first_hits(hits):
+    first_hits = []
+    for hit in hits:
+        if hit[0] == hits[0][0]:
+            first_hits.append(hit)
+    return first_hits
+
+
+
+
+# versions of find_reachable_blocks, find_blocks_in_way, find_unprotected_pigs and find_hittable_pigs that use the shots' parabolas
+
+def find_reachable_blocks_analytic(complete_locations,final_pig_positions,selected_other,final_platforms):
+    reachable_blocks = []
+    for parabola in find_shot_parabolas():
+        for hit in find_first_hits(find_shot_hits(parabola, complete_locations, final_pig_positions, selected_other, final_platforms)):
+            if hit[1] == 'block':
+                reachable_blocks.append(hit[2])
+    return reachable_blocks
+
+def find_blocks_in_way_analytic(complete_locations,final_pig_positions,selected_other,final_platforms):
+    final_blocks_in_way = []
+    for parabola in find_shot_parabolas():
+        blocks_in_way = []
+        hits = find_shot_hits(parabola, complete_locations, final_pig_positions, [], final_platforms)
+        for i in range(len(hits)):
+            if hits[i][1] == 'block':
+                blocks_in_way.append(hits[i][2])
+            else:
+                for pig_hit in find_first_hits(hits[i:]):       # the pigs hit where the shot is stopped
+                    if pig_hit[1] == 'pig':
+                        final_blocks_in_way.append([pig_hit[2],blocks_in_way])
+                break
+    return final_blocks_in_way
+
+def find_unprotected_pigs_analytic(complete_locations,final_pig_positions,selected_other,final_platforms):
+    unprotected_pigs = []
+    for parabola in find_shot_parabolas():
+        for hit in find_first_hits(find_shot_hits(parabola, complete_locations, final_pig_positions, selected_other, final_platforms)):
+            if hit[1] == 'pig':
+                unprotected_pigs.append(hit[2])
+    return unprotected_pigs
+
+def find_hittable_pigs_analytic(complete_locations,final_pig_positions,selected_other,final_platforms):
+    hittable_pigs = []
+    for parabola in find_shot_parabolas():
+        for hit in find_first_hits(find_shot_hits(parabola, [], final_pig_positions, [], final_platforms)):
+            if hit[1] == 'pig':
+                hittable_pigs.append(hit[2])
+    return hittable_pigs
+
+
+
+
+# the ranges of launch angles (from -pi/2 to pi/2, as in find_shot_parabolas) over which the same objects are hit first,
+# as [start angle, end angle, first hits] (first hits as given by find_first_hits, empty where the shots hit nothing)
+# a shot only starts or stops touching an object where its parabola passes through one of the object's corners, or has its highest point
+# on the object's bottom edge, so these angles are solved for every object (find_object_shot_events) and swept through in order
+# the first hits can only change at one of them, so only the objects with an event there are checked against the first hit before it
+# (a full shot is only fired at the edges of the shot pieces, after a tie, or when the object that was hit first stops being hit)
+# the ranges are kept for the level geometry they were found for, so later queries on the same geometry don't find them again
+
+first_hit_interval_cache = {}
+
+def find_first_hit_intervals(complete_locations, final_pig_positions, selected_other, final_platforms):
+    key = (tuple([tuple(block) for structure in complete_locations for block in structure]), tuple([tuple(pig) for pig in final_pig_positions]),
+           tuple([tuple(irregular) for irregular in selected_other]), tuple([tuple(platform_block) for platform in final_platforms for platform_block in platform]))
+    objects = []            # [object type, object, left, right, bottom, top] (in the same order as the key)
+    for structure in complete_locations:
+        for block in structure:
+            objects.append(shot_object('block', block, block[1], block[2], blocks[str(block[0])]))
+    for pig in final_pig_positions:
+        objects.append(shot_object('pig', pig, pig[0], pig[1], pig_size))
+    for irregular in selected_other:
+        objects.append(shot_object('irregular', irregular, irregular[1], irregular[2], additional_object_sizes[str(irregular[0])]))
+    for platform in final_platforms:
+        for platform_block in platform:
+            objects.append(shot_object('platform', platform_block, platform_block[0], platform_block[1], platform_size))
+
+    if key not in first_hit_interval_cache:
+        if len(first_hit_interval_cache) >= 4:      # only the geometry of the current level is queried again
+            first_hit_interval_cache.clear()
+        first_hit_interval_cache[key] = sweep_first_hits(objects)
+
+    intervals = []
+    for start, end, first_indices in first_hit_interval_cache[key]:
+        intervals.append([start, end, [[None, objects[i][0], objects[i][1]] for i in first_indices]])
+    return intervals
+
+# the type, the object and its edges, for an object of the given size centred at x, y
+
+def shot_object(object_type, item, x, y, size):
+    return [object_type, item, x - (size[0]/2.0), x + (size[0]/2.0), y - (size[1]/2.0), y + (size[1]/2.0)]
+
+# finds the first hit ranges for the given objects, with the first hits given as indices into objects
+
+def sweep_first_hits(objects):
+    events = []             # [angle, object index] (None for the edges of the shot pieces, where every object may change)
+    for piece in find_shot_pieces():
+        events.append([piece[0], None])
+        for i in range(len(objects)):
+            for angle in find_object_shot_events(objects[i], piece):
+                events.append([angle, i])
+    events.sort(key=lambda event: event[0])
+
+    angles = []             # the distinct event angles, and the objects with events at each
+    for angle, i in events:
+        if angles == [] or angle != angles[-1][0]:
+            angles.append([angle, []])
+        angles[-1][1].append(i)
+
+    object_index = build_grid_index([[item[2], item[3]] for item in objects])
+    left_order = sorted(range(len(objects)), key=lambda i: objects[i][2])
+    intervals = []
+    current = []
+    for k in range(len(angles)):
+        angle, changed = angles[k]
+        end = pi/2
+        if k+1 < len(angles):
+            end = angles[k+1][0]
+        parabola = find_angle_parabola((angle + end)/2.0)
+        if None in changed or len(current) > 1:
+            count_work('adaptive_shots')
+            current = find_first_indices(parabola, objects, left_order)
+        else:
+            current = update_first_hit(angle, parabola, objects, object_index, left_order, current, changed)
+        if intervals != [] and intervals[-1][2] == current:
+            intervals[-1][1] = end
+        else:
+            intervals.append([angle, end, current])
+    return intervals
+
+# the first hit after the objects with events at the angle change, given the first hit before it
+# only those objects can come in front of the first hit, unless it has an event itself, when the objects the shot passes over between
+# where it entered the first hit at the event and where it enters it after are also checked (a shot is fired if it stops being hit)
+
+def update_first_hit(angle, parabola, objects, object_index, left_order, current, changed):
+    candidates = current + [i for i in changed if i not in current]
+    if current != [] and current[0] in changed:
+        first = objects[current[0]]
+        entry = parabola_entry(parabola, first[2], first[3], first[4], first[5])
+        event_entry = parabola_entry(find_angle_parabola(angle), first[2], first[3], first[4], first[5])
+        if entry == None or event_entry == None:
+            count_work('adaptive_shots')
+            return find_first_indices(parabola, objects, left_order)
+        low = slingshot_x + min(entry, event_entry) - 0.000001
+        high = slingshot_x + max(entry, event_entry) + 0.000001
+        for i in query_grid_index(object_index, low, high):
+            if objects[i][2] <= high and objects[i][3] >= low and i not in candidates:
+                candidates.append(i)
+    return find_first_indices(parabola, objects, sorted(candidates, key=lambda i: objects[i][2]))
+
+# the indices of the given objects (in order of their left edges) that the shot hits first
+# a shot can't enter an object before its left edge, so the objects after one that starts beyond the first entry found are not checked
+
+def find_first_indices(parabola, objects, indices):
+    first_entry = None
+    first_indices = []
+    for i in indices:
+        if first_entry != None and objects[i][2] - slingshot_x > first_entry:
+            break
+        entry = parabola_entry(parabola, objects[i][2], objects[i][3], objects[i][4], objects[i][5])
+        if entry != None:
+            if first_entry == None or entry < first_entry:
+                first_entry = entry
+                first_indices = [i]
+            elif entry == first_entry:
+                first_indices.append(i)
+    return sorted(first_indices)
+
+# the parabola of the shot at the given launch angle
+
+def find_angle_parabola(angle):
+    release_point = find_release_point(angle)
+    return find_parabola(release_point[0],release_point[1])
+
+
+
+
+# the ranges of launch angles over which the shots change smoothly, as [start angle, end angle, offset, k]
+# a shot at launch angle θ in the range leaves the slingshot at angle θ + offset, so with t = tan(θ + offset) its parabola is [-(1+t*t)*k, t*scale*scale]
+# the velocity and offset given by the launch tables only change where the release angle crosses one of launchAngle, or where atan2 of the
+# release point changes branch (at 0), and the shots go straight up (where t changes from +infinity to -infinity) in between pieces
+
+shot_piece_cache = {}
+
+def find_shot_pieces():
+    key = (scale, scaleFactor, tuple(launchAngle), tuple(changeAngle), tuple(launchVelocity))
+    if key not in shot_piece_cache:
+        edges = [-(pi/2), 0.0, pi/2]
+        for angle in launchAngle:
+            for edge in (angle - pi, angle + pi):
+                if -(pi/2) < edge and edge < pi/2:
+                    edges.append(edge)
+        edges.sort()
+        pieces = []
+        for i in range(len(edges)-1):
+            middle = (edges[i] + edges[i+1])/2.0
+            release_point = find_release_point(middle)
+            theta = atan2(release_point[1], release_point[0])
+            offset = launchToActual(theta) - middle
+            k = 0.5*scale*scale*scale/(getVelocity(theta)*getVelocity(theta))
+            start = edges[i]
+            turn = (pi/2) - offset + (pi*ceil((edges[i] + offset - (pi/2))/pi))       # first angle at or after the start where the shot goes straight up
+            while turn < edges[i+1]:
+                if turn > start:
+                    pieces.append([start, turn, offset, k])
+                start = turn
+                turn = turn + pi
+            pieces.append([start, edges[i+1], offset, k])
+        shot_piece_cache[key] = pieces
+    return shot_piece_cache[key]
+
+# the launch angles within the piece where a shot starts or stops touching the object (given as from shot_object)
+# where the shot passes through one of its corners, or where the highest point of the shot is on its bottom edge
+# (the object is cut to where shots are followed, as in parabola_entry)
+
+def find_object_shot_events(shot_object_edges, piece):
+    left = max(shot_object_edges[2] - slingshot_x, 0.0)
+    right = min(shot_object_edges[3] - slingshot_x, MAX_X)
+    bottom = shot_object_edges[4] - slingshot_y
+    top = shot_object_edges[5] - slingshot_y
+    start, end, offset, k = piece
+    if left > right:
+        return []
+    s2 = scale*scale
+    turns = round((((start + end)/2.0) + offset)/pi)        # the shot angle is atan(t) plus a whole number of turns of pi
+    slopes = []
+    # passing through (x, y): k*x*x*t*t - s2*x*t + k*x*x + y = 0
+    for x in (left, right):
+        if x > 0.0:
+            for y in (bottom, top):
+                discriminant = s2*s2*x*x - 4*k*x*x*(k*x*x + y)
+                if discriminant >= 0:
+                    root = sqrt(discriminant)
+                    slopes.append((s2*x + root)/(2*k*x*x))
+                    slopes.append((s2*x - root)/(2*k*x*x))
+    # highest point on the bottom edge: s2*s2*t*t = 4*k*bottom*(1 + t*t), at x = s2*t/(2*k*(1 + t*t))
+    if bottom > 0.0 and s2*s2 > 4*k*bottom:
+        t = sqrt(4*k*bottom/(s2*s2 - 4*k*bottom))
+        x = s2*t/(2*k*(1 + t*t))
+        if left < x and x < right:
+            slopes.append(t)
+    angles = []
+    for t in slopes:
+        angle = atan(t) + (turns*pi) - offset
+        if start < angle and angle < end:
+            angles.append(angle)
+    return angles
+
+
+
+
+# the distinct objects of the given type that are hit first over some range of angles
+
+def find_first_hit_objects(intervals, object_type):
+    first_hit_objects = []
+    found = set()
+    for interval in intervals:
+        for hit in interval[2]:
+            if hit[1] == object_type and id(hit[2]) not in found:
+                found.add(id(hit[2]))
+                first_hit_objects.append(hit[2])
+    return first_hit_objects
+
+
+
+
+# versions of find_reachable_blocks, find_unprotected_pigs and find_hittable_pigs that query the first hit intervals (each object is given once)
+
+def find_reachable_blocks_adaptive(complete_locations,final_pig_positions,selected_other,final_platforms):
+    return find_first_hit_objects(find_first_hit_intervals(complete_locations, final_pig_positions, selected_other, final_platforms), 'block')
+
+def find_unprotected_pigs_adaptive(complete_locations,final_pig_positions,selected_other,final_platforms):
+    return find_first_hit_objects(find_first_hit_intervals(complete_locations, final_pig_positions, selected_other, final_platforms), 'pig')
+
+def find_hittable_pigs_adaptive(complete_locations,final_pig_positions,selected_other,final_platforms):
+    return find_first_hit_objects(find_first_hit_intervals([], final_pig_positions, [], final_platforms), 'pig')
+
+
+
+
 # determins which blocks are vulnerable (are reachable and there removal affects a large number of blocks/pigs)
 
 def find_vulnerable_blocks(complete_locations,final_pig_positions,selected_other,final_platforms):
@@ -1492,15 +1975,16 @@ def find_vulnerable_blocks(complete_locations,final_pig_positions,selected_other
 
     # remove duplicate blocks
     reachable_blocks = []
+    reachable_ids = set()
     for i in reachable_blocks_dup:
-        if i not in reachable_blocks:
+        if object_id(i) not in reachable_ids:
+            reachable_ids.add(object_id(i))
             reachable_blocks.append(i)
 
     vulnerable_scores = []
     for block in reachable_blocks:
         score = 0
-        temp_locations = [item for sublist in complete_locations for item in sublist]
-        temp_locations.remove(block)
+        temp_locations = [item for sublist in complete_locations for item in sublist if object_id(item) != object_id(block)]
         to_remove = [1]
 
         while(to_remove != []):
@@ -1525,7 +2009,7 @@ def find_vulnerable_blocks(complete_locations,final_pig_positions,selected_other
 
                 error_buffer = 0.01             # rounding errors can sometimes cause inaccuracies for checking edges
                 for block2 in temp_locations:
-                    if block2 != item:
+                    if object_id(block2) != object_id(item):
                         if (block2[1]-error_buffer-(blocks[str(block2[0])][0]/2.0) <= edge1_point[0] and
                             block2[1]+error_buffer+(blocks[str(block2[0])][0]/2.0) >= edge1_point[0] and
                             block2[2]-error_buffer-(blocks[str(block2[0])][1]/2.0) <= edge1_point[1] and
@@ -1573,8 +2057,8 @@ def find_vulnerable_blocks(complete_locations,final_pig_positions,selected_other
                         score = score + 1
                         to_remove.append(item) 
 
-            for i in to_remove:
-                temp_locations.remove(i)
+            removed_ids = set([object_id(i) for i in to_remove])
+            temp_locations = [item for item in temp_locations if object_id(item) not in removed_ids]
 
         for other in selected_other:
             other_fine = False
@@ -1636,94 +2120,104 @@ def find_vulnerable_blocks(complete_locations,final_pig_positions,selected_other
 def protect_vulnerable_blocks1(complete_locations, complete_ground_locations, final_platforms, vulnerable_blocks, final_pig_positions, selected_other):
     vulnerable_blocks.sort(key=lambda x: x[2])
     vulnerable_blocks.reverse()
+    ground_id_to_structure = build_object_index(complete_ground_locations)[1]
     for vul in vulnerable_blocks:
-        for structure in complete_ground_locations:
-            if vul in structure:
-                leftmost_point = vul[1]-(blocks[str(vul[0])][0]/2.0)
-                if (far_left == True):
-                    for block in structure:
-                        if block[1]-(blocks[str(block[0])][0]/2.0) < leftmost_point:
-                            leftmost_point = block[1]-(blocks[str(block[0])][0]/2.0)
+        if object_id(vul) in ground_id_to_structure:
+            structure = complete_ground_locations[ground_id_to_structure[object_id(vul)]]
+            leftmost_point = vul[1]-(blocks[str(vul[0])][0]/2.0)
+            if (far_left == True):
+                for block in structure:
+                    if block[1]-(blocks[str(block[0])][0]/2.0) < leftmost_point:
+                        leftmost_point = block[1]-(blocks[str(block[0])][0]/2.0)
 
-                buffer = uniform(buffer_min,buffer_max)
-                height_limit = vul[2] + (blocks[str(vul[0])][1]/2.0) + height_bonus
+            buffer = uniform(buffer_min,buffer_max)
+            height_limit = vul[2] + (blocks[str(vul[0])][1]/2.0) + height_bonus
 
-                number_attempts = 0                      
-                new_stack = []
-                overlap = True
-                    
-                while (number_attempts < max_number_attempts):
-
-                    if (overlap == False):
-                        new_stack.append(new_block)
-                        number_attempts = 0
-                    overlap = False
-                    choosen_item = choose_item(probability_table_blocks)
-                    if new_stack == []:
-                        x_position = leftmost_point - blocks[str(choosen_item)][0]/2.0 - buffer 
-                        new_block = [choosen_item, x_position, absolute_ground+(blocks[str(choosen_item)][1]/2.0)]
-                    else:
-                        new_block = [choosen_item, x_position, new_stack[-1][2] + (blocks[str(new_stack[-1][0])][1]/2.0) + (blocks[str(choosen_item)][1]/2.0)]
-
-                    for structure in complete_locations:
-                        for block in structure:
-                            if ( round((new_block[1] - (blocks[str(new_block[0])][0]/2.0)),10) <= round((block[1] + blocks[str(block[0])][0]/2),10) and
-                             round((new_block[1] + (blocks[str(new_block[0])][0]/2.0)),10) >= round((block[1] - blocks[str(block[0])][0]/2),10) and
-                             round((new_block[2] + (blocks[str(new_block[0])][1]/2.0)),10) >= round((block[2] - blocks[str(block[0])][1]/2),10) and
-                             round((new_block[2] - (blocks[str(new_block[0])][1]/2.0)),10) <= round((block[2] + blocks[str(block[0])][1]/2),10)):
-                                overlap = True
-                                number_attempts = number_attempts + 1
-                                
-                    for platforms in final_platforms:
-                        for platform in platforms:
-                            if ( round((new_block[1] - (blocks[str(new_block[0])][0]/2.0)),10) <= round((platform[0] + platform_distance_buffer + platform_size[0]/2),10) and
-                             round((new_block[1] + (blocks[str(new_block[0])][0]/2.0)),10) >= round((platform[0] - platform_distance_buffer - platform_size[0]/2),10) and
-                             round((new_block[2] + (blocks[str(new_block[0])][1]/2.0)),10) >= round((platform[1] - platform_distance_buffer - platform_size[1]/2),10) and
-                             round((new_block[2] - (blocks[str(new_block[0])][1]/2.0)),10) <= round((platform[1] + platform_distance_buffer + platform_size[1]/2),10)):
-                                overlap = True
-                                number_attempts = number_attempts + 1
+            number_attempts = 0                      
+            new_stack = []
+            overlap = True
+                
+            while (number_attempts < max_number_attempts):
 
-                    for pig in final_pig_positions:
-                        if ( round((new_block[1] - (blocks[str(new_block[0])][0]/2.0)),10) <= round((pig[0] + pig_size[0]/2),10) and
-                         round((new_block[1] + (blocks[str(new_block[0])][0]/2.0)),10) >= round((pig[0] - pig_size[0]/2),10) and
-                         round((new_block[2] + (blocks[str(new_block[0])][1]/2.0)),10) >= round((pig[1] - pig_size[1]/2),10) and
-                         round((new_block[2] - (blocks[str(new_block[0])][1]/2.0)),10) <= round((pig[1] + pig_size[1]/2),10)):
+                if (overlap == False):
+                    new_stack.append(new_block)
+                    number_attempts = 0
+                overlap = False
+                count_work('protect_stack_attempts')
+                count_work('aabb_checks', count_objects(complete_locations) + count_objects(final_platforms) + len(final_pig_positions) + len(selected_other))
+                choosen_item = sample_item(block_sampler)
+                if new_stack == []:
+                    x_position = leftmost_point - blocks[str(choosen_item)][0]/2.0 - buffer 
+                    new_block = [choosen_item, x_position, absolute_ground+(blocks[str(choosen_item)][1]/2.0), new_object_id()]
+                else:
+                    new_block = [choosen_item, x_position, new_stack[-1][2] + (blocks[str(new_stack[-1][0])][1]/2.0) + (blocks[str(choosen_item)][1]/2.0), new_object_id()]
+
+                for structure in complete_locations:
+                    for block in structure:
+                        if ( rounded((new_block[1] - (blocks[str(new_block[0])][0]/2.0))) <= rounded((block[1] + blocks[str(block[0])][0]/2)) and
+                         rounded((new_block[1] + (blocks[str(new_block[0])][0]/2.0))) >= rounded((block[1] - blocks[str(block[0])][0]/2)) and
+                         rounded((new_block[2] + (blocks[str(new_block[0])][1]/2.0))) >= rounded((block[2] - blocks[str(block[0])][1]/2)) and
+                         rounded((new_block[2] - (blocks[str(new_block[0])][1]/2.0))) <= rounded((block[2] + blocks[str(block[0])][1]/2))):
                             overlap = True
                             number_attempts = number_attempts + 1
-
-                    for block in selected_other:
-                        if ( round((new_block[1] - (blocks[str(new_block[0])][0]/2.0)),10) <= round((block[1] + additional_object_sizes[str(block[0])][0]/2),10) and
-                         round((new_block[1] + (blocks[str(new_block[0])][0]/2.0)),10) >= round((block[1] - additional_object_sizes[str(block[0])][0]/2),10) and
-                         round((new_block[2] + (blocks[str(new_block[0])][1]/2.0)),10) >= round((block[2] - additional_object_sizes[str(block[0])][1]/2),10) and
-                         round((new_block[2] - (blocks[str(new_block[0])][1]/2.0)),10) <= round((block[2] + additional_object_sizes[str(block[0])][1]/2),10)):
+                            
+                for platforms in final_platforms:
+                    for platform in platforms:
+                        if ( rounded((new_block[1] - (blocks[str(new_block[0])][0]/2.0))) <= rounded((platform[0] + platform_distance_buffer + platform_size[0]/2)) and
+                         rounded((new_block[1] + (blocks[str(new_block[0])][0]/2.0))) >= rounded((platform[0] - platform_distance_buffer - platform_size[0]/2)) and
+                         rounded((new_block[2] + (blocks[str(new_block[0])][1]/2.0))) >= rounded((platform[1] - platform_distance_buffer - platform_size[1]/2)) and
+                         rounded((new_block[2] - (blocks[str(new_block[0])][1]/2.0))) <= rounded((platform[1] + platform_distance_buffer + platform_size[1]/2))):
                             overlap = True
                             number_attempts = number_attempts + 1
 
-                    if (new_block[2] + (blocks[str(new_block[0])][1]/2.0) > height_limit) and (overlap == False):
-                        new_stack.append(new_block)
-                        number_attempts = max_number_attempts
+                for pig in final_pig_positions:
+                    if ( rounded((new_block[1] - (blocks[str(new_block[0])][0]/2.0))) <= rounded((pig[0] + pig_size[0]/2)) and
+                     rounded((new_block[1] + (blocks[str(new_block[0])][0]/2.0))) >= rounded((pig[0] - pig_size[0]/2)) and
+                     rounded((new_block[2] + (blocks[str(new_block[0])][1]/2.0))) >= rounded((pig[1] - pig_size[1]/2)) and
+                     rounded((new_block[2] - (blocks[str(new_block[0])][1]/2.0))) <= rounded((pig[1] + pig_size[1]/2))):
+                        overlap = True
+                        number_attempts = number_attempts + 1
+
+                for block in selected_other:
+                    if ( rounded((new_block[1] - (blocks[str(new_block[0])][0]/2.0))) <= rounded((block[1] + additional_object_sizes[str(block[0])][0]/2)) and
+                     rounded((new_block[1] + (blocks[str(new_block[0])][0]/2.0))) >= rounded((block[1] - additional_object_sizes[str(block[0])][0]/2)) and
+                     rounded((new_block[2] + (blocks[str(new_block[0])][1]/2.0))) >= rounded((block[2] - additional_object_sizes[str(block[0])][1]/2)) and
+                     rounded((new_block[2] - (blocks[str(new_block[0])][1]/2.0))) <= rounded((block[2] + additional_object_sizes[str(block[0])][1]/2))):
+                        overlap = True
+                        number_attempts = number_attempts + 1
 
-                if (new_stack != []):
-                    complete_locations.append(new_stack)
-                    print("")
-                    print("vul 1: ", new_stack)
+                if (new_block[2] + (blocks[str(new_block[0])][1]/2.0) > height_limit) and (overlap == False):
+                    new_stack.append(new_block)
+                    number_attempts = max_number_attempts
+
+            if (new_stack != []):
+                complete_locations.append(new_stack)
+                print("")
+                print("vul 1: ", new_stack)
 
     return complete_locations
 
 
 
 
+# the rounded edges (left, right, bottom, top) of an object of the given size centred at x, y
+
+def rounded_bounds(x, y, size):
+    return rounded(x-(size[0]/2.0)), rounded(x+(size[0]/2.0)), rounded(y-(size[1]/2.0)), rounded(y+(size[1]/2.0))
+
+
+
+
 # finds the blocks in complete_locations that are directly supported by block
 
 def find_above_blocks(block,complete_locations):
     above_blocks = []
+    left, right, bottom, top = rounded_bounds(block[1], block[2], blocks[str(block[0])])
     for structure in complete_locations:
         for block2 in structure:
             if block2[2] > block[2]+(blocks[str(block[0])][1]/2.0):
-                if ( (round(block[1]-(blocks[str(block[0])][0]/2.0),10) <= round((block2[1]+(blocks[str(block2[0])][0]/2)),10))
-                and (round(block[1]+(blocks[str(block[0])][0]/2.0),10) >= round((block2[1]-(blocks[str(block2[0])][0]/2)),10))
-                and (round(block[2]-(blocks[str(block[0])][1]/2.0),10) <= round((block2[2]+(blocks[str(block2[0])][1]/2)),10))
-                and (round(block[2]+(blocks[str(block[0])][1]/2.0),10) >= round((block2[2]-(blocks[str(block2[0])][1]/2)),10)) ):
+                left2, right2, bottom2, top2 = rounded_bounds(block2[1], block2[2], blocks[str(block2[0])])
+                if left <= right2 and right >= left2 and bottom <= top2 and top >= bottom2:
                     above_blocks.append(block2)
     return above_blocks
 
@@ -1733,50 +2227,27 @@ def find_above_blocks(block,complete_locations):
 # finds the blocks in complete_locations that directly support block (and functions for other object types)
 
 def find_below_blocks(block,complete_locations):
-    below_blocks = []
-    for structure in complete_locations:
-        for block2 in structure:
-            if block2[2] < block[2]-(blocks[str(block[0])][1]/2.0):
-                if ( (round(block[1]-(blocks[str(block[0])][0]/2.0),10) <= round((block2[1]+(blocks[str(block2[0])][0]/2)),10))
-                and (round(block[1]+(blocks[str(block[0])][0]/2.0),10) >= round((block2[1]-(blocks[str(block2[0])][0]/2)),10))
-                and (round(block[2]-(blocks[str(block[0])][1]/2.0),10) <= round((block2[2]+(blocks[str(block2[0])][1]/2)),10))
-                and (round(block[2]+(blocks[str(block[0])][1]/2.0),10) >= round((block2[2]-(blocks[str(block2[0])][1]/2)),10)) ):
-                    below_blocks.append(block2)
-    return below_blocks
+    return find_below_bounds(rounded_bounds(block[1], block[2], blocks[str(block[0])]), block[2]-(blocks[str(block[0])][1]/2.0), complete_locations)
 
 def find_below_blocks_other(block,complete_locations):
-    below_blocks = []
-    for structure in complete_locations:
-        for block2 in structure:
-            if block2[2] < block[2]-(additional_object_sizes[str(block[0])][1]/2.0):
-                if ( (round(block[1]-(additional_object_sizes[str(block[0])][0]/2.0),10) <= round((block2[1]+(blocks[str(block2[0])][0]/2)),10))
-                and (round(block[1]+(additional_object_sizes[str(block[0])][0]/2.0),10) >= round((block2[1]-(blocks[str(block2[0])][0]/2)),10))
-                and (round(block[2]-(additional_object_sizes[str(block[0])][1]/2.0),10) <= round((block2[2]+(blocks[str(block2[0])][1]/2)),10))
-                and (round(block[2]+(additional_object_sizes[str(block[0])][1]/2.0),10) >= round((block2[2]-(blocks[str(block2[0])][1]/2)),10)) ):
-                    below_blocks.append(block2)
-    return below_blocks
+    return find_below_bounds(rounded_bounds(block[1], block[2], additional_object_sizes[str(block[0])]), block[2]-(additional_object_sizes[str(block[0])][1]/2.0), complete_locations)
 
 def find_below_blocks_tnt(tnt,complete_locations):
-    below_blocks = []
-    for structure in complete_locations:
-        for block2 in structure:
-            if block2[2] < tnt[1]-(tnt_size[1]/2.0):
-                if ( (round(tnt[0]-(tnt_size[0]/2.0),10) <= round((block2[1]+(blocks[str(block2[0])][0]/2)),10))
-                and (round(tnt[0]+(tnt_size[0]/2.0),10) >= round((block2[1]-(blocks[str(block2[0])][0]/2)),10))
-                and (round(tnt[1]-(tnt_size[1]/2.0),10) <= round((block2[2]+(blocks[str(block2[0])][1]/2)),10))
-                and (round(tnt[1]+(tnt_size[1]/2.0),10) >= round((block2[2]-(blocks[str(block2[0])][1]/2)),10)) ):
-                    below_blocks.append(block2)
-    return below_blocks
+    return find_below_bounds(rounded_bounds(tnt[0], tnt[1], tnt_size), tnt[1]-(tnt_size[1]/2.0), complete_locations)
 
 def find_below_blocks_pig(pig,complete_locations):
+    return find_below_bounds(rounded_bounds(pig[0], pig[1], pig_size), pig[1]-(pig_size[1]/2.0), complete_locations)
+
+# the blocks below base (centred lower) that touch or overlap the object with the given rounded edges
+
+def find_below_bounds(bounds, base, complete_locations):
     below_blocks = []
+    left, right, bottom, top = bounds
     for structure in complete_locations:
         for block2 in structure:
-            if block2[2] < pig[1]-(pig_size[1]/2.0):
-                if ( (round(pig[0]-(pig_size[0]/2.0),10) <= round((block2[1]+(blocks[str(block2[0])][0]/2)),10))
-                and (round(pig[0]+(pig_size[0]/2.0),10) >= round((block2[1]-(blocks[str(block2[0])][0]/2)),10))
-                and (round(pig[1]-(pig_size[1]/2.0),10) <= round((block2[2]+(blocks[str(block2[0])][1]/2)),10))
-                and (round(pig[1]+(pig_size[1]/2.0),10) >= round((block2[2]-(blocks[str(block2[0])][1]/2)),10)) ):
+            if block2[2] < base:
+                left2, right2, bottom2, top2 = rounded_bounds(block2[1], block2[2], blocks[str(block2[0])])
+                if left <= right2 and right >= left2 and bottom <= top2 and top >= bottom2:
                     below_blocks.append(block2)
     return below_blocks
 
@@ -1786,6 +2257,7 @@ def find_below_blocks_pig(pig,complete_locations):
 # protects vulnerable blocks by attempting to add more blocks to its current row within the structure (additonal support)
 
 def protect_vulnerable_blocks2(complete_locations,final_platforms,final_pig_positions,selected_other, vulnerable_blocks):
+    id_to_structure = build_object_index(complete_locations)[1]
     for vul in vulnerable_blocks:
         above_blocks = find_above_blocks(vul,complete_locations)
         for y in above_blocks:
@@ -1800,35 +2272,37 @@ def protect_vulnerable_blocks2(complete_locations,final_platforms,final_pig_posi
                 overlap = False
                 valid = False
                 error_buffer = 0.01
+                count_work('protect_row_attempts')
+                count_work('aabb_checks', count_objects(complete_locations) + count_objects(final_platforms) + len(final_pig_positions) + len(selected_other))
 
                 for structure in complete_locations:
                     for block in structure:
-                        if ( round((i[1] - (blocks[str(i[0])][0]/2.0)) + error_buffer,10) <= round((block[1] + blocks[str(block[0])][0]/2),10) and
-                             round((i[1] + (blocks[str(i[0])][0]/2.0)) - error_buffer,10) >= round((block[1] - blocks[str(block[0])][0]/2),10) and
-                             round((i[2] + (blocks[str(i[0])][1]/2.0)) - error_buffer,10) >= round((block[2] - blocks[str(block[0])][1]/2),10) and
-                             round((i[2] - (blocks[str(i[0])][1]/2.0)) + error_buffer,10) <= round((block[2] + blocks[str(block[0])][1]/2),10)):
+                        if ( rounded((i[1] - (blocks[str(i[0])][0]/2.0)) + error_buffer) <= rounded((block[1] + blocks[str(block[0])][0]/2)) and
+                             rounded((i[1] + (blocks[str(i[0])][0]/2.0)) - error_buffer) >= rounded((block[1] - blocks[str(block[0])][0]/2)) and
+                             rounded((i[2] + (blocks[str(i[0])][1]/2.0)) - error_buffer) >= rounded((block[2] - blocks[str(block[0])][1]/2)) and
+                             rounded((i[2] - (blocks[str(i[0])][1]/2.0)) + error_buffer) <= rounded((block[2] + blocks[str(block[0])][1]/2))):
                                 overlap = True
          
                 for platforms in final_platforms:
                     for platform in platforms:
-                        if ( round((i[1] - (blocks[str(i[0])][0]/2.0)) + error_buffer,10) <= round((platform[0] + platform_distance_buffer + platform_size[0]/2),10) and
-                         round((i[1] + (blocks[str(i[0])][0]/2.0)) - error_buffer,10) >= round((platform[0] - platform_distance_buffer - platform_size[0]/2),10) and
-                         round((i[2] + (blocks[str(i[0])][1]/2.0)) - error_buffer,10) >= round((platform[1] - platform_distance_buffer - platform_size[1]/2),10) and
-                         round((i[2] - (blocks[str(i[0])][1]/2.0)) + error_buffer,10) <= round((platform[1] + platform_distance_buffer + platform_size[1]/2),10)):
+                        if ( rounded((i[1] - (blocks[str(i[0])][0]/2.0)) + error_buffer) <= rounded((platform[0] + platform_distance_buffer + platform_size[0]/2)) and
+                         rounded((i[1] + (blocks[str(i[0])][0]/2.0)) - error_buffer) >= rounded((platform[0] - platform_distance_buffer - platform_size[0]/2)) and
+                         rounded((i[2] + (blocks[str(i[0])][1]/2.0)) - error_buffer) >= rounded((platform[1] - platform_distance_buffer - platform_size[1]/2)) and
+                         rounded((i[2] - (blocks[str(i[0])][1]/2.0)) + error_buffer) <= rounded((platform[1] + platform_distance_buffer + platform_size[1]/2))):
                             overlap = True
 
                 for pig in final_pig_positions:
-                    if ( round((i[1] - (blocks[str(i[0])][0]/2.0)) + error_buffer,10) <= round((pig[0] + pig_size[0]/2),10) and
-                     round((i[1] + (blocks[str(i[0])][0]/2.0)) - error_buffer,10) >= round((pig[0] - pig_size[0]/2),10) and
-                     round((i[2] + (blocks[str(i[0])][1]/2.0)) - error_buffer,10) >= round((pig[1] - pig_size[1]/2),10) and
-                     round((i[2] - (blocks[str(i[0])][1]/2.0)) + error_buffer,10) <= round((pig[1] + pig_size[1]/2),10)):
+                    if ( rounded((i[1] - (blocks[str(i[0])][0]/2.0)) + error_buffer) <= rounded((pig[0] + pig_size[0]/2)) and
+                     rounded((i[1] + (blocks[str(i[0])][0]/2.0)) - error_buffer) >= rounded((pig[0] - pig_size[0]/2)) and
+                     rounded((i[2] + (blocks[str(i[0])][1]/2.0)) - error_buffer) >= rounded((pig[1] - pig_size[1]/2)) and
+                     rounded((i[2] - (blocks[str(i[0])][1]/2.0)) + error_buffer) <= rounded((pig[1] + pig_size[1]/2))):
                         overlap = True
 
                 for block in selected_other:
-                    if ( round((i[1] - (blocks[str(i[0])][0]/2.0)) + error_buffer,10) <= round((block[1] + additional_object_sizes[str(block[0])][0]/2),10) and
-                     round((i[1] + (blocks[str(i[0])][0]/2.0)) - error_buffer,10) >= round((block[1] - additional_object_sizes[str(block[0])][0]/2),10) and
-                     round((i[2] + (blocks[str(i[0])][1]/2.0)) - error_buffer,10) >= round((block[2] - additional_object_sizes[str(block[0])][1]/2),10) and
-                     round((i[2] - (blocks[str(i[0])][1]/2.0)) + error_buffer,10) <= round((block[2] + additional_object_sizes[str(block[0])][1]/2),10)):
+                    if ( rounded((i[1] - (blocks[str(i[0])][0]/2.0)) + error_buffer) <= rounded((block[1] + additional_object_sizes[str(block[0])][0]/2)) and
+                     rounded((i[1] + (blocks[str(i[0])][0]/2.0)) - error_buffer) >= rounded((block[1] - additional_object_sizes[str(block[0])][0]/2)) and
+                     rounded((i[2] + (blocks[str(i[0])][1]/2.0)) - error_buffer) >= rounded((block[2] - additional_object_sizes[str(block[0])][1]/2)) and
+                     rounded((i[2] - (blocks[str(i[0])][1]/2.0)) + error_buffer) <= rounded((block[2] + additional_object_sizes[str(block[0])][1]/2))):
                         overlap = True
 
                 center = i[1]
@@ -1849,23 +2323,23 @@ def protect_vulnerable_blocks2(complete_locations,final_platforms,final_pig_posi
                 push_down = 0.01
                 for platforms in final_platforms:
                     for platform in platforms:
-                        if ( round(i[1],10) <= round((platform[0] + platform_size[0]/2),10) and
-                         round(i[1],10) >= round((platform[0] - platform_size[0]/2),10) and
+                        if ( rounded(i[1]) <= rounded((platform[0] + platform_size[0]/2)) and
+                         rounded(i[1]) >= rounded((platform[0] - platform_size[0]/2)) and
                          (i[2] > platform[1]) and
-                         round((i[2] - push_down - (blocks[str(i[0])][1]/2.0)),10) <= round((platform[1] + platform_size[1]/2),10)):
+                         rounded((i[2] - push_down - (blocks[str(i[0])][1]/2.0))) <= rounded((platform[1] + platform_size[1]/2))):
                             center_supported = True
-                        if ( round((i[1] - (blocks[str(i[0])][0]/2.0)),10) <= round((platform[0] + platform_size[0]/2),10) and
-                         round((i[1] - (blocks[str(i[0])][0]/2.0)),10) >= round((platform[0] - platform_size[0]/2),10) and
+                        if ( rounded((i[1] - (blocks[str(i[0])][0]/2.0))) <= rounded((platform[0] + platform_size[0]/2)) and
+                         rounded((i[1] - (blocks[str(i[0])][0]/2.0))) >= rounded((platform[0] - platform_size[0]/2)) and
                          (i[2] > platform[1]) and
-                         round((i[2] - push_down - (blocks[str(i[0])][1]/2.0)),10) <= round((platform[1] + platform_size[1]/2),10)):
+                         rounded((i[2] - push_down - (blocks[str(i[0])][1]/2.0))) <= rounded((platform[1] + platform_size[1]/2))):
                             edge1_supported = True
-                        if ( round((i[1] + (blocks[str(i[0])][0]/2.0)),10) <= round((platform[0] + platform_size[0]/2),10) and
-                         round((i[1] + (blocks[str(i[0])][0]/2.0)),10) >= round((platform[0] - platform_size[0]/2),10) and
+                        if ( rounded((i[1] + (blocks[str(i[0])][0]/2.0))) <= rounded((platform[0] + platform_size[0]/2)) and
+                         rounded((i[1] + (blocks[str(i[0])][0]/2.0))) >= rounded((platform[0] - platform_size[0]/2)) and
                          (i[2] > platform[1]) and
-                         round((i[2] - push_down - (blocks[str(i[0])][1]/2.0)),10) <= round((platform[1] + platform_size[1]/2),10)):
+                         rounded((i[2] - push_down - (blocks[str(i[0])][1]/2.0))) <= rounded((platform[1] + platform_size[1]/2))):
                             edge2_supported = True
 
-                if (round((i[2] - push_down - (blocks[str(i[0])][1]/2.0)),10) <= absolute_ground):
+                if (rounded(i[2] - push_down - (blocks[str(i[0])][1]/2.0)) <= rounded(absolute_ground)):
                     center_supported = True
                     edge1_supported = True
                     edge2_supported = True
@@ -1881,32 +2355,81 @@ def protect_vulnerable_blocks2(complete_locations,final_platforms,final_pig_posi
                         valid = True
                               
                 if (overlap == False) and (valid == True):
-                    for j in range(len(complete_locations)):
-                        if vul in complete_locations[j]:
-                            complete_locations[j].append(i)
-                            print("")
-                            print("vul 2: ", i)
+                    if object_id(vul) in id_to_structure:
+                        i.append(new_object_id())
+                        complete_locations[id_to_structure[object_id(vul)]].append(i)
+                        print("")
+                        print("vul 2: ", i)
 
     return complete_locations
 
 
 
 
-# write level out in desired xml format
+# set the material and rotation of each additional block (chosen randomly, triangles face either way)
+
+def set_other_materials(selected_other):
+    other_materials = []
+    for i in selected_other:
+        material = materials[str(sample_item(other_material_samplers.get(str(i[0]), material_sampler)))]   # material is chosen randomly from those allowed for the block type
+        rotation = '0'
+        if i[0] == '2':
+            facing = randint(0,1)
+            rotation = str(facing*90.0)
+        other_materials.append([material, rotation])
+    return other_materials
+
+
+
+
+# templates used when writing levels out in xml format
+
+level_xml_header = ('<?xml version="1.0" encoding="utf-16"?>\n'
+                    '<Level width ="2">\n'
+                    '<Camera x="0" y="2" minWidth="20" maxWidth="30">\n'
+                    '<Birds>\n')
+level_xml_slingshot = ('</Birds>\n'
+                       '<Slingshot x="-8" y="-2.5">\n'
+                       '<GameObjects>\n')
+level_xml_footer = ('</GameObjects>\n'
+                    '</Level>\n')
+bird_xml_template = '<Bird type="%s"/>\n'
+block_xml_template = '<Block type="%s" material="%s" x="%s" y="%s" rotation="%s" />\n'
+pig_xml_template = '<Pig type="BasicSmall" material="" x="%s" y="%s" rotation="0" />\n'
+tnt_xml_template = '<TNT type="" x="%s" y="%s" rotation="0" />\n'
+platform_xml_template = '<Platform type="Platform" material="" x="%s" y="%s" />\n'
+angled_platform_xml_template = '<Platform type="Platform" material="" x="%s" y="%s" rotation="%s" scaleX="%s" />\n'
 
-def write_level_xml(final_blocks, selected_other, final_pig_positions, final_platforms, number_birds, bird_order, final_materials, final_tnt_positions, extra_platforms_angled, current_level, restricted_combinations):
+coordinate_precision = 5        # number of decimal places written for coordinates (None writes the full float value)
+compress_levels = False         # write levels as gzip compressed files (level-xx.xml.gz)
+output_sink = None              # where levels are written (see level_sinks.py), set from the command line
 
-    f = open("level-%s.xml" % current_level, "w")
 
-    f.write('<?xml version="1.0" encoding="utf-16"?>\n')
-    f.write('<Level width ="2">\n')
-    f.write('<Camera x="0" y="2" minWidth="20" maxWidth="30">\n')
-    f.write('<Birds>\n')
+
+
+# formats a coordinate with the set precision, dropping trailing zeros
+
+def format_coordinate(value):
+    if coordinate_precision == None:
+        return str(value)
+    text = '%.*f' % (coordinate_precision, value)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text == '-0':
+        text = '0'
+    return text
+
+
+
+
+# builds the level in the desired xml format as a single string
+
+def level_xml_string(final_blocks, selected_other, final_pig_positions, final_platforms, number_birds, bird_order, final_materials, final_tnt_positions, extra_platforms_angled, other_materials):
+
+    level_xml = [level_xml_header]
     for i in range(number_birds):
-        f.write('<Bird type="%s"/>\n' % bird_types_index[str((bird_order[i]))])
-    f.write('</Birds>\n')
-    f.write('<Slingshot x="-8" y="-2.5">\n')
-    f.write('<GameObjects>\n')
+        level_xml.append(bird_xml_template % bird_types_index[str((bird_order[i]))])
+    level_xml.append(level_xml_slingshot)
 
     for index in range(len(final_blocks)):
         i = final_blocks[index]
@@ -1914,40 +2437,43 @@ def write_level_xml(final_blocks, selected_other, final_pig_positions, final_pla
         rotation = 0
         if (i[0] in (3,7,9,11,13)):
             rotation = 90
-        f.write('<Block type="%s" material="%s" x="%s" y="%s" rotation="%s" />\n' % (block_names[str(i[0])],materials[str(j)], str(i[1]), str(i[2]), str(rotation)))
+        level_xml.append(block_xml_template % (block_names[str(i[0])], materials[str(j)], format_coordinate(i[1]), format_coordinate(i[2]), rotation))
 
-    for i in selected_other:
-        material = materials[str(choose_item(probability_table_materials))]       # material is chosen randomly
-        while [material,additional_objects[str(i[0])]] in restricted_combinations:      # if material if not allowed for block type then pick again
-            material = materials[str(choose_item(probability_table_materials))]
-        if i[0] == '1':
-            f.write('<Block type="%s" material="%s" x="%s" y="%s" rotation="0" />\n' % (additional_objects[i[0]], material, str(i[1]), str(i[2])))
-        if i[0] == '2':
-            facing = randint(0,1)
-            f.write('<Block type="%s" material="%s" x="%s" y="%s" rotation="%s" />\n' % (additional_objects[i[0]], material, str(i[1]), str(i[2]), str(facing*90.0)))
-        if i[0] == '3':
-            f.write('<Block type="%s" material="%s" x="%s" y="%s" rotation="0" />\n' % (additional_objects[i[0]], material, str(i[1]), str(i[2])))
-        if i[0] == '4':
-            f.write('<Block type="%s" material="%s" x="%s" y="%s" rotation="0" />\n' % (additional_objects[i[0]], material, str(i[1]), str(i[2])))
+    for index in range(len(selected_other)):
+        i = selected_other[index]
+        material, rotation = other_materials[index]
+        level_xml.append(block_xml_template % (additional_objects[i[0]], material, format_coordinate(i[1]), format_coordinate(i[2]), rotation))
 
     for i in final_pig_positions:
-        f.write('<Pig type="BasicSmall" material="" x="%s" y="%s" rotation="0" />\n' % (str(i[0]),str(i[1])))
+        level_xml.append(pig_xml_template % (format_coordinate(i[0]), format_coordinate(i[1])))
 
     for i in final_tnt_positions:
-        f.write('<TNT type="" x="%s" y="%s" rotation="0" />\n' % (str(i[0]),str(i[1])))
-        
+        level_xml.append(tnt_xml_template % (format_coordinate(i[0]), format_coordinate(i[1])))
 
     for i in final_platforms:
         for j in i:
-            f.write('<Platform type="Platform" material="" x="%s" y="%s" />\n' % (str(j[0]),str(j[1])))
+            level_xml.append(platform_xml_template % (format_coordinate(j[0]), format_coordinate(j[1])))
 
     for i in extra_platforms_angled:
-            f.write('<Platform type="Platform" material="" x="%s" y="%s" rotation="%s" scaleX="%s" />\n' % (str(i[0]),str(i[1]),str(i[2]),str(i[3])))
-        
-    f.write('</GameObjects>\n')
-    f.write('</Level>\n')
+        level_xml.append(angled_platform_xml_template % (format_coordinate(i[0]), format_coordinate(i[1]), format_coordinate(i[2]), format_coordinate(i[3])))
 
-    f.close()
+    level_xml.append(level_xml_footer)
+
+    return ''.join(level_xml)
+
+
+
+
+# write level out in desired xml format to the output sink (one file per level in the current directory if not set)
+
+def write_level_xml(final_blocks, selected_other, final_pig_positions, final_platforms, number_birds, bird_order, final_materials, final_tnt_positions, extra_platforms_angled, current_level, other_materials):
+
+    level_xml = level_xml_string(final_blocks, selected_other, final_pig_positions, final_platforms, number_birds, bird_order, final_materials, final_tnt_positions, extra_platforms_angled, other_materials)
+
+    sink = output_sink
+    if sink == None:
+        sink = open_sink('directory', '.', compress_levels)
+    write_to_sink(sink, "level-%s.xml" % current_level, level_xml)
 
 
 
@@ -2027,8 +2553,14 @@ def write_structure_xml(all_structures,structure_others,structure_pigs,structure
 def swap_blocks(complete_locations, final_pig_positions, final_platforms):
     if (block_swapping == True):
         total_swaps = 0
+        out_of_time = False
         for i in range(len(complete_locations)):
+            if out_of_time == True:
+                break
             for j in range(len(complete_locations[i])):
+                if stage_deadline_passed('swap_blocks'):        # out of time, leave the remaining blocks (of every structure) as they are
+                    out_of_time = True
+                    break
                 test_blocks = []
                 test_complete_locations = deepcopy(complete_locations)
                 test_complete_locations[i].pop(j);
@@ -2062,28 +2594,30 @@ def swap_blocks(complete_locations, final_pig_positions, final_platforms):
                         pigs_supported = True
                         error_buffer = 0.01
 
+                        # rounded edges of the test block (shrunk by the error buffer)
+                        test_left = rounded((test_block[1] - (blocks[str(test_block[0])][0]/2.0)) + error_buffer)
+                        test_right = rounded((test_block[1] + (blocks[str(test_block[0])][0]/2.0)) - error_buffer)
+                        test_top = rounded((test_block[2] + (blocks[str(test_block[0])][1]/2.0)) - error_buffer)
+                        test_bottom = rounded((test_block[2] - (blocks[str(test_block[0])][1]/2.0)) + error_buffer)
+
                         for structure in test_complete_locations:
                             for block in structure:
-                                if ( round((test_block[1] - (blocks[str(test_block[0])][0]/2.0)) + error_buffer,10) <= round((block[1] + blocks[str(block[0])][0]/2),10) and
-                                     round((test_block[1] + (blocks[str(test_block[0])][0]/2.0)) - error_buffer,10) >= round((block[1] - blocks[str(block[0])][0]/2),10) and
-                                     round((test_block[2] + (blocks[str(test_block[0])][1]/2.0)) - error_buffer,10) >= round((block[2] - blocks[str(block[0])][1]/2),10) and
-                                     round((test_block[2] - (blocks[str(test_block[0])][1]/2.0)) + error_buffer,10) <= round((block[2] + blocks[str(block[0])][1]/2),10)):
-                                        overlap = True
+                                left, right, bottom, top = rounded_bounds(block[1], block[2], blocks[str(block[0])])
+                                if test_left <= right and test_right >= left and test_top >= bottom and test_bottom <= top:
+                                    overlap = True
                  
                         for platforms in final_platforms:
                             for platform in platforms:
-                                if ( round((test_block[1] - (blocks[str(test_block[0])][0]/2.0)) + error_buffer,10) <= round((platform[0] + platform_distance_buffer + platform_size[0]/2),10) and
-                                     round((test_block[1] + (blocks[str(test_block[0])][0]/2.0)) - error_buffer,10) >= round((platform[0] - platform_distance_buffer - platform_size[0]/2),10) and
-                                     round((test_block[2] + (blocks[str(test_block[0])][1]/2.0)) - error_buffer,10) >= round((platform[1] - platform_distance_buffer - platform_size[1]/2),10) and
-                                     round((test_block[2] - (blocks[str(test_block[0])][1]/2.0)) + error_buffer,10) <= round((platform[1] + platform_distance_buffer + platform_size[1]/2),10)):
+                                if ( test_left <= rounded((platform[0] + platform_distance_buffer + platform_size[0]/2)) and
+                                     test_right >= rounded((platform[0] - platform_distance_buffer - platform_size[0]/2)) and
+                                     test_top >= rounded((platform[1] - platform_distance_buffer - platform_size[1]/2)) and
+                                     test_bottom <= rounded((platform[1] + platform_distance_buffer + platform_size[1]/2))):
                                         overlap = True
 
                         for pig in final_pig_positions:
-                            if ( round((test_block[1] - (blocks[str(test_block[0])][0]/2.0)) + error_buffer,10) <= round((pig[0] + pig_size[0]/2),10) and
-                                 round((test_block[1] + (blocks[str(test_block[0])][0]/2.0)) - error_buffer,10) >= round((pig[0] - pig_size[0]/2),10) and
-                                 round((test_block[2] + (blocks[str(test_block[0])][1]/2.0)) - error_buffer,10) >= round((pig[1] - pig_size[1]/2),10) and
-                                 round((test_block[2] - (blocks[str(test_block[0])][1]/2.0)) + error_buffer,10) <= round((pig[1] + pig_size[1]/2),10)):
-                                    overlap = True
+                            left, right, bottom, top = rounded_bounds(pig[0], pig[1], pig_size)
+                            if test_left <= right and test_right >= left and test_top >= bottom and test_bottom <= top:
+                                overlap = True
 
                         # check that all stability requirements are still met for all blocks/pigs in rows above and below (and for self)
                         
@@ -2115,23 +2649,23 @@ def swap_blocks(complete_locations, final_pig_positions, final_platforms):
                             push_down = 0.01
                             for platforms in final_platforms:
                                 for platform in platforms:
-                                    if ( round(test_blockx[1],10) <= round((platform[0] + platform_size[0]/2),10) and
-                                     round(test_blockx[1],10) >= round((platform[0] - platform_size[0]/2),10) and
+                                    if ( rounded(test_blockx[1]) <= rounded((platform[0] + platform_size[0]/2)) and
+                                     rounded(test_blockx[1]) >= rounded((platform[0] - platform_size[0]/2)) and
                                      (test_blockx[2] > platform[1]) and
-                                     round((test_blockx[2] - push_down - (blocks[str(test_blockx[0])][1]/2.0)),10) <= round((platform[1] + platform_size[1]/2),10)):
+                                     rounded((test_blockx[2] - push_down - (blocks[str(test_blockx[0])][1]/2.0))) <= rounded((platform[1] + platform_size[1]/2))):
                                         center_supported = True
-                                    if ( round((test_blockx[1] - (blocks[str(test_blockx[0])][0]/2.0)),10) <= round((platform[0] + platform_size[0]/2),10) and
-                                     round((test_blockx[1] - (blocks[str(test_blockx[0])][0]/2.0)),10) >= round((platform[0] - platform_size[0]/2),10) and
+                                    if ( rounded((test_blockx[1] - (blocks[str(test_blockx[0])][0]/2.0))) <= rounded((platform[0] + platform_size[0]/2)) and
+                                     rounded((test_blockx[1] - (blocks[str(test_blockx[0])][0]/2.0))) >= rounded((platform[0] - platform_size[0]/2)) and
                                      (test_blockx[2] > platform[1]) and
-                                     round((test_blockx[2] - push_down - (blocks[str(test_blockx[0])][1]/2.0)),10) <= round((platform[1] + platform_size[1]/2),10)):
+                                     rounded((test_blockx[2] - push_down - (blocks[str(test_blockx[0])][1]/2.0))) <= rounded((platform[1] + platform_size[1]/2))):
                                         edge1_supported = True
-                                    if ( round((test_blockx[1] + (blocks[str(test_blockx[0])][0]/2.0)),10) <= round((platform[0] + platform_size[0]/2),10) and
-                                     round((test_blockx[1] + (blocks[str(test_blockx[0])][0]/2.0)),10) >= round((platform[0] - platform_size[0]/2),10) and
+                                    if ( rounded((test_blockx[1] + (blocks[str(test_blockx[0])][0]/2.0))) <= rounded((platform[0] + platform_size[0]/2)) and
+                                     rounded((test_blockx[1] + (blocks[str(test_blockx[0])][0]/2.0))) >= rounded((platform[0] - platform_size[0]/2)) and
                                      (test_blockx[2] > platform[1]) and
-                                     round((test_blockx[2] - push_down - (blocks[str(test_blockx[0])][1]/2.0)),10) <= round((platform[1] + platform_size[1]/2),10)):
+                                     rounded((test_blockx[2] - push_down - (blocks[str(test_blockx[0])][1]/2.0))) <= rounded((platform[1] + platform_size[1]/2))):
                                         edge2_supported = True
 
-                            if (round((test_blockx[2] - push_down - (blocks[str(test_blockx[0])][1]/2.0)),10) <= absolute_ground):
+                            if (rounded(test_blockx[2] - push_down - (blocks[str(test_blockx[0])][1]/2.0)) <= rounded(absolute_ground)):
                                 center_supported = True
                                 edge1_supported = True
                                 edge2_supported = True
@@ -2156,10 +2690,10 @@ def swap_blocks(complete_locations, final_pig_positions, final_platforms):
                             pig_supported = False
                             for structure in test_complete_locations2:
                                 for block in structure:
-                                    if ( round((block[1] - (blocks[str(block[0])][0]/2.0)) + error_buffer,10) <= round((pig[0]),10) and
-                                         round((block[1] + (blocks[str(block[0])][0]/2.0)) - error_buffer,10) >= round((pig[0]),10) and
-                                         round((block[2] + (blocks[str(block[0])][1]/2.0)) - error_buffer,10) >= round((pig[1] - pig_size[1]/2 - 0.01),10) and
-                                         round((block[2] - (blocks[str(block[0])][1]/2.0)) + error_buffer,10) <= round((pig[1] - pig_size[1]/2 - 0.01),10)):
+                                    if ( rounded((block[1] - (blocks[str(block[0])][0]/2.0)) + error_buffer) <= rounded((pig[0])) and
+                                         rounded((block[1] + (blocks[str(block[0])][0]/2.0)) - error_buffer) >= rounded((pig[0])) and
+                                         rounded((block[2] + (blocks[str(block[0])][1]/2.0)) - error_buffer) >= rounded((pig[1] - pig_size[1]/2 - 0.01)) and
+                                         rounded((block[2] - (blocks[str(block[0])][1]/2.0)) + error_buffer) <= rounded((pig[1] - pig_size[1]/2 - 0.01))):
                                             pig_supported = True
 
                             if pig_supported == False:
@@ -2188,17 +2722,18 @@ def protect_vulnerable_blocks(complete_locations, complete_ground_locations, fin
         vulnerable_blocks = find_vulnerable_blocks(complete_locations,final_pig_positions,selected_other,final_platforms)
         print("")
         print ("vulnerable blocks: ", vulnerable_blocks)
+        # when out of time the remaining protection passes are skipped (the blocks found vulnerable so far are still returned)
         temp_complete_locations = deepcopy(complete_locations)
-        if (protection_method1 == True):
+        if (protection_method1 == True) and not stage_deadline_passed('protect_vulnerable_blocks'):
             complete_locations = protect_vulnerable_blocks1(complete_locations, complete_ground_locations, final_platforms, vulnerable_blocks, final_pig_positions, selected_other)
-        if (vulnerable_blocks != []) and (temp_complete_locations != complete_locations):
+        if (vulnerable_blocks != []) and (temp_complete_locations != complete_locations) and not stage_deadline_passed('protect_vulnerable_blocks'):
             vulnerable_blocks = find_vulnerable_blocks(complete_locations,final_pig_positions,selected_other,final_platforms)
         print("")
         print ("vulnerable blocks: ", vulnerable_blocks)
         temp_complete_locations = deepcopy(complete_locations)
-        if (protection_method2 == True):
+        if (protection_method2 == True) and not stage_deadline_passed('protect_vulnerable_blocks'):
             complete_locations = protect_vulnerable_blocks2(complete_locations,final_platforms,final_pig_positions,selected_other, vulnerable_blocks)
-        if (vulnerable_blocks != []) and (temp_complete_locations != complete_locations):
+        if (vulnerable_blocks != []) and (temp_complete_locations != complete_locations) and not stage_deadline_passed('protect_vulnerable_blocks'):
             vulnerable_blocks = find_vulnerable_blocks(complete_locations,final_pig_positions,selected_other,final_platforms)
         print("")
         print ("vulnerable blocks: ", vulnerable_blocks)
@@ -2209,7 +2744,7 @@ def protect_vulnerable_blocks(complete_locations, complete_ground_locations, fin
 
 # set the material of each block
 
-def set_materials(complete_locations, final_pig_positions, vulnerable_blocks):
+def set_materials(complete_locations, final_pig_positions, vulnerable_blocks, selected_other, final_platforms):
     final_materials = []
     final_blocks = []
     for ii in complete_locations:
@@ -2219,70 +2754,72 @@ def set_materials(complete_locations, final_pig_positions, vulnerable_blocks):
     for i in final_blocks:
         final_materials.append(0)
 
+    block_positions = {}
+    for i in range(len(final_blocks)):
+        block_positions[object_id(final_blocks[i])] = i
+
     if (protection_method3 == True):
+        vulnerable_ids = set([object_id(vul) for vul in vulnerable_blocks])
         for i in range(len(final_blocks)):
-            if final_blocks[i] in vulnerable_blocks:
+            if object_id(final_blocks[i]) in vulnerable_ids:
                 final_materials[i] = 3
 
     index = 0
     blocks_in_way_dup = find_blocks_in_way(complete_locations,final_pig_positions,selected_other,final_platforms)
 
-    blocks_in_way_merged = []
+    blocks_in_way_merged = {}
     blocks_in_way = []
     for trajectory in blocks_in_way_dup:
-        found = 0
-        for pig_traj in blocks_in_way_merged:
-            if trajectory[0] == pig_traj[0]:
-                pig_traj[1] = pig_traj[1]+trajectory[1]
-                found = 1
-        if found == 0:
-            blocks_in_way_merged.append(trajectory)
-    for traj_new in blocks_in_way_merged:
-        blocks_in_way.append(traj_new[1])
+        if object_id(trajectory[0]) in blocks_in_way_merged:
+            blocks_in_way_merged[object_id(trajectory[0])] = blocks_in_way_merged[object_id(trajectory[0])]+trajectory[1]
+        else:
+            blocks_in_way_merged[object_id(trajectory[0])] = trajectory[1]
+    for traj_new in blocks_in_way_merged.values():
+        blocks_in_way.append(traj_new)
         
     for grouping in blocks_in_way:
         if (uniform(0.0,1.0) < trajectory_chance):
-            material_choice = choose_item(probability_table_materials_trajectory)
+            material_choice = sample_item(material_trajectory_sampler)
             for block in grouping:
-                for j in range(len(final_blocks)):
-                    if block == final_blocks[j]:
-                        if final_materials[j] == 0:
-                            final_materials[j] = material_choice
+                j = block_positions[object_id(block)]
+                if final_materials[j] == 0:
+                    final_materials[j] = material_choice
                         
     for structure in complete_locations:
         
         if uniform(0.0,1.0) < cluster_chance:
-            all_set = 0
+            # blocks are given the current material in order of distance from the start point
+            # the material (and start point) sometimes changes to the block just reached, forming clusters
+            # the distance order from each start point is only sorted once, and read from a cursor that skips assigned blocks
+            block_points = [[block[1],block[2]] for block in structure]
+            neighbour_orders = {}
             current_point = randint(0,len(structure)-1)
-            #current_point = 0
             start_point = current_point
-            material_choice = choose_item(probability_table_materials)
-            while (all_set == 0):
+            material_choice = sample_item(material_sampler)
+            while (current_point != None):
                 final_materials[index+current_point] = material_choice
-                smallest_distance = 9999
-                for i in range(len(structure)):
-                    if final_materials[index+i] == 0:
-                        if sqrt( ((structure[i][1]-structure[start_point][1]) * (structure[i][1]-structure[start_point][1])) +
-                                 ((structure[i][2]-structure[start_point][2]) * (structure[i][2]-structure[start_point][2])) ) < smallest_distance:
-                            smallest_distance = sqrt( ((structure[i][1]-structure[start_point][1]) * (structure[i][1]-structure[start_point][1])) +
-                                                      ((structure[i][2]-structure[start_point][2]) * (structure[i][2]-structure[start_point][2])) )
-                            current_point = i
-                            if uniform(0.0,1.0) < cluster_swap_prob:
-                                material_choice = choose_item(probability_table_materials)
-                                start_point = current_point
-                if smallest_distance == 9999:
-                    all_set = 1
+                if start_point not in neighbour_orders:
+                    neighbour_orders[start_point] = [sorted_neighbours(block_points, block_points[start_point]), 0]
+                order = neighbour_orders[start_point]
+                while order[1] < len(order[0]) and final_materials[index+order[0][order[1]]] != 0:
+                    order[1] = order[1] + 1
+                current_point = None
+                if order[1] < len(order[0]):
+                    current_point = order[0][order[1]]
+                    if uniform(0.0,1.0) < cluster_swap_prob:
+                        material_choice = sample_item(material_sampler)
+                        start_point = current_point
             index = index + len(structure)  
                     
         elif uniform(0.0,1.0) < random_chance:
             for block in structure:
-                material_choice = choose_item(probability_table_materials)
+                material_choice = sample_item(material_sampler)
                 if final_materials[index] == 0:
                     final_materials[index] = material_choice
                 index = index + 1
         
         elif len(structure) <= small_threshold:
-            material_choice = choose_item(probability_table_materials)
+            material_choice = sample_item(material_sampler)
             for block in structure:
                 if final_materials[index] == 0:
                     final_materials[index] = material_choice
@@ -2292,7 +2829,7 @@ def set_materials(complete_locations, final_pig_positions, vulnerable_blocks):
             current_y = 999
             for block in structure:
                 if block[2] != current_y:
-                    material_choice = choose_item(probability_table_materials)
+                    material_choice = sample_item(material_sampler)
                     current_y = block[2]
                 if final_materials[index] == 0:
                     final_materials[index] = material_choice
@@ -2305,7 +2842,7 @@ def set_materials(complete_locations, final_pig_positions, vulnerable_blocks):
 
 # selects the type and order of the birds, based on level properties
 
-def find_bird_order(complete_locations, final_pig_positions, final_platforms, selected_other, final_materials):
+def find_bird_order(complete_locations, final_pig_positions, final_platforms, selected_other, final_materials, number_birds):
     number_wood = 0
     number_ice = 0
     number_stone = 0
@@ -2324,17 +2861,15 @@ def find_bird_order(complete_locations, final_pig_positions, final_platforms, se
             number_stone = number_stone + 1
 
     hittable_dup = find_hittable_pigs(complete_locations,final_pig_positions,selected_other,final_platforms)
-    hittable_final = []
+    hittable_final = set()
     for i in hittable_dup:
-        if i not in hittable_final:
-            hittable_final.append(i)
+        hittable_final.add(object_id(i))
     number_protected = total_number_pigs-len(hittable_final)
 
     unprotected_dup = find_unprotected_pigs(complete_locations,final_pig_positions,selected_other,final_platforms)
-    unprotected_final = []
+    unprotected_final = set()
     for i in unprotected_dup:
-        if i not in unprotected_final:
-            unprotected_final.append(i)
+        unprotected_final.add(object_id(i))
     number_unprotected = len(unprotected_final)
 
     print("")
@@ -2460,46 +2995,52 @@ def add_tnt(possible_tnt_positions, final_pig_positions, complete_locations, fin
     tnt_height = tnt_size[1]
     pig_width = pig_size[0]
     pig_height = pig_size[1]
-    to_remove = []
     
+    to_remove = set()
     for i in possible_tnt_positions:
         remove_me = False
         for j in final_pig_positions:
 
-            if not( round((j[0] - pig_width/2),10) >= round((i[0] + tnt_width/2),10) or
-                     round((j[0] + pig_width/2),10) <= round((i[0] - tnt_width/2),10) or
-                     round((j[1] + pig_height/2),10) <= round((i[1] - tnt_height/2),10) or
-                     round((j[1] - pig_height/2),10) >= round((i[1] + tnt_height/2),10)):
+            if not( rounded((j[0] - pig_width/2)) >= rounded((i[0] + tnt_width/2)) or
+                     rounded((j[0] + pig_width/2)) <= rounded((i[0] - tnt_width/2)) or
+                     rounded((j[1] + pig_height/2)) <= rounded((i[1] - tnt_height/2)) or
+                     rounded((j[1] - pig_height/2)) >= rounded((i[1] + tnt_height/2))):
                 remove_me = True
         for j in selected_other:
-            if not( round((j[1] - (additional_object_sizes[j[0]][0])/2),10) >= round((i[0] + tnt_width/2),10) or
-                     round((j[1] + (additional_object_sizes[j[0]][0])/2),10) <= round((i[0] - tnt_width/2),10) or
-                     round((j[2] + (additional_object_sizes[j[0]][1])/2),10) <= round((i[1] - tnt_height/2),10) or
-                     round((j[2] - (additional_object_sizes[j[0]][1])/2),10) >= round((i[1] + tnt_height/2),10)):
+            if not( rounded((j[1] - (additional_object_sizes[j[0]][0])/2)) >= rounded((i[0] + tnt_width/2)) or
+                     rounded((j[1] + (additional_object_sizes[j[0]][0])/2)) <= rounded((i[0] - tnt_width/2)) or
+                     rounded((j[2] + (additional_object_sizes[j[0]][1])/2)) <= rounded((i[1] - tnt_height/2)) or
+                     rounded((j[2] - (additional_object_sizes[j[0]][1])/2)) >= rounded((i[1] + tnt_height/2))):
                 remove_me = True
         if (remove_me == True):
-            to_remove.append(i)
+            to_remove.add(object_id(i))
                 
-    for k in to_remove:
-        possible_tnt_positions.remove(k)
+    possible_tnt_positions = [i for i in possible_tnt_positions if object_id(i) not in to_remove]
             
+    # the number of vulnerable blocks and pigs near each position doesn't change between placements, so is only found once
+    distance_threshold = 1.0
+    weak_points = []
+    for i in vulnerable_blocks:
+        weak_points.append([i[1],i[2]])
+    for j in final_pig_positions:
+        weak_points.append([j[0],j[1]])
+    weak_point_tree = build_kd_tree(weak_points)
+    nearby_vulnerable = []
+    for position in possible_tnt_positions:
+        nearby_vulnerable.append(count_within_radius(weak_point_tree, position, distance_threshold))
+
     while((block_placed == True) and (len(final_tnt_positions)<max_number_TNT)):
+        if len(final_tnt_positions) > 0 and stage_deadline_passed('add_tnt'):       # out of time, no extra TNT rounds
+            break
         block_placed = False
         tnt_values = []         # three factors used
         f1 = []                 # proximity to pigs / weak points (estimated damage)
         f2 = []                 # how far away the location is from other already selected locations (overall dispersion)
         f3 = []                 # how likely the location is to have other objects fall on it (occupancy estimation)
 
-        for position in possible_tnt_positions:
-            nearby_vulnerable = 0
-            distance_threshold = 1.0
-            for i in vulnerable_blocks:
-                if (sqrt(((i[1]-position[0])*(i[1]-position[0]))+((i[2]-position[1])*(i[2]-position[1]))) < distance_threshold):
-                    nearby_vulnerable = nearby_vulnerable + 1
-            for j in final_pig_positions:
-                if (sqrt(((j[0]-position[0])*(j[0]-position[0]))+((j[1]-position[1])*(j[1]-position[1]))) < distance_threshold):
-                    nearby_vulnerable = nearby_vulnerable + 1
-            f1.append(nearby_vulnerable)
+        for position_index in range(len(possible_tnt_positions)):
+            position = possible_tnt_positions[position_index]
+            f1.append(nearby_vulnerable[position_index])
 
             distance = 1
             tnt_f2_weight = 1.0
@@ -2541,13 +3082,16 @@ def add_tnt(possible_tnt_positions, final_pig_positions, complete_locations, fin
             # remove locations that are no longer valid
             tnt_choice = possible_tnt_positions[max_i]
             new_tnt_positions = []
+            new_nearby_vulnerable = []
             for i in range(len(possible_tnt_positions)):
-                if ( round((tnt_choice[0] - tnt_width/2),10) >= round((possible_tnt_positions[i][0] + tnt_width/2),10) or
-                     round((tnt_choice[0] + tnt_width/2),10) <= round((possible_tnt_positions[i][0] - tnt_width/2),10) or
-                     round((tnt_choice[1] + tnt_height/2),10) <= round((possible_tnt_positions[i][1] - tnt_height/2),10) or
-                     round((tnt_choice[1] - tnt_height/2),10) >= round((possible_tnt_positions[i][1] + tnt_height/2),10)):
+                if ( rounded((tnt_choice[0] - tnt_width/2)) >= rounded((possible_tnt_positions[i][0] + tnt_width/2)) or
+                     rounded((tnt_choice[0] + tnt_width/2)) <= rounded((possible_tnt_positions[i][0] - tnt_width/2)) or
+                     rounded((tnt_choice[1] + tnt_height/2)) <= rounded((possible_tnt_positions[i][1] - tnt_height/2)) or
+                     rounded((tnt_choice[1] - tnt_height/2)) >= rounded((possible_tnt_positions[i][1] + tnt_height/2))):
                     new_tnt_positions.append(possible_tnt_positions[i])
+                    new_nearby_vulnerable.append(nearby_vulnerable[i])
             possible_tnt_positions = new_tnt_positions
+            nearby_vulnerable = new_nearby_vulnerable
 
     print("")
     print("Number of TNT: ", len(final_tnt_positions))
@@ -2699,151 +3243,572 @@ def remove_blocks(restricted_blocks):
 
 
 
-# generate level!
+# reads the parameters file, returning a list of [number of levels, restricted combinations, pig range, time limit] for each block
 
-backup_probability_table_blocks = deepcopy(probability_table_blocks)
-backup_materials = deepcopy(materials)
+def read_parameters(parameters_file):
+    parameter_blocks = []
+    FILE = open(parameters_file, 'r')
+    checker = FILE.readline()
+    while (checker != ""):
+        if checker == "\n":
+            checker = FILE.readline()
+        else:
+            number_levels = int(deepcopy(checker))              # the number of levels to generate
+            restricted_combinations = FILE.readline().split(',')      # block type and material combination that are banned from the level
+            for i in range(len(restricted_combinations)):
+                restricted_combinations[i] = restricted_combinations[i].split()     # if all materials are baned for a block type then do not use that block type
+            pig_range = FILE.readline().split(',')
+            time_limit = int(FILE.readline())                   # time limit to create the levels, shouldn't be an issue for most generators (approximately an hour for 10 levels)
+            checker = FILE.readline()
+            parameter_blocks.append([number_levels, restricted_combinations, pig_range, time_limit])
+    FILE.close()
+    return parameter_blocks
+
+
+
+
+# finds the materials banned for each block type (or additional object) by the restricted combinations,
+# and builds a sampler choosing from the remaining materials with their probabilities renormalized (the same as redrawing until allowed)
+# only block types with banned materials (but not all of them) are given a sampler
+
+def build_material_samplers(names, restricted_combinations):
+    banned = {}
+    samplers = {}
+    for key, name in names.items():
+        banned_materials = set()
+        for material_key, material in materials.items():
+            if [material,name] in restricted_combinations:
+                banned_materials.add(int(material_key))
+        if len(banned_materials) == 0:
+            continue
+        banned[key] = banned_materials
+        allowed_table = {}
+        total = 0.0
+        for material_key, probability in probability_table_materials.items():
+            if int(material_key) in banned_materials:
+                allowed_table[material_key] = 0.0
+            else:
+                allowed_table[material_key] = probability
+                total = total + probability
+        if total > 0:
+            for material_key in allowed_table:
+                allowed_table[material_key] = allowed_table[material_key]/total
+            samplers[key] = build_sampler(allowed_table)
+    return banned, samplers
 
-FILE = open("parameters.txt", 'r')
-checker = FILE.readline()
-finished_levels = 0
-while (checker != ""):
-    if checker == "\n":
-        checker = FILE.readline()
-    else:
-        number_levels = int(deepcopy(checker))              # the number of levels to generate
-        restricted_combinations = FILE.readline().split(',')      # block type and material combination that are banned from the level
-        for i in range(len(restricted_combinations)):
-            restricted_combinations[i] = restricted_combinations[i].split()     # if all materials are baned for a block type then do not use that block type
-        pig_range = FILE.readline().split(',')
-        time_limit = int(FILE.readline())                   # time limit to create the levels, shouldn't be an issue for most generators (approximately an hour for 10 levels)
-        checker = FILE.readline()
-
-        restricted_blocks = []                              # block types that cannot be used with any materials
-        for key,value in block_names.items():
+
+
+
+# sets the block probability table, allowed additional blocks and allowed materials for the given restricted combinations
+# the table, samplers and allowed blocks for each set of restricted combinations are only worked out once and then kept
+
+restriction_cache = {}
+
+def apply_restrictions(restricted_combinations):
+    global probability_table_blocks, block_sampler, trihole_allowed, tri_allowed, cir_allowed, cirsmall_allowed
+    global banned_block_materials, block_material_samplers, other_material_samplers
+
+    key = tuple(sorted([tuple(combination) for combination in restricted_combinations]))
+    if key not in restriction_cache:
+        restricted_blocks = []                              # block types (and additional objects) that cannot be used with any materials
+        for value in list(block_names.values()) + list(additional_objects.values()):
             completely_restricted = True
             for material in list(materials.values()):
                 if [material,value] not in restricted_combinations:
                     completely_restricted = False
-            if completely_restricted == True:
+            if completely_restricted == True and value not in restricted_blocks:     # rotated blocks share their name, but are only removed once
                 restricted_blocks.append(value)
 
         probability_table_blocks = deepcopy(backup_probability_table_blocks)
 
-        probability_table_blocks = remove_blocks(restricted_blocks)     # remove restricted block types from the structure generation process
-        if "TriangleHole" in restricted_blocks:
-            trihole_allowed = False
-        if "Triangle" in restricted_blocks:
-            tri_allowed = False
-        if "Circle" in restricted_blocks:
-            cir_allowed = False
-        if "CircleSmall" in restricted_blocks:
-            cirsmall_allowed = False
+        restricted_table = remove_blocks(restricted_blocks)     # remove restricted block types from the structure generation process
+        banned_blocks, block_samplers = build_material_samplers(block_names, restricted_combinations)
+        other_samplers = build_material_samplers(additional_objects, restricted_combinations)[1]
+        restriction_cache[key] = {'table':restricted_table, 'sampler':build_sampler(restricted_table),
+                                  'allowed':[backup_allowed_blocks[0] and "TriangleHole" not in restricted_blocks, backup_allowed_blocks[1] and "Triangle" not in restricted_blocks,
+                                             backup_allowed_blocks[2] and "Circle" not in restricted_blocks, backup_allowed_blocks[3] and "CircleSmall" not in restricted_blocks],
+                                  'banned_block_materials':banned_blocks, 'block_material_samplers':block_samplers, 'other_material_samplers':other_samplers}
 
-        for current_level in range(number_levels):
+    restrictions = restriction_cache[key]
+    probability_table_blocks = deepcopy(restrictions['table'])
+    block_sampler = restrictions['sampler']
+    trihole_allowed, tri_allowed, cir_allowed, cirsmall_allowed = restrictions['allowed']
+    banned_block_materials = restrictions['banned_block_materials']
+    block_material_samplers = restrictions['block_material_samplers']
+    other_material_samplers = restrictions['other_material_samplers']
 
-            print(number_levels)
 
-            number_pigs = randint(int(pig_range[0]),int(pig_range[1]))  # number of pigs (if set too large then can cause program to infinitely loop)
 
-            if (current_level+finished_levels+4) < 10:
-                level_name = "0"+str(current_level+finished_levels+4)
-            else:
-                level_name = str(current_level+finished_levels+4)
 
-            number_ground_structures, complete_locations, possible_pig_positions, pig_protect_values, ground_divides = create_ground_structures()
+# starts the time budget (in seconds, None for no limit) of a new level
+# replay gives, for each stage, the check at which its deadline passed when the level was first generated (see fired_stage_deadlines),
+# so that a saved level can be regenerated with the same stages cut short, whatever the time taken now
 
-            complete_locations, possible_pig_positions,extra_platforms = create_hills(complete_locations, possible_pig_positions,ground_divides)
+level_deadline_checks = {}          # stage -> [checks made, check at which the deadline passed (None if it hasn't)], for the current level
+replayed_deadlines = None
 
-            extra_platforms_seperated = deepcopy(extra_platforms)
-            extra_platforms =  []
-            for i in extra_platforms_seperated:
-                extra_platforms = extra_platforms + i
+def start_level_deadline(time_budget, replay=None):
+    global level_start_time, level_time_budget, level_deadline_checks, replayed_deadlines
+    level_start_time = perf_counter()
+    level_time_budget = time_budget
+    level_deadline_checks = {}
+    replayed_deadlines = replay
 
-            possible_pig_positions_seperated = deepcopy(possible_pig_positions)
-            possible_pig_positions = []
-            for i in possible_pig_positions_seperated:
-                possible_pig_positions = possible_pig_positions + i
 
-            complete_ground_locations = deepcopy(complete_locations)
 
-            number_platforms, final_platforms, platform_centers = create_platforms(number_platforms,complete_locations,possible_pig_positions)
 
-            complete_locations, possible_pig_positions, pig_protect_values = create_platform_structures(final_platforms, platform_centers, complete_locations, possible_pig_positions, pig_protect_values)
+# checks whether the optional stage has run past its deadline within the current level
 
-            final_pig_positions,pigs_placed_on_ground = add_pigs(number_pigs, possible_pig_positions, complete_locations, pig_protect_values, final_platforms,extra_platforms)
-            number_birds = choose_number_birds(final_pig_positions,number_ground_structures,number_platforms)
-            number_birds = number_birds+1
+def stage_deadline_passed(stage):
+    checks = level_deadline_checks.setdefault(stage, [0, None])
+    checks[0] = checks[0] + 1
+    if replayed_deadlines != None:
+        passed = replayed_deadlines.get(stage) != None and checks[0] >= replayed_deadlines[stage]
+    elif level_time_budget == None:
+        passed = False
+    else:
+        passed = perf_counter() > level_start_time + (level_time_budget*stage_deadline_shares[stage])
+    if passed == True:
+        if checks[1] == None:
+            checks[1] = checks[0]
+        count_work('deadline_' + stage)
+    return passed
 
-            extra_platforms_angled = add_angled_terrain(pigs_placed_on_ground,extra_platforms_seperated)
 
-            final_platforms.append(extra_platforms)
 
-            complete_locations = swap_blocks(complete_locations, final_pig_positions, final_platforms)
 
-            possible_trihole_positions, possible_tri_positions, possible_cir_positions, possible_cirsmall_positions = find_additional_block_positions(complete_locations)
-            selected_other = add_additional_blocks(possible_trihole_positions, possible_tri_positions, possible_cir_positions, possible_cirsmall_positions)
-            vulnerable_blocks = protect_vulnerable_blocks(complete_locations, complete_ground_locations, final_platforms, final_pig_positions, selected_other)
+# the stages whose deadlines passed while generating the current level, with the check at which each passed
 
-            final_tnt_positions = add_tnt(possible_pig_positions, final_pig_positions, complete_locations, final_platforms, vulnerable_blocks, selected_other)
+def fired_stage_deadlines():
+    fired = {}
+    for stage, checks in level_deadline_checks.items():
+        if checks[1] != None:
+            fired[stage] = checks[1]
+    return fired
 
-            all_structures = []
-            for structure in complete_locations:
-                all_structures.append(structure)
 
-            structure_others = []
-            for i in complete_locations:
-                structure_others.append([])
 
-            structure_pigs = []
-            for i in complete_locations:
-                structure_pigs.append([])
 
-            structure_tnts = []
-            for i in complete_locations:
-                structure_tnts.append([])
-
-            for bb in selected_other:
-                belows = find_below_blocks_other(bb,complete_locations)
-                if len(belows)>0:
-                    below_block = belows[0]
-                    for i in range(len(complete_locations)):
-                        if below_block in complete_locations[i]:
-                            structure_others[i].append(bb)
-
-            for bb in final_tnt_positions:
-                belows = find_below_blocks_tnt(bb,complete_locations)
-                if len(belows)>0:
-                    below_block = belows[0]
-                    for i in range(len(complete_locations)):
-                        if below_block in complete_locations[i]:
-                            structure_tnts[i].append(bb)
-
-            for bb in final_pig_positions:
-                belows = find_below_blocks_pig(bb,complete_locations)
-                if len(belows)>0:
-                    below_block = belows[0]
-                    for i in range(len(complete_locations)):
-                        if below_block in complete_locations[i]:
-                            structure_pigs[i].append(bb)
-
-            new_all_structures = deepcopy(all_structures)
-            new_structure_others = deepcopy(structure_others)
-            new_structure_pigs = deepcopy(structure_pigs)
-            new_structure_tnts = deepcopy(structure_tnts)
-
-            final_materials, final_blocks = set_materials(complete_locations, final_pig_positions, vulnerable_blocks)
-
-            for i in range (len(final_materials)):
-                while [materials[str(final_materials[i])],block_names[str(final_blocks[i][0])]] in restricted_combinations:
-                    
-                    final_materials[i] = choose_item(probability_table_materials)
+# estimates the most pigs the level can hold, before any are placed
+# add_pigs first uses the chosen pig positions (every position choose_pig_positions would pick) and then places pigs at random on the ground,
+# so this is the number of chosen positions plus the number of pigs that are sure to fit in the free intervals of ground
+# (as pigs are placed at random an interval is only sure to hold one pig for every two pig widths of it, and an interval
+# narrower than that is not counted, as a random position may never fall in it)
+
+def estimate_pig_capacity(chosen_pig_positions, complete_locations, extra_platforms):
+    pig_width = pig_size[0]
+    pig_height = pig_size[1]
+
+    # x ranges (of the pig center) where a pig on the ground would overlap a block, hill platform or chosen pig
+    blocked = []
+    for pig in chosen_pig_positions:
+        if ( rounded((absolute_ground + pig_height/2)) > rounded((pig[1] - pig_height/2)) and
+             rounded((absolute_ground - pig_height/2)) < rounded((pig[1] + pig_height/2))):
+            blocked.append([pig[0] - pig_width, pig[0] + pig_width])
+    for structure in complete_locations:
+        for i in structure:
+            if ( rounded((absolute_ground + pig_height/2)) > rounded((i[2] - (blocks[str(i[0])][1])/2)) and
+                 rounded((absolute_ground - pig_height/2)) < rounded((i[2] + (blocks[str(i[0])][1])/2))):
+                blocked.append([i[1] - (blocks[str(i[0])][0])/2 - pig_width/2, i[1] + (blocks[str(i[0])][0])/2 + pig_width/2])
+    for i in extra_platforms:
+        if ( rounded((absolute_ground + pig_height/2)) > rounded((i[1] - (platform_size[1]/2))) and
+             rounded((absolute_ground - pig_height/2)) < rounded((i[1] + (platform_size[1]/2)))):
+            blocked.append([i[0] - (platform_size[0]/2) - pig_width/2, i[0] + (platform_size[0]/2) + pig_width/2])
+    count_work('aabb_checks', len(chosen_pig_positions) + count_objects(complete_locations) + len(extra_platforms))
+    blocked.sort()
+
+    free_intervals = []
+    free_start = level_width_min
+    for interval in blocked:
+        if rounded(interval[0]) >= rounded(free_start):
+            free_intervals.append([free_start, min(interval[0], level_width_max)])
+        free_start = max(free_start, interval[1])
+    free_intervals.append([free_start, level_width_max])
+
+    ground_capacity = 0
+    for interval in free_intervals:
+        if rounded(interval[1]) > rounded(interval[0]):
+            ground_capacity = ground_capacity + int(floor(round((interval[1] - interval[0])/(2*pig_width),10)))
+
+    return len(chosen_pig_positions) + ground_capacity
+
+
+
+
+# builds the ground structures, hills, platforms and platform structures of a level (everything that pigs are later placed on)
+# the number of platforms actually placed is returned last (the number_platforms setting is left as it is)
+
+def create_level_geometry(number_platforms_wanted):
+    _, complete_locations, possible_pig_positions, pig_protect_values, ground_divides = timed_stage('create_ground_structures', create_ground_structures)
+
+    complete_locations, possible_pig_positions,extra_platforms = timed_stage('create_hills', create_hills, complete_locations, possible_pig_positions,ground_divides)
+
+    extra_platforms_seperated = deepcopy(extra_platforms)
+    extra_platforms =  []
+    for i in extra_platforms_seperated:
+        extra_platforms = extra_platforms + i
+
+    possible_pig_positions_seperated = deepcopy(possible_pig_positions)
+    possible_pig_positions = []
+    for i in possible_pig_positions_seperated:
+        possible_pig_positions = possible_pig_positions + i
+
+    complete_ground_locations = deepcopy(complete_locations)
+
+    platforms_placed, final_platforms, platform_centers = timed_stage('create_platforms', create_platforms, number_platforms_wanted,complete_locations,possible_pig_positions)
+
+    complete_locations, possible_pig_positions, pig_protect_values = timed_stage('create_platform_structures', create_platform_structures, final_platforms, platform_centers, complete_locations, possible_pig_positions, pig_protect_values)
+
+    return complete_locations, complete_ground_locations, possible_pig_positions, pig_protect_values, final_platforms, extra_platforms, extra_platforms_seperated, platforms_placed
+
+
+
+
+# generate level!
+# returns the level as a dictionary holding everything write_level_xml needs
+# (materials follow the restricted combinations last given to apply_restrictions)
+
+def generate_level(number_pigs):
+    number_platforms_wanted = number_platforms
+    geometry_attempts = 0
+    while True:
+        complete_locations, complete_ground_locations, possible_pig_positions, pig_protect_values, final_platforms, extra_platforms, extra_platforms_seperated, platforms_placed = create_level_geometry(number_platforms_wanted + min(geometry_attempts, max_geometry_attempts-1))
+        if pig_capacity_check == False:
+            chosen_pig_positions = timed_stage('choose_pig_positions', choose_pig_positions, number_pigs, possible_pig_positions, pig_protect_values, final_platforms)
+            break
+        chosen_pig_positions = timed_stage('choose_pig_positions', choose_pig_positions, None, possible_pig_positions, pig_protect_values, final_platforms)
+        pig_capacity = timed_stage('estimate_pig_capacity', estimate_pig_capacity, chosen_pig_positions, complete_locations, extra_platforms)
+        record_counts(pig_capacity=pig_capacity)
+        if pig_capacity >= number_pigs:
+            break
+        geometry_attempts = geometry_attempts + 1
+        if geometry_attempts >= max_geometry_attempts and pig_capacity > 0:       # a level without space for any pigs is always rebuilt
+            print("")
+            print("not enough space for", number_pigs, "pigs, reduced to", pig_capacity)
+            count_work('pig_capacity_shortfalls')
+            number_pigs = pig_capacity
+            break
+        if geometry_attempts >= max_empty_geometry_attempts:     # add_pigs would never find space for a pig
+            raise RuntimeError("no space for any pigs after %d level geometries" % geometry_attempts)
+        count_work('geometry_rebuilds')
+        print("")
+        print("not enough space for", number_pigs, "pigs, rebuilding level geometry")
+    record_counts(pig_candidates=len(possible_pig_positions), geometry_attempts=geometry_attempts+1)
+
+    final_pig_positions,pigs_placed_on_ground = timed_stage('add_pigs', add_pigs, number_pigs, chosen_pig_positions, complete_locations, extra_platforms)
+    number_birds = choose_number_birds(final_pig_positions,number_ground_structures,platforms_placed)
+    number_birds = number_birds+1
+
+    extra_platforms_angled = timed_stage('add_angled_terrain', add_angled_terrain, pigs_placed_on_ground,extra_platforms_seperated)
+
+    final_platforms.append(extra_platforms)
+
+    complete_locations = timed_stage('swap_blocks', swap_blocks, complete_locations, final_pig_positions, final_platforms)
+
+    possible_trihole_positions, possible_tri_positions, possible_cir_positions, possible_cirsmall_positions = timed_stage('find_additional_block_positions', find_additional_block_positions, complete_locations, final_pig_positions, final_platforms)
+    record_counts(additional_block_candidates=len(possible_trihole_positions)+len(possible_tri_positions)+len(possible_cir_positions)+len(possible_cirsmall_positions))
+    selected_other = timed_stage('add_additional_blocks', add_additional_blocks, possible_trihole_positions, possible_tri_positions, possible_cir_positions, possible_cirsmall_positions)
+    vulnerable_blocks = timed_stage('protect_vulnerable_blocks', protect_vulnerable_blocks, complete_locations, complete_ground_locations, final_platforms, final_pig_positions, selected_other)
+
+    record_counts(tnt_candidates=len(possible_pig_positions))
+    final_tnt_positions = timed_stage('add_tnt', add_tnt, possible_pig_positions, final_pig_positions, complete_locations, final_platforms, vulnerable_blocks, selected_other)
+
+    all_structures = []
+    for structure in complete_locations:
+        all_structures.append(structure)
+
+    structure_others = []
+    for i in complete_locations:
+        structure_others.append([])
+
+    structure_pigs = []
+    for i in complete_locations:
+        structure_pigs.append([])
+
+    structure_tnts = []
+    for i in complete_locations:
+        structure_tnts.append([])
+
+    id_to_structure = build_object_index(complete_locations)[1]
+    for bb in selected_other:
+        belows = find_below_blocks_other(bb,complete_locations)
+        if len(belows)>0:
+            below_block = belows[0]
+            if object_id(below_block) in id_to_structure:
+                structure_others[id_to_structure[object_id(below_block)]].append(bb)
+
+    for bb in final_tnt_positions:
+        belows = find_below_blocks_tnt(bb,complete_locations)
+        if len(belows)>0:
+            below_block = belows[0]
+            if object_id(below_block) in id_to_structure:
+                structure_tnts[id_to_structure[object_id(below_block)]].append(bb)
+
+    for bb in final_pig_positions:
+        belows = find_below_blocks_pig(bb,complete_locations)
+        if len(belows)>0:
+            below_block = belows[0]
+            if object_id(below_block) in id_to_structure:
+                structure_pigs[id_to_structure[object_id(below_block)]].append(bb)
+
+    new_all_structures = deepcopy(all_structures)
+    new_structure_others = deepcopy(structure_others)
+    new_structure_pigs = deepcopy(structure_pigs)
+    new_structure_tnts = deepcopy(structure_tnts)
+
+    final_materials, final_blocks = timed_stage('set_materials', set_materials, complete_locations, final_pig_positions, vulnerable_blocks, selected_other, final_platforms)
+
+    for i in range (len(final_materials)):
+        if final_materials[i] in banned_block_materials.get(str(final_blocks[i][0]), ()):     # material not allowed for the block type, so choose one of those that are
+            count_work('restricted_material_redraws')
+            final_materials[i] = sample_item(block_material_samplers[str(final_blocks[i][0])])
+
+    bird_order = timed_stage('find_bird_order', find_bird_order, complete_locations, final_pig_positions, final_platforms, selected_other, final_materials, number_birds)
+
+    other_materials = set_other_materials(selected_other)
+
+    number_platform_blocks = 0
+    for platform_set in final_platforms:
+        number_platform_blocks = number_platform_blocks + len(platform_set)
+    record_counts(structures=len(complete_locations), blocks=len(final_blocks), additional_blocks=len(selected_other), pigs=len(final_pig_positions),
+                  tnt=len(final_tnt_positions), platforms=number_platform_blocks, angled_platforms=len(extra_platforms_angled), birds=number_birds)
+
+    return {'blocks':final_blocks, 'others':selected_other, 'pigs':final_pig_positions, 'platforms':final_platforms,
+            'number_birds':number_birds, 'bird_order':bird_order, 'materials':final_materials, 'tnt':final_tnt_positions,
+            'angled_platforms':extra_platforms_angled, 'other_materials':other_materials}
+
 
-            bird_order = find_bird_order(complete_locations, final_pig_positions, final_platforms, selected_other, final_materials)
 
-            write_level_xml(final_blocks, selected_other, final_pig_positions, final_platforms, number_birds, bird_order, final_materials, final_tnt_positions, extra_platforms_angled, level_name, restricted_combinations)
 
-        finished_levels = finished_levels + number_levels
+# builds the xml for the given level (as returned by generate_level)
 
+def level_to_xml(level):
+    return level_xml_string(level['blocks'], level['others'], level['pigs'], level['platforms'], level['number_birds'], level['bird_order'],
+                            level['materials'], level['tnt'], level['angled_platforms'], level['other_materials'])
 
 
+
+
+# converts the level to the format written to the given sink (packed records for binary sinks, xml otherwise)
+
+def serialize_level(level, name, sink):
+    if sink['type'] == 'binary':
+        return pack_level(level, name)
+    return level_to_xml(level)
+
+
+
+
+# writes the given level out, handing it to the background writer if there is one
+# (the hand over is timed as the submit_to_writer stage, and the writer thread adds the time it takes to write the level as write_level_xml)
+
+def write_level(level, level_name, writer=None):
+    if writer != None:
+        timed_stage('submit_to_writer', submit_to_writer, writer, "level-%s.xml" % level_name, level, level_write_timer())
+    else:
+        timed_stage('write_level_xml', write_level_now, level, level_name)
+
+def write_level_now(level, level_name):
+    name = "level-%s.xml" % level_name
+    if output_sink != None and output_sink['type'] == 'binary':
+        write_to_sink(output_sink, name, serialize_level(level, name, output_sink))
+    else:
+        write_level_xml(level['blocks'], level['others'], level['pigs'], level['platforms'], level['number_birds'], level['bird_order'],
+                        level['materials'], level['tnt'], level['angled_platforms'], level_name, level['other_materials'])
+
+
+
+
+# generates the levels of one parameter block ([number of levels, restricted combinations, pig range, time limit] as read by read_parameters)
+# yielding the name and level (as returned by generate_level) of each in turn, so each level is only generated when it is asked for
+# levels are named from first_level on (level-04 is the first level of a run)
+# each level's stage record is finished when the next level is asked for, so it includes the time taken to write the level out
+
+def generate_block_levels(parameter_block, first_level=4, parameters_file=None):
+    number_levels, restricted_combinations, pig_range, time_limit = parameter_block
+
+    apply_restrictions(restricted_combinations)
+    block_deadline = perf_counter() + (time_limit*60.0)       # time limit is given in minutes
+
+    for current_level in range(number_levels):
+
+        print(number_levels)
+
+        number_pigs = randint(int(pig_range[0]),int(pig_range[1]))  # number of pigs (reduced if the level doesn't have space for them, see pig_capacity_check)
+
+        if (current_level+first_level) < 10:
+            level_name = "0"+str(current_level+first_level)
+        else:
+            level_name = str(current_level+first_level)
+
+        if honour_time_limit == True:
+            start_level_deadline(max(0.0, block_deadline - perf_counter())/(number_levels - current_level))
+        else:
+            start_level_deadline(None)
+
+        level_config = {'parameters_file':parameters_file, 'restricted_combinations':restricted_combinations, 'pig_range':pig_range,
+                        'number_pigs':number_pigs, 'number_ground_structures':number_ground_structures, 'number_platforms':number_platforms}
+        start_level_record(level_config)
+
+        level = generate_level(number_pigs)
+        level_config['deadlines'] = fired_stage_deadlines()        # saved with the level's profile, so that reproducing it cuts the same stages short
+
+        yield level_name, level
+
+        finish_level_record(level_name)
+
+
+
+
+# generates all levels described by the parameters file
+
+def generate_levels(parameters_file, writer=None):
+    finished_levels = 0
+    for parameter_block in read_parameters(parameters_file):
+
+        for level_name, level in generate_block_levels(parameter_block, finished_levels+4, parameters_file):
+            write_level(level, level_name, writer)
+
+        finished_levels = finished_levels + parameter_block[0]
+
+
+
+
+backup_probability_table_blocks = deepcopy(probability_table_blocks)
+backup_materials = deepcopy(materials)
+backup_allowed_blocks = [trihole_allowed, tri_allowed, cir_allowed, cirsmall_allowed]
+
+# samplers for choosing from the probability tables (the block sampler is replaced by apply_restrictions along with its table)
+block_sampler = build_sampler(probability_table_blocks)
+material_sampler = build_sampler(probability_table_materials)
+material_trajectory_sampler = build_sampler(probability_table_materials_trajectory)
+
+# materials banned for each block type and samplers for the materials allowed (for block types and additional objects), set by apply_restrictions
+banned_block_materials = {}
+block_material_samplers = {}
+other_material_samplers = {}
+
+
+
+
+# regenerates and writes the single level described by a saved profile (the .json written next to slow level profiles)
+
+def reproduce_level(profile_file, writer=None):
+    global number_ground_structures, number_platforms
+    f = open(profile_file, 'r')
+    saved = json.load(f)
+    f.close()
+    config = saved['config']
+    apply_restrictions(config['restricted_combinations'])
+    number_ground_structures = config['number_ground_structures']
+    number_platforms = config['number_platforms']
+    random_state = saved['random_state']
+    random.setstate((random_state[0], tuple(random_state[1]), random_state[2]))
+    if 'deadlines' in config:
+        start_level_deadline(None, config['deadlines'])
+        if config['deadlines'] != {}:
+            print("replaying the stage deadlines the level hit: " + ", ".join(sorted(config['deadlines'].keys())))
+    else:
+        print("warning: the profile doesn't say whether the level hit any stage deadlines, it is regenerated without them (and may differ if it did)")
+        start_level_deadline(None)
+
+    start_level_record(config)
+
+    level = generate_level(config['number_pigs'])
+
+    write_level(level, saved['level'], writer)
+
+    finish_level_record(saved['level'])
+
+
+
+
+# functions whose calls are counted while work counting is enabled
+# (they are only swapped for counting versions then, so they cost nothing extra otherwise)
+
+counted_functions = ['ccw', 'line_intersects_line', 'parabola_entry', 'deepcopy']
+uncounted_functions = {}
+
+def count_function_calls(enabled):
+    for name in counted_functions:
+        if enabled == True and name not in uncounted_functions:
+            uncounted_functions[name] = globals()[name]
+            globals()[name] = counting_function(name, uncounted_functions[name])
+        elif enabled == False and name in uncounted_functions:
+            globals()[name] = uncounted_functions.pop(name)
+
+
+
+
+# command line options select the parameters file and where/how the levels are written
+
+def main():
+    global output_sink, coordinate_precision, honour_time_limit, number_ground_structures, number_platforms
+
+    parser = argparse.ArgumentParser(description="Generate Science-Birds levels from a parameters file.")
+    parser.add_argument("--parameters", default="parameters.txt", help="parameters file describing the levels to generate")
+    parser.add_argument("--sink", choices=sink_types, default="directory", help="where levels are written: one file per level in a directory, a zip or tar archive, a jsonl stream with an offset index or a binary batch file")
+    parser.add_argument("--output", default=None, help="output directory or archive/stream/batch file (default: current directory, levels.zip, levels.tar, levels.jsonl or levels.bin)")
+    parser.add_argument("--compress", action="store_true", default=compress_levels, help="gzip level files (directory), deflate (zip) or gzip the archive (tar)")
+    parser.add_argument("--precision", type=int, default=coordinate_precision, help="number of decimal places written for coordinates")
+    parser.add_argument("--full-precision", action="store_true", help="write coordinates with full float precision")
+    parser.add_argument("--writer-threads", type=int, default=1, help="number of background threads writing levels while the next ones are generated (0 writes each level before continuing)")
+    parser.add_argument("--writer-queue", type=int, default=4, help="maximum number of finished levels waiting to be written before generation pauses")
+    parser.add_argument("--stage-times", default=None, help="file that a json record of stage timings and object counts is written to for each level (off by default)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed, so that runs can be repeated")
+    parser.add_argument("--ignore-time-limit", action="store_true", help="always run every stage in full, however long the levels take")
+    parser.add_argument("--profile-dir", default=None, help="directory that profiles (.pstats, collapsed stacks and level config) of slow levels are written to (off by default)")
+    parser.add_argument("--profile-threshold", type=float, default=10.0, help="levels taking longer than this many seconds keep their profile")
+    parser.add_argument("--reproduce", default=None, help="regenerate the single level described by a saved profile .json instead of reading the parameters file")
+    parser.add_argument("--memory", default=None, help="file that a json record of memory allocated per stage (with tracemalloc) and the top allocation sites is written to for each level (off by default)")
+    parser.add_argument("--work-counts", default=None, help="file that a json record of loop retries, overlap checks and geometry function calls is written to for each level and for the whole run (off by default)")
+    args = parser.parse_args()
+
+    coordinate_precision = args.precision
+    if args.full_precision:
+        coordinate_precision = None
+
+    output_path = args.output
+    if output_path == None:
+        output_path = default_sink_paths[args.sink]
+
+    output_sink = open_sink(args.sink, output_path, args.compress)
+    writer = None
+    if args.writer_threads > 0:
+        writer = start_writer(output_sink, serialize_level, args.writer_threads, args.writer_queue)
+    if args.stage_times != None:
+        enable_stage_timing(args.stage_times)
+    if args.work_counts != None:
+        enable_work_counting(args.work_counts)
+        count_function_calls(True)
+    if args.profile_dir != None:
+        enable_level_profiling(args.profile_dir, args.profile_threshold)
+    if args.memory != None:
+        enable_memory_tracing(args.memory)
+    if args.seed != None:
+        random.seed(args.seed)
+        number_ground_structures = randint(2,4)     # these were drawn when the module was loaded, before seeding
+        number_platforms = randint(1,3)
+    if args.ignore_time_limit:
+        honour_time_limit = False
+    try:
+        if args.reproduce != None:
+            reproduce_level(args.reproduce, writer)
+        else:
+            generate_levels(args.parameters, writer)
+    finally:
+        try:
+            if writer != None:
+                stop_writer(writer)     # before stage timing is switched off, as the writer threads finish the records of the levels they write
+        finally:
+            disable_memory_tracing()
+            disable_level_profiling()
+            count_function_calls(False)
+            disable_work_counting()
+            disable_stage_timing()
+            close_sink(output_sink)
+            output_sink = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# compact binary format for generated levels (everything write_level_xml needs), for storing and quickly reloading levels
+#
+# a level record is a fixed header of counts followed by one packed array per field:
+#   name, block types, block materials, block positions, additional block shapes/materials/rotations/positions,
+#   pig positions, TNT positions, platform group sizes, platform positions, angled platforms (x, y, rotation, scaleX), bird order
+# positions are stored as 64 bit floats so levels reload (and convert to xml) exactly as generated
+#
+# a batch file holds many level records:
+#   "IALB" + version, then for each level a 4 byte length followed by the record,
+#   then (once finished) an index of record offsets, the number of levels and "IALX"
+# batch files are read through mmap, so only the levels actually read are loaded
+
+level_header = struct.Struct('<HHHHHHHHH')
+record_length = struct.Struct('<I')
+batch_header = b'IALB' + struct.pack('<H', 1)
+batch_trailer = struct.Struct('<Q4s')
+
+other_material_names = ['wood', 'ice', 'stone']     # same numbering as the materials table in generator_competition.py (starting at 1)
+other_rotations = ['0', '0.0', '90.0']
+
+
+
+
+# packs a list of values into bytes using the given array type code (little endian)
+
+def pack_values(type_code, values):
+    packed = array(type_code, values)
+    if sys.byteorder != 'little' and packed.itemsize > 1:
+        packed.byteswap()
+    return packed.tobytes()
+
+
+
+
+# unpacks number values of the given array type code from data starting at offset, returning the values and the next offset
+
+def unpack_values(type_code, data, offset, number):
+    values = array(type_code)
+    end = offset + (number*values.itemsize)
+    values.frombytes(data[offset:end])
+    if sys.byteorder != 'little' and values.itemsize > 1:
+        values.byteswap()
+    return values, end
+
+
+
+
+# packs a level (as returned by generate_level in generator_competition.py) and its name into a binary record
+
+def pack_level(level, name):
+    name_bytes = name.encode()
+
+    block_xy = []
+    for block in level['blocks']:
+        block_xy.append(block[1])
+        block_xy.append(block[2])
+
+    other_shapes = []
+    other_materials = []
+    other_rotation_codes = []
+    other_xy = []
+    for index in range(len(level['others'])):
+        other = level['others'][index]
+        other_shapes.append(int(other[0]))
+        other_materials.append(other_material_names.index(level['other_materials'][index][0]) + 1)
+        other_rotation_codes.append(other_rotations.index(level['other_materials'][index][1]))
+        other_xy.append(other[1])
+        other_xy.append(other[2])
+
+    pig_xy = []
+    for pig in level['pigs']:
+        pig_xy.append(pig[0])
+        pig_xy.append(pig[1])
+
+    tnt_xy = []
+    for tnt in level['tnt']:
+        tnt_xy.append(tnt[0])
+        tnt_xy.append(tnt[1])
+
+    platform_group_sizes = []
+    platform_xy = []
+    for platform_set in level['platforms']:
+        platform_group_sizes.append(len(platform_set))
+        for platform in platform_set:
+            platform_xy.append(platform[0])
+            platform_xy.append(platform[1])
+
+    angled_values = []
+    for platform in level['angled_platforms']:
+        angled_values.extend(platform[0:4])
+
+    bird_order = level['bird_order'][0:level['number_birds']]
+
+    return b''.join([level_header.pack(len(name_bytes), len(level['blocks']), len(level['others']), len(level['pigs']), len(level['tnt']),
+                                       len(platform_group_sizes), len(platform_xy)//2, len(level['angled_platforms']), len(bird_order)),
+                     name_bytes,
+                     pack_values('B', [block[0] for block in level['blocks']]),
+                     pack_values('B', level['materials']),
+                     pack_values('d', block_xy),
+                     pack_values('B', other_shapes),
+                     pack_values('B', other_materials),
+                     pack_values('B', other_rotation_codes),
+                     pack_values('d', other_xy),
+                     pack_values('d', pig_xy),
+                     pack_values('d', tnt_xy),
+                     pack_values('H', platform_group_sizes),
+                     pack_values('d', platform_xy),
+                     pack_values('d', angled_values),
+                     pack_values('B', bird_order)])
+
+
+
+
+# unpacks a binary level record (starting at offset), returning the level in the form returned by generate_level and its name
+
+def unpack_level(data, offset=0):
+    name_length, n_blocks, n_others, n_pigs, n_tnt, n_platform_groups, n_platforms, n_angled, n_birds = level_header.unpack_from(data, offset)
+    offset = offset + level_header.size
+    name = bytes(data[offset:offset+name_length]).decode()
+    offset = offset + name_length
+
+    block_types, offset = unpack_values('B', data, offset, n_blocks)
+    block_materials, offset = unpack_values('B', data, offset, n_blocks)
+    block_xy, offset = unpack_values('d', data, offset, n_blocks*2)
+    other_shapes, offset = unpack_values('B', data, offset, n_others)
+    other_materials, offset = unpack_values('B', data, offset, n_others)
+    other_rotation_codes, offset = unpack_values('B', data, offset, n_others)
+    other_xy, offset = unpack_values('d', data, offset, n_others*2)
+    pig_xy, offset = unpack_values('d', data, offset, n_pigs*2)
+    tnt_xy, offset = unpack_values('d', data, offset, n_tnt*2)
+    platform_group_sizes, offset = unpack_values('H', data, offset, n_platform_groups)
+    platform_xy, offset = unpack_values('d', data, offset, n_platforms*2)
+    angled_values, offset = unpack_values('d', data, offset, n_angled*4)
+    bird_order, offset = unpack_values('B', data, offset, n_birds)
+
+    platforms = []
+    position = 0
+    for size in platform_group_sizes:
+        platform_set = []
+        for i in range(position, position+size):
+            platform_set.append([platform_xy[i*2], platform_xy[i*2+1]])
+        platforms.append(platform_set)
+        position = position + size
+
+    level = {'blocks':[[block_types[i], block_xy[i*2], block_xy[i*2+1]] for i in range(n_blocks)],
+             'materials':list(block_materials),
+             'others':[[str(other_shapes[i]), other_xy[i*2], other_xy[i*2+1]] for i in range(n_others)],
+             'other_materials':[[other_material_names[other_materials[i]-1], other_rotations[other_rotation_codes[i]]] for i in range(n_others)],
+             'pigs':[[pig_xy[i*2], pig_xy[i*2+1]] for i in range(n_pigs)],
+             'tnt':[[tnt_xy[i*2], tnt_xy[i*2+1]] for i in range(n_tnt)],
+             'platforms':platforms,
+             'angled_platforms':[list(angled_values[i*4:i*4+4]) for i in range(n_angled)],
+             'number_birds':n_birds,
+             'bird_order':list(bird_order)}
+    return level, name
+
+
+
+
+# creates a new batch file that level records can be appended to
+
+def start_level_batch(path):
+    f = open(path, 'wb')
+    f.write(batch_header)
+    return {'file':f, 'offsets':[], 'offset':len(batch_header)}
+
+
+
+
+# appends a packed level record to the batch file
+
+def append_to_level_batch(batch, record):
+    batch['file'].write(record_length.pack(len(record)))
+    batch['file'].write(record)
+    batch['offsets'].append(batch['offset'])
+    batch['offset'] = batch['offset'] + record_length.size + len(record)
+
+
+
+
+# writes the index of record offsets and closes the batch file
+
+def finish_level_batch(batch):
+    batch['file'].write(pack_values('Q', batch['offsets']))
+    batch['file'].write(batch_trailer.pack(len(batch['offsets']), b'IALX'))
+    batch['file'].close()
+
+
+
+
+# opens a batch file for reading (memory mapped), finding the offset of every level record
+# batches that were not finished (no index) are indexed by stepping through the record lengths
+
+def open_level_batch(path):
+    f = open(path, 'rb')
+    if os.path.getsize(path) == 0:
+        f.close()
+        raise ValueError("%s is not a level batch file" % path)
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[0:len(batch_header)] != batch_header:
+        data.close()
+        f.close()
+        raise ValueError("%s is not a level batch file" % path)
+
+    offsets = None
+    if len(data) >= len(batch_header) + batch_trailer.size:
+        number_levels, marker = batch_trailer.unpack_from(data, len(data) - batch_trailer.size)
+        index_start = len(data) - batch_trailer.size - (number_levels*8)
+        if marker == b'IALX' and index_start >= len(batch_header):
+            offsets = list(unpack_values('Q', data, index_start, number_levels)[0])
+    if offsets == None:
+        offsets = []
+        offset = len(batch_header)
+        while offset + record_length.size <= len(data):
+            length = record_length.unpack_from(data, offset)[0]
+            if offset + record_length.size + length > len(data):
+                break
+            offsets.append(offset)
+            offset = offset + record_length.size + length
+
+    return {'file':f, 'data':data, 'offsets':offsets}
+
+
+
+
+# reads level number n (starting at 0) from an open batch, returning the level and its name
+
+def read_batch_level(batch, n):
+    return unpack_level(batch['data'], batch['offsets'][n] + record_length.size)
+
+
+
+
+# reads every level in an open batch, returning a list of [level, name]
+
+def read_batch_levels(batch):
+    levels = []
+    for n in range(len(batch['offsets'])):
+        level, name = read_batch_level(batch, n)
+        levels.append([level, name])
+    return levels
+
+
+
+
+def close_level_batch(batch):
+    batch['data'].close()
+    batch['file'].close()
+
+
+
+
+# converts every level in a batch file to xml, written to the given sink
+
+def batch_to_xml(path, sink, level_to_xml):
+    from level_sinks import write_to_sink
+    batch = open_level_batch(path)
+    for n in range(len(batch['offsets'])):
+        level, name = read_batch_level(batch, n)
+        write_to_sink(sink, name, level_to_xml(level))
+    close_level_batch(batch)
+
+
+
+
+# converts binary level batches to xml files (python level_binary.py levels.bin --output xml_levels)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert binary level batch files to Science-Birds xml levels.")
+    parser.add_argument("batches", nargs="+", help="binary level batch files")
+    parser.add_argument("--output", default=".", help="directory the xml levels are written to")
+    parser.add_argument("--full-precision", action="store_true", help="write coordinates with full float precision")
+    args = parser.parse_args()
+
+    import generator_competition
+    from level_sinks import open_sink, close_sink
+    if args.full_precision:
+        generator_competition.coordinate_precision = None
+    sink = open_sink('directory', args.output)
+    for path in args.batches:
+        batch_to_xml(path, sink, generator_competition.level_to_xml)
+    close_sink(sink)
+
+
+if __name__ == "__main__":
+    main()
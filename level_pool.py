@@ -0,0 +1,180 @@
+
+import queue
+import threading
+from collections import OrderedDict, deque
+
+# pools of ready generated levels, one per level config, so that requests for a config seen before are answered without waiting
+#
+# each config (restricted combinations, pig range, time limit and format, see level_config_key) keeps up to pool_size ready levels
+# when a level is taken (or a config is first asked for) background threads refill its pool using generate(request),
+# which must return a new level entry [data, ...] (data being the level's bytes, used to count the pool's memory)
+# once the levels held use more than memory_cap bytes the least recently used configs are dropped
+#
+#   pool = start_level_pool(generate, pool_size=4, memory_cap=64*1024*1024)
+#   entry = take_pooled_level(pool, request)        # None if there is no ready level (a miss), the pool is refilled either way
+#   stop_level_pool(pool)
+
+
+
+
+# the key that levels are pooled under, requests with the same key are given levels from the same pool
+
+def level_config_key(request):
+    restricted_combinations = tuple(sorted([tuple(combination) for combination in request['restricted_combinations']]))
+    return (restricted_combinations, tuple(request['pig_range']), request['time_limit'], request['format'])
+
+
+
+
+# starts the refill threads of a new, empty level pool
+
+def start_level_pool(generate, pool_size, memory_cap, refill_threads=1):
+    pool = {'generate':generate, 'size':pool_size, 'memory_cap':memory_cap, 'configs':OrderedDict(), 'bytes':0,
+            'lock':threading.Lock(), 'refill_queue':queue.Queue(), 'threads':[], 'stopped':False,
+            'stats':{'hits':0, 'misses':0, 'generated':0, 'evicted_configs':0, 'dropped_levels':0, 'errors':0}}
+    for i in range(refill_threads):
+        thread = threading.Thread(target=refill_thread, args=(pool,), daemon=True)
+        thread.start()
+        pool['threads'].append(thread)
+    return pool
+
+
+
+
+# takes a ready level for the request's config from the pool (None if there isn't one) and starts refilling the config's pool
+
+def take_pooled_level(pool, request):
+    key = level_config_key(request)
+    entry = None
+    pool['lock'].acquire()
+    try:
+        config = pool['configs'].get(key)
+        if config == None:
+            config = {'request':request, 'levels':deque(), 'bytes':0, 'refilling':False}
+            pool['configs'][key] = config
+        pool['configs'].move_to_end(key)            # most recently used configs are kept last
+
+        if len(config['levels']) > 0:
+            entry = config['levels'].popleft()
+            config['bytes'] = config['bytes'] - len(entry[0])
+            pool['bytes'] = pool['bytes'] - len(entry[0])
+            pool['stats']['hits'] = pool['stats']['hits'] + 1
+        else:
+            pool['stats']['misses'] = pool['stats']['misses'] + 1
+
+        if config['refilling'] == False and len(config['levels']) < pool['size']:
+            config['refilling'] = True
+            pool['refill_queue'].put(key)
+    finally:
+        pool['lock'].release()
+    return entry
+
+
+
+
+# generates levels for the configs waiting to be refilled, until each has pool_size levels (or has been dropped)
+
+def refill_thread(pool):
+    while True:
+        key = pool['refill_queue'].get()
+        if key == None:
+            return
+        while True:
+            pool['lock'].acquire()
+            try:
+                config = pool['configs'].get(key)
+                if config == None:
+                    break
+                if pool['stopped'] or len(config['levels']) >= pool['size']:
+                    config['refilling'] = False
+                    break
+                request = config['request']
+            finally:
+                pool['lock'].release()
+
+            try:
+                entry = pool['generate'](request)
+            except Exception:
+                pool['lock'].acquire()
+                pool['stats']['errors'] = pool['stats']['errors'] + 1
+                config['refilling'] = False
+                pool['lock'].release()
+                break
+
+            pool['lock'].acquire()
+            try:
+                pool['stats']['generated'] = pool['stats']['generated'] + 1
+                refill = False
+                if pool['configs'].get(key) is config:
+                    config['levels'].append(entry)
+                    config['bytes'] = config['bytes'] + len(entry[0])
+                    pool['bytes'] = pool['bytes'] + len(entry[0])
+                    refill = evict_configs(pool, key)
+                    if refill == False:
+                        config['refilling'] = False
+            finally:
+                pool['lock'].release()
+            if refill == False:
+                break
+
+
+
+
+# drops the least recently used configs (other than the one just refilled) until the pool is within its memory cap
+# if the refilled config alone is over the cap its newest level is dropped instead, returning False as it shouldn't be refilled further
+# (called with the pool's lock held)
+
+def evict_configs(pool, refilled_key):
+    while pool['bytes'] > pool['memory_cap']:
+        evict_key = None
+        for key in pool['configs']:
+            if key != refilled_key:
+                evict_key = key
+                break
+        if evict_key != None:
+            config = pool['configs'].pop(evict_key)
+            pool['bytes'] = pool['bytes'] - config['bytes']
+            pool['stats']['evicted_configs'] = pool['stats']['evicted_configs'] + 1
+        else:
+            config = pool['configs'][refilled_key]
+            entry = config['levels'].pop()
+            config['bytes'] = config['bytes'] - len(entry[0])
+            pool['bytes'] = pool['bytes'] - len(entry[0])
+            pool['stats']['dropped_levels'] = pool['stats']['dropped_levels'] + 1
+            return False
+    return True
+
+
+
+
+# hit/miss counts and the number of configs, levels and bytes the pool holds
+
+def level_pool_stats(pool):
+    pool['lock'].acquire()
+    try:
+        stats = dict(pool['stats'])
+        stats['configs'] = len(pool['configs'])
+        stats['levels'] = sum([len(config['levels']) for config in pool['configs'].values()])
+        stats['bytes'] = pool['bytes']
+    finally:
+        pool['lock'].release()
+    requests = stats['hits'] + stats['misses']
+    if requests > 0:
+        stats['hit_rate'] = stats['hits']/float(requests)
+    else:
+        stats['hit_rate'] = None
+    return stats
+
+
+
+
+# stops the refill threads (each finishes the level it is generating)
+
+def stop_level_pool(pool):
+    pool['lock'].acquire()
+    pool['stopped'] = True
+    pool['lock'].release()
+    for thread in pool['threads']:
+        pool['refill_queue'].put(None)
+    for thread in pool['threads']:
+        thread.join()
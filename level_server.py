@@ -0,0 +1,308 @@
+
+import argparse
+import json
+import os
+import random
+import signal
+import socketserver
+import sys
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from random import randint
+from time import perf_counter
+
+import generator_competition as generator
+from level_binary import pack_level
+from level_pool import start_level_pool, take_pooled_level, level_pool_stats, stop_level_pool
+
+# long running level generation service, so that requests don't pay for starting python and the generator each time
+# (python level_server.py --port 8765 --workers 4, or --socket /tmp/levels.sock for a unix socket)
+#
+# POST /level with a json config returns one generated level:
+#   {"restricted_combinations": "wood RectMedium,ice Circle",    (as in parameters.txt, or a list of [material, block] pairs)
+#    "pig_range": [3, 5], "time_limit": 30, "seed": 12, "format": "xml"}     (format is xml or binary, see level_binary.py)
+# every field is optional, the seed used is returned in the X-Level-Seed header (the same config and seed give the same level)
+# GET /stats returns the number of requests served and recent latencies
+#
+# levels are generated by a pool of worker processes that are started once and kept warm,
+# each keeping the generator's shot trajectories and the probability tables of the restrictions it has seen
+# with --pool-size requests without a seed are answered from a pool of levels generated in advance for their config (see level_pool.py),
+# X-Level-Pool says whether the level came from the pool (hit) or had to be generated (miss)
+
+default_pig_range = [3, 5]
+default_time_limit = 30         # minutes, as in parameters.txt
+latency_window = 1000           # number of recent requests that latency percentiles are taken over
+
+worker_pool = None
+level_pool = None
+server_stats = {'requests':0, 'errors':0, 'latencies':deque(maxlen=latency_window), 'lock':threading.Lock()}
+
+
+
+
+# prepares a worker process (the generator's progress messages are discarded and its caches filled)
+
+def warm_worker():
+    sys.stdout = open(os.devnull, 'w')
+    generator.find_shot_trajectories()
+    generator.find_shot_parabolas()
+    generator.apply_restrictions([])
+
+
+
+
+# generates the level described by a checked request (in a worker process), returning its data and the seconds taken
+
+def generate_requested_level(request):
+    start = perf_counter()
+    random.seed(request['seed'])
+    generator.number_ground_structures = randint(2,4)
+    generator.number_platforms = randint(1,3)
+
+    parameter_block = [1, request['restricted_combinations'], request['pig_range'], request['time_limit']]
+    for level_name, level in generator.generate_block_levels(parameter_block):
+        if request['format'] == 'binary':
+            data = pack_level(level, "level-%s.xml" % level_name)
+        else:
+            data = generator.level_to_xml(level).encode('utf-8')
+    return data, perf_counter() - start
+
+
+
+
+# checks a level request (the json body of POST /level), filling in defaults, raises ValueError if it isn't valid
+
+def read_level_request(body):
+    try:
+        config = json.loads(body.decode('utf-8') or '{}')
+    except ValueError:
+        raise ValueError("request body is not valid json")
+    if not isinstance(config, dict):
+        raise ValueError("request must be a json object")
+
+    restricted_combinations = config.get('restricted_combinations', [])
+    if isinstance(restricted_combinations, str):
+        restricted_combinations = [combination.split() for combination in restricted_combinations.split(',')]
+    if not isinstance(restricted_combinations, list):
+        raise ValueError("restricted_combinations must be a string or a list of [material, block] pairs")
+    for combination in restricted_combinations:
+        if not isinstance(combination, list):
+            raise ValueError("restricted_combinations must be a string or a list of [material, block] pairs")
+    restricted_combinations = [combination for combination in restricted_combinations if len(combination) > 0]
+    for combination in restricted_combinations:
+        if ( len(combination) != 2 or combination[0] not in generator.materials.values() or
+             (combination[1] not in generator.block_names.values() and combination[1] not in generator.additional_objects.values()) ):
+            raise ValueError("unknown restricted combination: %s" % ' '.join([str(x) for x in combination]))
+
+    pig_range = config.get('pig_range', default_pig_range)
+    if ( not isinstance(pig_range, list) or len(pig_range) != 2 or not is_integer(pig_range[0]) or not is_integer(pig_range[1]) or
+         pig_range[0] < 1 or pig_range[1] < pig_range[0] ):
+        raise ValueError("pig_range must be [minimum, maximum] with 1 <= minimum <= maximum")
+
+    seed = config.get('seed')
+    if seed != None and not is_integer(seed):
+        raise ValueError("seed must be an integer")
+
+    time_limit = config.get('time_limit', default_time_limit)
+    if isinstance(time_limit, bool) or not isinstance(time_limit, (int, float)) or time_limit <= 0:
+        raise ValueError("time_limit must be a positive number of minutes")
+
+    level_format = config.get('format', 'xml')
+    if level_format not in ('xml', 'binary'):
+        raise ValueError("format must be xml or binary")
+
+    return {'restricted_combinations':restricted_combinations, 'pig_range':[pig_range[0], pig_range[1]],
+            'time_limit':float(time_limit), 'seed':seed, 'format':level_format}
+
+
+
+
+# checks for a json integer (json true and false are read as bools, which python counts as ints)
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+
+
+# a new random seed, for requests that don't give one
+
+def new_seed():
+    return random.SystemRandom().randrange(2**32)
+
+
+
+
+# generates a level for the level pool, returning [level data, seed, generation seconds]
+
+def generate_pool_level(request):
+    request = dict(request)
+    request['seed'] = new_seed()
+    data, seconds = worker_pool.apply(generate_requested_level, (request,))
+    return [data, request['seed'], seconds]
+
+
+
+
+# records the latency of a served request
+
+def record_request(seconds, failed):
+    server_stats['lock'].acquire()
+    try:
+        server_stats['requests'] = server_stats['requests'] + 1
+        if failed:
+            server_stats['errors'] = server_stats['errors'] + 1
+        else:
+            server_stats['latencies'].append(seconds)
+    finally:
+        server_stats['lock'].release()
+
+
+
+
+# the number of requests served and percentiles of the recent latencies (in seconds)
+
+def current_stats():
+    server_stats['lock'].acquire()
+    try:
+        latencies = sorted(server_stats['latencies'])
+        stats = {'requests':server_stats['requests'], 'errors':server_stats['errors']}
+    finally:
+        server_stats['lock'].release()
+    for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        if latencies != []:
+            stats[name] = latencies[min(len(latencies)-1, int(fraction*len(latencies)))]
+        else:
+            stats[name] = None
+    return stats
+
+
+
+
+# handles the http requests (each request is handled in its own thread, which waits for a worker to generate the level)
+
+class LevelRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/stats':
+            stats = current_stats()
+            if level_pool != None:
+                stats['pool'] = level_pool_stats(level_pool)
+            self.send_data(200, 'application/json', json.dumps(stats).encode('utf-8'))
+        else:
+            self.send_data(404, 'text/plain', b"not found\n")
+
+    def do_POST(self):
+        if self.path != '/level':
+            self.send_data(404, 'text/plain', b"not found\n")
+            return
+        start = perf_counter()
+        try:
+            request = read_level_request(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as error:
+            record_request(0.0, True)
+            self.send_data(400, 'text/plain', (str(error) + "\n").encode('utf-8'))
+            return
+        headers = {}
+        pooled = None
+        if level_pool != None and request['seed'] == None:
+            pooled = take_pooled_level(level_pool, request)
+            if pooled != None:
+                headers['X-Level-Pool'] = 'hit'
+            else:
+                headers['X-Level-Pool'] = 'miss'
+        if pooled != None:
+            data, seed, seconds = pooled
+        else:
+            if request['seed'] == None:
+                request['seed'] = new_seed()
+            seed = request['seed']
+            try:
+                data, seconds = worker_pool.apply(generate_requested_level, (request,))
+            except Exception as error:
+                record_request(0.0, True)
+                self.send_data(500, 'text/plain', ("level generation failed: %r\n" % error).encode('utf-8'))
+                return
+        record_request(perf_counter() - start, False)
+        if request['format'] == 'binary':
+            content_type = 'application/octet-stream'
+        else:
+            content_type = 'application/xml'
+        headers['X-Level-Seed'] = str(seed)
+        headers['X-Generation-Seconds'] = "%.3f" % seconds
+        self.send_data(200, content_type, data, headers)
+
+    def send_data(self, status, content_type, data, headers={}):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass                    # requests aren't logged (unix socket clients have no address to log)
+
+
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+
+
+# stops the server when it is asked to terminate (the same as interrupting it)
+
+def stop_on_signal(signal_number, frame):
+    raise KeyboardInterrupt()
+
+
+
+
+def main():
+    global worker_pool, level_pool
+    parser = argparse.ArgumentParser(description="Serve generated levels over http (on a local port or a unix socket) from a pool of warm worker processes.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--socket", default=None, help="listen on this unix socket instead of a port")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes generating levels")
+    parser.add_argument("--pool-size", type=int, default=0, help="number of levels generated in advance for each config requested (0 turns the level pool off)")
+    parser.add_argument("--pool-memory", type=float, default=64.0, help="megabytes of pooled levels kept before the least recently used configs are dropped")
+    parser.add_argument("--pool-threads", type=int, default=1, help="number of levels generated at the same time to refill the level pool")
+    args = parser.parse_args()
+
+    worker_pool = Pool(args.workers, initializer=warm_worker)
+    if args.pool_size > 0:
+        level_pool = start_level_pool(generate_pool_level, args.pool_size, int(args.pool_memory*1024*1024), args.pool_threads)
+    if args.socket != None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, LevelRequestHandler)
+        print("serving levels on unix socket " + args.socket)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), LevelRequestHandler)
+        server.daemon_threads = True
+        print("serving levels on http://%s:%d" % (args.host, args.port))
+    sys.stdout.flush()
+
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if level_pool != None:
+            stop_level_pool(level_pool)
+        worker_pool.terminate()
+        worker_pool.join()
+        if args.socket != None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
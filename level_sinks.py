@@ -0,0 +1,197 @@
+
+import gzip
+import io
+import json
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+
+from level_binary import start_level_batch, append_to_level_batch, finish_level_batch
+
+# output sinks that generated levels are written to
+# directory: one file per level (level-xx.xml, or level-xx.xml.gz if compressed)
+# zip/tar:   all levels in a single archive
+# stream:    one json object per line ({"name": ..., "level": ...}) plus an index file (stream path + ".idx")
+#            holding the byte offset and length of each line, so that any level can be read without scanning the stream
+# binary:    packed level records in a single batch file (see level_binary.py), written data must be packed records
+
+sink_types = ['directory', 'zip', 'tar', 'stream', 'binary']
+default_sink_paths = {'directory':'.', 'zip':'levels.zip', 'tar':'levels.tar', 'stream':'levels.jsonl', 'binary':'levels.bin'}
+
+
+
+
+# opens a sink of the given type at path
+
+def open_sink(sink_type, path, compress=False):
+    if sink_type == 'directory':
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return {'type':sink_type, 'path':path, 'compress':compress}
+    if sink_type == 'zip':
+        if compress == True:
+            archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+        return {'type':sink_type, 'path':path, 'compress':compress, 'archive':archive}
+    if sink_type == 'tar':
+        if compress == True:
+            archive = tarfile.open(path, 'w:gz')
+        else:
+            archive = tarfile.open(path, 'w')
+        return {'type':sink_type, 'path':path, 'compress':compress, 'archive':archive}
+    if sink_type == 'stream':
+        stream = open(path, 'wb')
+        index = open(path + '.idx', 'w')
+        return {'type':sink_type, 'path':path, 'compress':compress, 'stream':stream, 'index':index, 'offset':0}
+    if sink_type == 'binary':
+        return {'type':sink_type, 'path':path, 'compress':compress, 'batch':start_level_batch(path)}
+    raise ValueError("unknown sink type: %s" % sink_type)
+
+
+
+
+# writes the level text (or packed record for binary sinks) under the given name (eg. level-04.xml) to the sink
+
+def write_to_sink(sink, name, level_text):
+    if sink['type'] == 'directory':
+        if sink['compress'] == True:
+            f = gzip.open(os.path.join(sink['path'], name + '.gz'), 'wb')
+            f.write(level_text.encode())
+        else:
+            f = open(os.path.join(sink['path'], name), 'w')
+            f.write(level_text)
+        f.close()
+
+    elif sink['type'] == 'zip':
+        sink['archive'].writestr(name, level_text)
+
+    elif sink['type'] == 'tar':
+        data = level_text.encode()
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        sink['archive'].addfile(info, io.BytesIO(data))
+
+    elif sink['type'] == 'stream':
+        record = (json.dumps({'name':name, 'level':level_text}) + '\n').encode()
+        sink['stream'].write(record)
+        sink['index'].write('%d %d %s\n' % (sink['offset'], len(record), name))
+        sink['offset'] = sink['offset'] + len(record)
+
+    elif sink['type'] == 'binary':
+        append_to_level_batch(sink['batch'], level_text)
+
+
+
+
+# flushes and closes the sink
+
+def close_sink(sink):
+    if sink['type'] == 'zip' or sink['type'] == 'tar':
+        sink['archive'].close()
+    elif sink['type'] == 'stream':
+        sink['stream'].close()
+        sink['index'].close()
+    elif sink['type'] == 'binary':
+        finish_level_batch(sink['batch'])
+
+
+
+
+# reads the index of a stream sink, returning [offset, length, name] for each level in the order written
+
+def read_stream_index(path):
+    index = []
+    f = open(path + '.idx', 'r')
+    for line in f:
+        offset, length, name = line.split(' ', 2)
+        index.append([int(offset), int(length), name.rstrip('\n')])
+    f.close()
+    return index
+
+
+
+
+# reads level number n (starting at 0) from a stream sink, returning its name and text
+
+def read_stream_level(path, n, index=None):
+    if index == None:
+        index = read_stream_index(path)
+    offset, length, name = index[n]
+    f = open(path, 'rb')
+    f.seek(offset)
+    record = json.loads(f.read(length).decode())
+    f.close()
+    return record['name'], record['level']
+
+
+
+
+# starts background threads that write levels to the sink while generation continues
+# levels are handed over through a bounded queue (generation waits when it is full) and converted with serialize(level, name, sink)
+# a level can be handed over with a function that is then called with the seconds taken to convert and write it
+
+def start_writer(sink, serialize, number_threads=1, queue_size=4):
+    writer = {'sink':sink, 'serialize':serialize, 'queue':queue.Queue(queue_size), 'lock':threading.Lock(), 'errors':[], 'threads':[]}
+    for i in range(number_threads):
+        thread = threading.Thread(target=writer_thread, args=(writer,), daemon=True)
+        thread.start()
+        writer['threads'].append(thread)
+    return writer
+
+def writer_thread(writer):
+    while True:
+        item = writer['queue'].get()
+        if item == None:
+            writer['queue'].task_done()
+            return
+        try:
+            if writer['errors'] == []:
+                start = time.perf_counter()
+                level_text = writer['serialize'](item[1], item[0], writer['sink'])
+                if writer['sink']['type'] == 'directory':           # separate files can be written at the same time
+                    write_to_sink(writer['sink'], item[0], level_text)
+                    seconds = time.perf_counter() - start
+                else:
+                    seconds = time.perf_counter() - start
+                    writer['lock'].acquire()
+                    try:
+                        start = time.perf_counter()                 # time spent waiting for another thread's write isn't counted
+                        write_to_sink(writer['sink'], item[0], level_text)
+                        seconds = seconds + (time.perf_counter() - start)
+                    finally:
+                        writer['lock'].release()
+                if item[2] != None:
+                    item[2](seconds)
+        except Exception as error:
+            writer['errors'].append(error)
+        writer['queue'].task_done()
+
+
+
+
+# hands a finished level to the writer threads (waits if the queue is full)
+# on_written (if given) is called from the writer thread with the seconds taken to convert and write the level
+# raises any error from an earlier write, so failures are not silently lost
+
+def submit_to_writer(writer, name, level, on_written=None):
+    if writer['errors'] != []:
+        raise writer['errors'][0]
+    writer['queue'].put([name, level, on_written])
+
+
+
+
+# waits for all queued levels to be written and stops the writer threads
+
+def stop_writer(writer):
+    for thread in writer['threads']:
+        writer['queue'].put(None)
+    for thread in writer['threads']:
+        thread.join()
+    if writer['errors'] != []:
+        raise writer['errors'][0]
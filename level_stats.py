@@ -0,0 +1,432 @@
+
+import copy
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import tracemalloc
+from time import perf_counter
+
+# optional per-stage timing of level generation (switched on with enable_stage_timing, eg. by --stage-times)
+# while enabled every stage run through timed_stage is timed and one json record per level is written:
+#   {"level": "04", "total": seconds, "stages": {"create_ground_structures": seconds, ...}, "counts": {"blocks": ..., ...}}
+# while disabled timed_stage just calls the stage, so the only cost is one check per stage
+# a level written by a background writer thread has its write_level_xml stage timed in that thread (see level_write_timer),
+# and its record is written once the write has finished (so records can be written out of level order)
+#
+# optional work counting (switched on with enable_work_counting, eg. by --work-counts) counts retries of the rejection loops,
+# overlap checks and calls to the counted geometry functions, writing one json record per level ({"level": "04", "work": {...}})
+# and a final record with the totals for the whole run ({"run": {...}, "levels": n})
+#
+# optional profiling (switched on with enable_level_profiling, eg. by --profile-dir) runs each level under cProfile
+# and keeps the profile only if the level took longer than the threshold, writing to the profile directory:
+#   level-04.pstats (for pstats/snakeviz), level-04.folded (collapsed stacks for flamegraph.pl/speedscope)
+#   and level-04.json (time taken, level config and the random state at the start of the level, to reproduce it)
+#
+# optional memory accounting (switched on with enable_memory_tracing, eg. by --memory) traces allocations with tracemalloc
+# and writes one json record per level: for each stage the bytes still allocated when it finished and its peak (both
+# relative to the start of the stage), the peak for the whole level, and the allocation sites (file:line) holding the
+# most memory at the end of any stage compared with the start of the level
+# (allocations made inside deepcopy are reported at the line that called deepcopy)
+# work done between stages (eg. the copies made in generate_level) is recorded as "before <next stage>"
+# tracing every allocation makes generation many times slower (the trajectory checks allocate heavily), so only trace a few levels
+
+stage_output = None         # file the level records are written to (None when timing is disabled)
+close_stage_output = False  # whether the file was opened here (and so should be closed when timing is disabled)
+level_record = None         # record for the level currently being generated (None when timing is disabled)
+record_lock = threading.Lock()  # held while a level record is finished, as writer threads finish the records of the levels they write
+
+work_output = None          # file the work counts are written to (None when work counting is disabled)
+close_work_output = False
+work_counts = None          # work counts for the level currently being generated (None when work counting is disabled)
+run_work_counts = {}        # work counts summed over all levels since work counting was enabled
+run_levels = 0
+
+profile_directory = None    # directory slow level profiles are written to (None when profiling is disabled)
+profile_threshold = 0.0     # levels taking longer than this (seconds) keep their profile
+level_profile = None        # [profiler, start time, level config, random state] for the level currently being generated
+
+memory_output = None        # file the memory records are written to (None when memory accounting is disabled)
+close_memory_output = False
+memory_top_sites = 10       # number of allocation sites reported per level
+memory_frames = 8           # frames traced per allocation (enough to see past deepcopy of the nested object lists)
+level_memory = None         # memory record for the level currently being generated (None when memory accounting is disabled)
+
+
+
+
+# switches stage timing on, writing records to the given file path or open file
+
+def enable_stage_timing(output):
+    global stage_output, close_stage_output
+    disable_stage_timing()
+    if isinstance(output, str):
+        stage_output = open(output, 'w')
+        close_stage_output = True
+    else:
+        stage_output = output
+        close_stage_output = False
+
+
+
+
+# switches stage timing off (the record of a level still being generated or written is dropped)
+
+def disable_stage_timing():
+    global stage_output, close_stage_output, level_record
+    record_lock.acquire()
+    try:
+        if stage_output != None and close_stage_output == True:
+            stage_output.close()
+        stage_output = None
+        close_stage_output = False
+    finally:
+        record_lock.release()
+    level_record = None
+
+
+
+
+# switches work counting on, writing records to the given file path or open file
+
+def enable_work_counting(output):
+    global work_output, close_work_output, run_work_counts, run_levels
+    disable_work_counting()
+    if isinstance(output, str):
+        work_output = open(output, 'w')
+        close_work_output = True
+    else:
+        work_output = output
+        close_work_output = False
+    run_work_counts = {}
+    run_levels = 0
+
+
+
+
+# switches work counting off, writing the totals for the run if any levels were counted
+
+def disable_work_counting():
+    global work_output, close_work_output, work_counts
+    if work_output != None:
+        if run_levels > 0:
+            work_output.write(json.dumps({'run':run_work_counts, 'levels':run_levels}) + '\n')
+        if close_work_output == True:
+            work_output.close()
+        else:
+            work_output.flush()
+    work_output = None
+    close_work_output = False
+    work_counts = None
+
+
+
+
+# switches profiling on, keeping the profiles of levels slower than threshold seconds in the given directory
+
+def enable_level_profiling(directory, threshold):
+    global profile_directory, profile_threshold
+    disable_level_profiling()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    profile_directory = directory
+    profile_threshold = threshold
+
+
+
+
+# switches profiling off (the profile of a level still being generated is dropped)
+
+def disable_level_profiling():
+    global profile_directory, level_profile
+    if level_profile != None:
+        level_profile[0].disable()
+    profile_directory = None
+    level_profile = None
+
+
+
+
+# switches memory accounting on (starting tracemalloc), writing records to the given file path or open file
+
+def enable_memory_tracing(output, top_sites=10):
+    global memory_output, close_memory_output, memory_top_sites
+    disable_memory_tracing()
+    if isinstance(output, str):
+        memory_output = open(output, 'w')
+        close_memory_output = True
+    else:
+        memory_output = output
+        close_memory_output = False
+    memory_top_sites = top_sites
+    tracemalloc.start(memory_frames)
+
+
+
+
+# switches memory accounting off (the record of a level still being generated is dropped)
+
+def disable_memory_tracing():
+    global memory_output, close_memory_output, level_memory
+    if memory_output != None:
+        tracemalloc.stop()
+        if close_memory_output == True:
+            memory_output.close()
+        else:
+            memory_output.flush()
+    memory_output = None
+    close_memory_output = False
+    level_memory = None
+
+
+
+
+# takes a snapshot of the traced allocations, leaving out those made by tracemalloc and these records
+
+def take_memory_snapshot():
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+
+
+
+
+# records the memory used by a stage (since the last stage finished) and the allocation sites holding memory after it
+# the sites are found first, and the baseline for the next stage is only taken once the snapshots compared for them have been freed
+
+def record_stage_memory(name):
+    start_memory = level_memory['last']
+    current, peak = tracemalloc.get_traced_memory()
+    stage = level_memory['stages'].setdefault(name, {'allocated':0, 'peak':0})
+    stage['allocated'] = stage['allocated'] + (current - start_memory)
+    stage['peak'] = max(stage['peak'], peak - start_memory)
+    level_memory['peak'] = max(level_memory['peak'], peak - level_memory['start'])
+
+    record_stage_sites(name)
+    tracemalloc.reset_peak()
+    level_memory['last'] = tracemalloc.get_traced_memory()[0]
+
+def record_stage_sites(name):
+    sites = {}
+    for difference in take_memory_snapshot().compare_to(level_memory['snapshot'], 'traceback'):
+        if difference.size_diff > 0:
+            frame = difference.traceback[-1]
+            for caller in reversed(difference.traceback):
+                if caller.filename != copy.__file__:
+                    frame = caller
+                    break
+            site = '%s:%d' % (os.path.basename(frame.filename), frame.lineno)
+            size, count = sites.get(site, [0, 0])
+            sites[site] = [size + difference.size_diff, count + difference.count_diff]
+    for site,(size, count) in sites.items():
+        if site not in level_memory['sites'] or size > level_memory['sites'][site][0]:
+            level_memory['sites'][site] = [size, count, name]
+
+
+
+
+# starts the records for a new level (does nothing if timing, work counting, profiling and memory accounting are disabled)
+# level_config describes how the level is generated (parameters, number of pigs, ...) and is saved with slow level profiles
+
+def start_level_record(level_config=None):
+    global level_record, work_counts, level_profile, level_memory
+    if stage_output != None:
+        level_record = {'stages':{}, 'counts':{}, 'start':perf_counter(), 'level':None, 'total':None, 'pending_writes':0, 'write_time':0.0}
+    if work_output != None:
+        work_counts = {}
+    if profile_directory != None:
+        level_profile = [cProfile.Profile(), perf_counter(), level_config, random.getstate()]
+        level_profile[0].enable()
+    if memory_output != None:
+        snapshot = take_memory_snapshot()
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        level_memory = {'stages':{}, 'peak':0, 'start':start_memory, 'last':start_memory, 'snapshot':snapshot, 'sites':{}}
+
+
+
+
+# runs function(*args) as the named stage, adding its time (and memory use) to the current level records
+
+def timed_stage(name, function, *args):
+    if level_record == None and level_memory == None:
+        return function(*args)
+    if level_memory != None:
+        record_stage_memory('before ' + name)
+    start = perf_counter()
+    result = function(*args)
+    if level_record != None:
+        stages = level_record['stages']
+        stages[name] = stages.get(name, 0.0) + (perf_counter() - start)
+    if level_memory != None:
+        record_stage_memory(name)
+    return result
+
+
+
+
+# returns a function for a writer thread to call with the seconds it took to write the current level out (None when timing is disabled)
+# the time is added to the level's record as its write_level_xml stage, and the record is kept back until the write has finished
+
+def level_write_timer():
+    if level_record == None:
+        return None
+    record = level_record
+    record['pending_writes'] = record['pending_writes'] + 1
+    def written(seconds):
+        record_lock.acquire()
+        try:
+            record['stages']['write_level_xml'] = record['stages'].get('write_level_xml', 0.0) + seconds
+            record['write_time'] = record['write_time'] + seconds
+            record['pending_writes'] = record['pending_writes'] - 1
+            write_stage_record(record)
+        finally:
+            record_lock.release()
+    return written
+
+
+
+
+# writes a level's stage record out once the level is finished and any writes of it by writer threads have been timed
+# (the total includes the time taken to write the level, in whichever thread it was written; called with record_lock held)
+
+def write_stage_record(record):
+    if record['total'] == None or record['pending_writes'] > 0 or stage_output == None:
+        return
+    stage_output.write(json.dumps({'level':record['level'], 'total':record['total'] + record['write_time'], 'stages':record['stages'], 'counts':record['counts']}) + '\n')
+    stage_output.flush()
+
+
+
+
+# adds object counts to the current level record
+
+def record_counts(**counts):
+    if level_record != None:
+        level_record['counts'].update(counts)
+
+
+
+
+# adds amount to the named work count of the current level
+
+def count_work(name, amount=1):
+    if work_counts != None:
+        work_counts[name] = work_counts.get(name, 0) + amount
+
+
+
+
+# returns a version of function that counts its calls under the given name (for swapping in while work counting is enabled)
+
+def counting_function(name, function):
+    def counted(*args):
+        if work_counts != None:
+            work_counts[name] = work_counts.get(name, 0) + 1
+        return function(*args)
+    return counted
+
+
+
+
+# returns the name used for a profiled function in collapsed stacks
+
+def profile_function_name(function):
+    file_name, line, name = function
+    if file_name == '~':
+        return name
+    return '%s (%s:%d)' % (name, os.path.basename(file_name), line)
+
+
+
+
+# converts profile stats into collapsed stack lines ("outer;inner;innermost microseconds")
+# cProfile only records caller/callee pairs, so each function's time is shared between its callers in proportion to the time spent under each
+
+def collapsed_stacks(stats):
+    callees = {}
+    roots = []
+    for function,(cc, nc, tt, ct, callers) in stats.stats.items():
+        if callers == {}:
+            roots.append(function)
+        for caller,(caller_cc, caller_nc, caller_tt, caller_ct) in callers.items():
+            callees.setdefault(caller, []).append([function, caller_ct])
+
+    stack_times = {}
+    to_visit = []
+    for function in roots:
+        to_visit.append([function, [function], stats.stats[function][3]])
+    while to_visit != []:
+        function, path, time_spent = to_visit.pop()
+        total_time = stats.stats[function][3]
+        fraction = 1.0
+        if total_time > 0:
+            fraction = min(1.0, time_spent/total_time)
+        stack = ';'.join([profile_function_name(f) for f in path])
+        stack_times[stack] = stack_times.get(stack, 0.0) + stats.stats[function][2]*fraction
+        for callee, callee_time in callees.get(function, []):
+            if callee not in path:
+                to_visit.append([callee, path + [callee], callee_time*fraction])
+
+    lines = []
+    for stack,time_spent in sorted(stack_times.items()):
+        microseconds = int(time_spent*1000000)
+        if microseconds > 0:
+            lines.append('%s %d' % (stack, microseconds))
+    return '\n'.join(lines) + '\n'
+
+
+
+
+# stops profiling the current level, writing its profile out if the level was slower than the threshold
+
+def finish_level_profile(level_name):
+    global level_profile
+    profiler, start, level_config, random_state = level_profile
+    profiler.disable()
+    level_profile = None
+    seconds = perf_counter() - start
+    if seconds <= profile_threshold:
+        return
+
+    path = os.path.join(profile_directory, 'level-%s' % level_name)
+    profiler.dump_stats(path + '.pstats')
+    f = open(path + '.folded', 'w')
+    f.write(collapsed_stacks(pstats.Stats(profiler)))
+    f.close()
+    f = open(path + '.json', 'w')
+    json.dump({'level':level_name, 'seconds':seconds, 'config':level_config, 'random_state':random_state}, f)
+    f.close()
+
+
+
+
+# writes the current level records out under the given level name
+
+def finish_level_record(level_name):
+    global level_record, work_counts, run_levels, level_memory
+    if level_profile != None:
+        finish_level_profile(level_name)
+    if level_memory != None:
+        top_sites = sorted(level_memory['sites'].items(), key=lambda x: -x[1][0])[0:memory_top_sites]
+        record = {'level':level_name, 'peak':level_memory['peak'], 'stages':level_memory['stages'],
+                  'top_sites':[{'site':site, 'size':size, 'count':count, 'stage':stage} for site,(size, count, stage) in top_sites]}
+        memory_output.write(json.dumps(record) + '\n')
+        memory_output.flush()
+        level_memory = None
+    if level_record != None:
+        record_lock.acquire()
+        try:
+            level_record['level'] = level_name
+            level_record['total'] = perf_counter() - level_record['start']
+            write_stage_record(level_record)
+        finally:
+            record_lock.release()
+        level_record = None
+    if work_counts != None:
+        work_output.write(json.dumps({'level':level_name, 'work':work_counts}) + '\n')
+        work_output.flush()
+        for name,count in work_counts.items():
+            run_work_counts[name] = run_work_counts.get(name, 0) + count
+        run_levels = run_levels + 1
+        work_counts = None
@@ -0,0 +1,146 @@
+
+import asyncio
+import queue
+import threading
+
+import generator_competition as generator
+
+# lazily generated levels, for consumers that want levels as a stream rather than as files
+# each level is given as its name and the level as returned by generate_level (the same data write_level_xml receives)
+#
+#   for level_name, level in iter_levels([10, [], ['2','4'], 30], prefetch=2):
+#       train_on(level)
+#
+# config is a parameter block as read from a parameters file by generator_competition.read_parameters
+# ([number of levels, restricted combinations, pig range, time limit])
+# with prefetch > 0 the levels are generated by a background thread, which keeps up to prefetch finished levels waiting
+# (so the consumer can work on one level while the next is built, but memory stays bounded)
+# a stream stops when cancel (a threading.Event) is set or when the consumer stops iterating, the level being built is finished first
+#
+# the generator keeps its state in module globals, so only one stream (or generate_levels run) should be generating at a time
+
+wait_interval = 0.1     # seconds between checks for cancellation while waiting on the queue
+
+
+
+
+# yields each level of the parameter block as [level name, level], generating them as they are needed (or prefetch levels ahead)
+
+def iter_levels(config, prefetch=0, cancel=None, first_level=4):
+    if prefetch == 0:
+        levels = generator.generate_block_levels(config, first_level)
+        try:
+            while cancel == None or not cancel.is_set():
+                item = next(levels, None)
+                if item == None:
+                    return
+                yield item
+        finally:
+            levels.close()
+        return
+
+    stream = start_level_stream(config, prefetch, cancel, first_level)
+    try:
+        while True:
+            item = next_stream_level(stream)
+            if item == None:
+                return
+            yield item
+    finally:
+        stop_level_stream(stream)
+
+
+
+
+# async version of iter_levels (async for level_name, level in aiter_levels(config)), levels are always generated in the background
+# cancelling the consuming task (or leaving the loop) stops the stream
+
+async def aiter_levels(config, prefetch=1, cancel=None, first_level=4):
+    loop = asyncio.get_running_loop()
+    stream = start_level_stream(config, max(prefetch, 1), cancel, first_level)
+    try:
+        while True:
+            item = await loop.run_in_executor(None, next_stream_level, stream)
+            if item == None:
+                return
+            yield item
+    finally:
+        stream['stop'].set()
+        await loop.run_in_executor(None, stop_level_stream, stream)
+
+
+
+
+# starts a background thread generating the levels of the parameter block into a queue holding at most depth levels
+
+def start_level_stream(config, depth, cancel, first_level):
+    stream = {'queue':queue.Queue(depth), 'stop':threading.Event(), 'cancel':cancel, 'finished':False, 'thread':None}
+    stream['thread'] = threading.Thread(target=level_stream_thread, args=(stream, config, first_level), daemon=True)
+    stream['thread'].start()
+    return stream
+
+def level_stream_thread(stream, config, first_level):
+    levels = generator.generate_block_levels(config, first_level)
+    try:
+        for level_name, level in levels:
+            if not put_stream_item(stream, ['level', level_name, level]):
+                return
+        put_stream_item(stream, ['end'])
+    except Exception as error:
+        put_stream_item(stream, ['error', error])
+    finally:
+        levels.close()
+
+
+
+
+# checks whether the stream has been stopped by its consumer or cancelled
+
+def stream_stopped(stream):
+    return stream['stop'].is_set() or (stream['cancel'] != None and stream['cancel'].is_set())
+
+
+
+
+# puts an item on the stream's queue, waiting while it is full (returns False if the stream was stopped while waiting)
+
+def put_stream_item(stream, item):
+    while not stream_stopped(stream):
+        try:
+            stream['queue'].put(item, timeout=wait_interval)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+
+
+# waits for the next level of the stream, returning [level name, level] (None once the stream has ended or been stopped)
+# raises any error from generating the level
+
+def next_stream_level(stream):
+    while not stream['finished']:
+        if stream_stopped(stream):
+            return None
+        try:
+            item = stream['queue'].get(timeout=wait_interval)
+        except queue.Empty:
+            continue
+        if item[0] == 'level':
+            return [item[1], item[2]]
+        stream['finished'] = True
+        if item[0] == 'error':
+            raise item[1]
+    return None
+
+
+
+
+# stops the stream, discarding any waiting levels, and waits for the level being built to finish
+
+def stop_level_stream(stream):
+    stream['stop'].set()
+    stream['thread'].join()
+    while not stream['queue'].empty():
+        stream['queue'].get()
@@ -0,0 +1,68 @@
+
+from math import sqrt
+
+# spatial proximity queries used when scoring TNT positions and clustering block materials
+# a kd-tree is built once from a list of [x,y] points and then answers radius counts,
+# sorted neighbour lists give the order in which points are reached moving out from a center
+
+slack = 0.000001        # extra distance allowed when deciding whether to search the far side of a split (prevents float errors)
+
+
+
+
+# builds a kd-tree from the given list of points
+
+def build_kd_tree(points):
+    root = build_kd_node(points, list(range(len(points))), 0)
+    return {'points':points, 'root':root}
+
+
+
+
+# recursively builds the tree node for the given point indices (splitting on the median of the given axis)
+# each node is [point index, axis, left node, right node]
+
+def build_kd_node(points, indices, axis):
+    if indices == []:
+        return None
+    indices.sort(key=lambda x: (points[x][axis], x))
+    middle = len(indices)//2
+    return [indices[middle], axis, build_kd_node(points, indices[:middle], 1-axis), build_kd_node(points, indices[middle+1:], 1-axis)]
+
+
+
+
+# counts the number of points that are less than radius away from center
+
+def count_within_radius(tree, center, radius):
+    points = tree['points']
+    count = 0
+    to_visit = [tree['root']]
+    while to_visit != []:
+        node = to_visit.pop()
+        if node == None:
+            continue
+        point = points[node[0]]
+        if sqrt(((point[0]-center[0])*(point[0]-center[0]))+((point[1]-center[1])*(point[1]-center[1]))) < radius:
+            count = count + 1
+        difference = center[node[1]] - point[node[1]]
+        if difference < 0:
+            to_visit.append(node[2])
+            if -difference <= radius + slack:
+                to_visit.append(node[3])
+        else:
+            to_visit.append(node[3])
+            if difference <= radius + slack:
+                to_visit.append(node[2])
+    return count
+
+
+
+
+# returns the indices of all points sorted by their distance from center (lowest index first if equally close)
+
+def sorted_neighbours(points, center):
+    distances = []
+    for point in points:
+        distances.append(sqrt(((point[0]-center[0])*(point[0]-center[0]))+((point[1]-center[1])*(point[1]-center[1]))))
+    return sorted(range(len(points)), key=lambda x: (distances[x], x))